@@ -0,0 +1,102 @@
+# benchmarks/bench_campaign_analytics.py
+# Tempo do campaign_analytics num banco sintético com muitas copies (padrão: 1M em 2000 campanhas):
+# criação dos índices, leitura agregada, cálculo vetorizado das métricas e gravação dos alertas.
+# Uso: python benchmarks/bench_campaign_analytics.py [--copies 1000000] [--campaigns 2000] [--runs 3]
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import campaign_analytics
+
+
+def make_synthetic_database(tmp_dir: str, copies: int, campaigns: int, seed: int = 7) -> str:
+    """Banco com as tabelas campaigns/copies/alerts do lib/db.js (sem índices) e dados aleatórios."""
+    path = os.path.join(tmp_dir, "campaigns.db")
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE campaigns (id TEXT PRIMARY KEY, name TEXT NOT NULL, platform TEXT, objective TEXT, budget REAL,
+            daily_budget REAL, duration INTEGER, revenue REAL DEFAULT 0, leads INTEGER DEFAULT 0, clicks INTEGER DEFAULT 0,
+            sales INTEGER DEFAULT 0, industry TEXT, targetAudience TEXT, segmentation TEXT, adFormat TEXT);
+        CREATE TABLE copies (id TEXT PRIMARY KEY, title TEXT NOT NULL, content TEXT NOT NULL, cta TEXT, target_audience TEXT,
+            status TEXT DEFAULT 'draft', campaign_id TEXT, created_date TEXT, clicks INTEGER DEFAULT 0,
+            impressions INTEGER DEFAULT 0, conversions INTEGER DEFAULT 0);
+        CREATE TABLE alerts (id INTEGER PRIMARY KEY AUTOINCREMENT, type TEXT NOT NULL, message TEXT NOT NULL, metric TEXT,
+            value REAL, threshold REAL, created_date TEXT, read INTEGER DEFAULT 0);
+    """)
+    campaign_rows = []
+    for i in range(campaigns):
+        budget = rng.choice([500, 1000, 5000, 20000])
+        duration = rng.choice([7, 15, 30, 60])
+        daily_budget = round(budget / duration * rng.uniform(0.7, 1.4), 2)
+        clicks = rng.randint(0, 20000)
+        campaign_rows.append((f"{1700000000000 + i}", f"Campanha {i}", "meta", "leads", budget, daily_budget, duration,
+                              round(budget * rng.uniform(0, 4), 2), rng.randint(0, 500), clicks, rng.randint(0, clicks // 20 + 1)))
+    conn.executemany("INSERT INTO campaigns (id, name, platform, objective, budget, daily_budget, duration, revenue, leads, clicks, sales) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", campaign_rows)
+    start = datetime.now(timezone.utc) - timedelta(days=90)
+    content = "Texto da copy com chamada para ação e benefícios do produto. " * 4
+
+    def copy_rows():
+        for i in range(copies):
+            impressions = rng.randint(0, 5000)
+            clicks = rng.randint(0, impressions // 25 + 1)
+            created = (start + timedelta(minutes=i % 120000)).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+            yield (f"copy-{i}", f"Copy {i}", content, "Saiba mais", "geral", "active", campaign_rows[rng.randrange(campaigns)][0],
+                   created, clicks, impressions, rng.randint(0, clicks // 10 + 1))
+
+    with conn:
+        conn.executemany("INSERT INTO copies (id, title, content, cta, target_audience, status, campaign_id, created_date, "
+                         "clicks, impressions, conversions) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", copy_rows())
+    conn.close()
+    return path
+
+
+def run(copies: int, campaigns: int, runs: int):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        started_at = time.perf_counter()
+        path = make_synthetic_database(tmp_dir, copies, campaigns)
+        print(f"Banco sintético: {copies} copies, {campaigns} campanhas ({os.path.getsize(path) / 2**20:.0f} MB) "
+              f"em {time.perf_counter() - started_at:.1f} s")
+
+        started_at = time.perf_counter()
+        campaign_analytics.ensure_indexes(path)
+        print(f"Criação dos índices: {time.perf_counter() - started_at:.2f} s")
+
+        stages = {"leitura": [], "métricas": [], "alertas": [], "gravação": []}
+        for _ in range(runs):
+            campaign_analytics.close_read_connections() # Cada rodada abre a conexão de novo
+            started_at = time.perf_counter()
+            campaign_data, copy_totals = campaign_analytics.load_data(path)
+            stages["leitura"].append(time.perf_counter() - started_at)
+            started_at = time.perf_counter()
+            metrics = campaign_analytics.compute_metrics(campaign_data, copy_totals)
+            stages["métricas"].append(time.perf_counter() - started_at)
+            started_at = time.perf_counter()
+            alerts = campaign_analytics.build_alerts(metrics)
+            stages["alertas"].append(time.perf_counter() - started_at)
+            started_at = time.perf_counter()
+            written = campaign_analytics.insert_alerts(alerts, path)
+            stages["gravação"].append(time.perf_counter() - started_at)
+        campaign_analytics.close_read_connections()
+
+        print(" | ".join(f"{stage}: {statistics.median(values) * 1000:.0f} ms" for stage, values in stages.items()))
+        print(f"Total (mediana): {sum(statistics.median(values) for values in stages.values()):.2f} s | "
+              f"{len(alerts)} alerta(s) na última rodada, {written} novo(s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tempo da análise de campanhas com históricos grandes de copies.")
+    parser.add_argument("--copies", type=int, default=1000000)
+    parser.add_argument("--campaigns", type=int, default=2000)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+    run(args.copies, args.campaigns, args.runs)
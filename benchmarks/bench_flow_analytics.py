@@ -0,0 +1,58 @@
+# benchmarks/bench_flow_analytics.py
+# Custo dos contadores do flow_analytics no caminho de /process_message: mede handle_message
+# (em processo, sem HTTP) com as métricas ligadas e desligadas, alternando as rodadas, e o tempo
+# da gravação em lote dos contadores acumulados. A thread de agregação/gravação roda como em
+# produção, então o tempo dela (GIL) entra na medição com as métricas ligadas.
+# Uso: python benchmarks/bench_flow_analytics.py [--messages 20000] [--rounds 5] [--senders 1000]
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from benchmarks.load_test_flow_controller import make_synthetic_database
+
+
+def run(messages: int, rounds: int, senders: int, flow_edges: int):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ["FLOW_DATABASE_PATH"] = make_synthetic_database(tmp_dir, flow_edges, branching=4)
+        os.environ.setdefault("FLOW_LOG_LEVEL", "WARNING")
+        import flow_controller
+        flow_controller.load_flow_from_db()
+
+        texts = ["opcao 1", "opcao 2", "opcao 3", "oi"]
+        workload = [{"sender_id": f"55119{i % senders:08d}@s.whatsapp.net", "message": texts[(i // senders) % len(texts)]}
+                    for i in range(messages)]
+        for data in workload[:1000]: # Aquecimento (compilação do fluxo, caches)
+            flow_controller.handle_message(data)
+
+        timings = {True: [], False: []}
+        for _ in range(rounds):
+            for enabled in (False, True):
+                flow_controller.flow_analytics.enabled = enabled
+                started_at = time.perf_counter()
+                for data in workload:
+                    flow_controller.handle_message(data)
+                timings[enabled].append((time.perf_counter() - started_at) / messages * 1e6)
+
+        started_at = time.perf_counter()
+        rows = flow_controller.flow_analytics.flush()
+        flush_ms = (time.perf_counter() - started_at) * 1000
+
+        off, on = statistics.median(timings[False]), statistics.median(timings[True])
+        print(f"handle_message sem métricas: {off:.2f} us/msg | com métricas: {on:.2f} us/msg | "
+              f"custo: {on - off:+.2f} us/msg ({(on - off) / off * 100:+.1f}%)")
+        print(f"Gravação em lote: {rows} linha(s) de {rounds * messages} mensagens em {flush_ms:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Custo dos contadores de métricas dos fluxos por mensagem.")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--senders", type=int, default=1000)
+    parser.add_argument("--flow-edges", type=int, default=1000, help="Arestas do fluxo sintético.")
+    args = parser.parse_args()
+    run(args.messages, args.rounds, args.senders, args.flow_edges)
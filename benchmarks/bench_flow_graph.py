@@ -0,0 +1,94 @@
+# benchmarks/bench_flow_graph.py
+# Micro-benchmark: latência por mensagem da decisão de transição em função do número de arestas.
+# Compara a varredura linear antiga (lista de edges) com o grafo compilado (flow_graph).
+# Uso: python benchmarks/bench_flow_graph.py [--edges 100,1000,10000] [--messages 20000] [--branching 60]
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from flow_graph import compile_flow
+
+
+def build_elements(edge_count: int, branching: int = 4) -> dict:
+    """Gera um fluxo sintético em árvore no formato flows.elements (nodes/edges do editor)."""
+    nodes = [{"id": "start-node", "type": "input", "data": {"label": "Início"}}]
+    edges = []
+    frontier = ["start-node"]
+    i = 0
+    while len(edges) < edge_count:
+        source = frontier.pop(0)
+        for b in range(branching):
+            if len(edges) >= edge_count:
+                break
+            node_id = f"node_{i}"
+            i += 1
+            nodes.append({"id": node_id, "type": "textMessage", "data": {"text": f"Mensagem {node_id}"}})
+            condition = "" if b == branching - 1 else f"opcao {b + 1}"
+            edges.append({"id": f"e_{source}_{node_id}", "source": source, "target": node_id, "data": {"condition": condition}})
+            frontier.append(node_id)
+    return {"nodes": nodes, "edges": edges}
+
+
+def legacy_step(elements: dict, current_node_id: str, user_message: str):
+    """Reproduz o caminho antigo: duas varreduras O(E) por mensagem."""
+    edges = elements["edges"]
+    outgoing_edges = [edge for edge in edges if edge.get('source') == current_node_id]
+    matched_edge = None
+    user_msg_clean = user_message.strip().lower()
+    for edge in outgoing_edges:
+        condition = edge.get('data', {}).get('condition', '')
+        if condition and user_msg_clean == condition.strip().lower():
+            matched_edge = edge
+            break
+    if not matched_edge:
+        matched_edge = next((edge for edge in outgoing_edges if not edge.get('data', {}).get('condition')), None)
+    next_node_id = matched_edge.get('target') if matched_edge else None
+    is_end_node = next_node_id is not None and not any(edge.get('source') == next_node_id for edge in edges)
+    return next_node_id, is_end_node
+
+
+def compiled_step(flow, current_node_id: str, user_message: str):
+    edge = flow.select_edge(current_node_id, user_message)
+    next_node_id = edge.target if edge else None
+    is_end_node = next_node_id is not None and flow.is_end_node(next_node_id)
+    return next_node_id, is_end_node
+
+
+def run(edge_counts: list[int], messages: int, branching: int = 4, seed: int = 42):
+    print(f"{'arestas':>10} {'legado (us/msg)':>16} {'compilado (us/msg)':>19} {'speedup':>9}")
+    for edge_count in edge_counts:
+        elements = build_elements(edge_count, branching)
+        flow = compile_flow(1, f"bench_{edge_count}", elements)
+        rng = random.Random(seed)
+        sources = list(flow.outgoing)
+        options = [f"opcao {b + 1}" for b in range(branching)] + ["Opcao 2 ", "qualquer coisa"]
+        workload = [(rng.choice(sources), rng.choice(options)) for _ in range(messages)]
+
+        # Sanidade: os dois caminhos devem concordar
+        for node_id, msg in workload[:200]:
+            assert legacy_step(elements, node_id, msg) == compiled_step(flow, node_id, msg)
+
+        legacy_n = max(1, min(messages, 2_000_000 // max(edge_count, 1)))
+        t0 = time.perf_counter()
+        for node_id, msg in workload[:legacy_n]:
+            legacy_step(elements, node_id, msg)
+        legacy_us = (time.perf_counter() - t0) / legacy_n * 1e6
+
+        t0 = time.perf_counter()
+        for node_id, msg in workload:
+            compiled_step(flow, node_id, msg)
+        compiled_us = (time.perf_counter() - t0) / messages * 1e6
+
+        print(f"{edge_count:>10} {legacy_us:>16.2f} {compiled_us:>19.2f} {legacy_us / compiled_us:>8.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latência por mensagem vs. número de arestas do fluxo.")
+    parser.add_argument("--edges", default="100,1000,2000,10000", help="Lista de contagens de arestas separadas por vírgula.")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--branching", type=int, default=4, help="Opções (edges de saída) por nó; ex.: 60 simula menus grandes.")
+    args = parser.parse_args()
+    run([int(x) for x in args.edges.split(",")], args.messages, args.branching)
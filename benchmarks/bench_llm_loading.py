@@ -0,0 +1,92 @@
+# benchmarks/bench_llm_loading.py
+# Benchmark de inicialização do llm_server por modo de carregamento (LLM_LOAD_MODE).
+# Cada modo roda num subprocesso novo (RSS e caches do sistema não vazam entre medições) e mede:
+#   - import: tempo até o servidor poder responder /health (o modelo carrega depois, em segundo plano)
+#   - load: tempo de carregamento do tokenizer + modelo
+#   - RSS após o carregamento e pico de RSS
+#   - tokens/s de uma geração gulosa curta (quantização troca memória por velocidade, dependendo da CPU)
+# Uso: python benchmarks/bench_llm_loading.py --model-path E:\MODELOS\TinyLlama-1.1B-Chat-v1.0 [--modes fp32,bf16,int8] [--threads 4]
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from service_metrics import memory_bytes
+
+PROMPT = "Escreva um título curto para um anúncio de curso de marketing digital:"
+
+
+def rss_mb() -> tuple[float | None, float | None]:
+    """(RSS atual, pico de RSS) em MB (service_metrics.memory_bytes)."""
+    current, peak = memory_bytes()
+    return (current / 2**20 if current is not None else None, peak / 2**20 if peak is not None else None)
+
+
+def measure(new_tokens: int) -> dict:
+    """Executado no subprocesso: importa o servidor, carrega o modelo e gera new_tokens tokens."""
+    started_at = time.perf_counter()
+    import llm_server
+    import torch
+    imported_at = time.perf_counter()
+    llm_server.load_model()
+    loaded_at = time.perf_counter()
+    if llm_server.model_status != "ok":
+        return {"error": llm_server.model_error}
+    current, peak = rss_mb()
+
+    inputs = llm_server.tokenizer(PROMPT, return_tensors="pt").to(llm_server.DEVICE)
+    with torch.no_grad():
+        generate_started_at = time.perf_counter()
+        output = llm_server.model.generate(**inputs, max_new_tokens=new_tokens, min_new_tokens=new_tokens, do_sample=False,
+                                           pad_token_id=llm_server.tokenizer.pad_token_id)
+        generate_seconds = time.perf_counter() - generate_started_at
+    generated = output.shape[1] - inputs["input_ids"].shape[1]
+    return {
+        "import_s": imported_at - started_at,
+        "load_s": loaded_at - imported_at,
+        "rss_mb": current,
+        "peak_rss_mb": peak,
+        "tokens_per_s": generated / generate_seconds if generate_seconds > 0 else None,
+        "threads": torch.get_num_threads(),
+    }
+
+
+def run(model_path: str, modes: list[str], threads: int, new_tokens: int):
+    print(f"Modelo: {model_path}")
+    print(f"{'modo':>6} | {'import (s)':>10} | {'load (s)':>9} | {'RSS (MB)':>9} | {'pico (MB)':>9} | {'tokens/s':>9}")
+    for mode in modes:
+        env = dict(os.environ, MODEL_PATH=model_path, LLM_LOAD_MODE=mode, LLM_RESPONSE_CACHE="0", PYTHONWARNINGS="ignore")
+        if threads:
+            env["LLM_NUM_THREADS"] = str(threads)
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", "--new-tokens", str(new_tokens)],
+                              env=env, capture_output=True, text=True)
+        lines = [line for line in proc.stdout.splitlines() if line.startswith("{")]
+        result = json.loads(lines[-1]) if lines else {"error": proc.stderr.strip().splitlines()[-1:] or "sem saída"}
+        if "error" in result:
+            print(f"{mode:>6} | falhou: {result['error']}")
+            continue
+
+        def fmt(value, spec):
+            return format(value, spec) if value is not None else "-"
+        print(f"{mode:>6} | {fmt(result['import_s'], '10.2f')} | {fmt(result['load_s'], '9.2f')} | "
+              f"{fmt(result['rss_mb'], '9.0f')} | {fmt(result['peak_rss_mb'], '9.0f')} | {fmt(result['tokens_per_s'], '9.1f')}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tempo de startup e RSS do llm_server por modo de carregamento.")
+    parser.add_argument("--model-path", default=os.environ.get("MODEL_PATH"), help="Pasta do modelo (padrão: $MODEL_PATH).")
+    parser.add_argument("--modes", default="fp32,bf16,int8")
+    parser.add_argument("--threads", type=int, default=0, help="LLM_NUM_THREADS para os subprocessos (0 = padrão do torch).")
+    parser.add_argument("--new-tokens", type=int, default=32)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(measure(args.new_tokens)))
+    else:
+        if not args.model_path:
+            parser.error("informe --model-path ou defina MODEL_PATH")
+        run(args.model_path, [m.strip() for m in args.modes.split(",")], args.threads, args.new_tokens)
@@ -0,0 +1,159 @@
+# benchmarks/load_test_flow_controller.py
+# Teste de carga do /process_message: N mensagens de S remetentes com C requisições simultâneas.
+# Reporta latência (p50/p90/p99/máx) e vazão (msgs/s); --batch-size > 1 usa /process_messages. Pode usar um servidor já rodando (--url)
+# ou subir o servidor Flask ou ASGI num subprocesso (--spawn flask|asgi) para comparar os modos.
+# Com --spawn e sem --database, os servidores usam uma cópia temporária do database.db com um único
+# fluxo ativo sintético (menus com opções "opcao N", ver bench_flow_graph.build_elements).
+# Uso:
+#   python benchmarks/load_test_flow_controller.py --spawn asgi --requests 20000 --concurrency 64
+#   python benchmarks/load_test_flow_controller.py --url http://127.0.0.1:5000 --messages "oi,1,2"
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from benchmarks.bench_flow_graph import build_elements
+
+SERVER_SCRIPTS = {"flask": "flow_controller.py", "asgi": "flow_controller_asgi.py"}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def make_synthetic_database(directory: str, edge_count: int, branching: int) -> str:
+    """Copia o database.db e deixa ativo apenas um fluxo sintético com edge_count arestas."""
+    path = os.path.join(directory, "database.db")
+    shutil.copy(os.path.join(ROOT, "database.db"), path)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("UPDATE flows SET status = 'inactive'")
+        conn.execute("INSERT INTO flows (name, status, elements) VALUES (?, 'active', ?)",
+                     ("Benchmark de carga", json.dumps(build_elements(edge_count, branching))))
+    conn.close()
+    return path
+
+
+def spawn_server(mode: str, log_level: str, database_path: str):
+    """Sobe o flow_controller no modo pedido e espera /flows responder. Retorna (processo, url)."""
+    port = free_port()
+    env = dict(os.environ, FLOW_CONTROLLER_PORT=str(port), HOST="127.0.0.1", FLOW_LOG_LEVEL=log_level,
+               FLOW_DATABASE_PATH=database_path)
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, SERVER_SCRIPTS[mode])], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Servidor {mode} encerrou ao iniciar (código {proc.returncode}).")
+        try:
+            if httpx.get(f"{url}/flows", timeout=1).status_code == 200:
+                return proc, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f"Servidor {mode} não respondeu em 30s.")
+
+
+async def run_load(url: str, total: int, concurrency: int, senders: int, messages: list[str], warmup: int,
+                   batch_size: int = 1) -> dict:
+    """batch_size > 1 envia lotes para /process_messages; latências são por requisição (lote)."""
+    latencies = []
+    errors = 0
+    counter = iter(range(0, warmup + total, batch_size))
+    # Um cliente com uma conexão (keep-alive) por worker: num pool único o httpcore percorre todas as
+    # conexões ociosas a cada requisição, e esse custo do cliente distorcia a medida de servidores com keep-alive
+    limits = httpx.Limits(max_connections=1, max_keepalive_connections=1)
+
+    async def worker():
+        nonlocal errors
+        async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+            for k in counter:
+                payloads = [{"sender_id": f"55119{i % senders:08d}@s.whatsapp.net", "message": messages[(i // senders) % len(messages)]}
+                            for i in range(k, k + batch_size)]
+                started_at = time.perf_counter()
+                try:
+                    if batch_size > 1:
+                        response = await client.post("/process_messages", json=payloads)
+                        ok = response.status_code == 200 and all(r["status"] == 200 for r in response.json()["results"])
+                    else:
+                        response = await client.post("/process_message", json=payloads[0])
+                        ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                if k < warmup:
+                    continue
+                latencies.append(time.perf_counter() - started_at)
+                errors += not ok
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started_at
+
+    # O relógio inclui o aquecimento; a vazão considera só as mensagens medidas
+    measured_elapsed = elapsed * total / (warmup + total)
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        "requests": len(latencies),
+        "messages": len(latencies) * batch_size,
+        "errors": errors,
+        "elapsed_s": measured_elapsed,
+        "msgs_per_s": len(latencies) * batch_size / measured_elapsed if measured_elapsed else 0.0,
+        "p50_ms": quantiles[49] * 1000,
+        "p90_ms": quantiles[89] * 1000,
+        "p99_ms": quantiles[98] * 1000,
+        "max_ms": max(latencies) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+    }
+
+
+def print_report(label: str, result: dict):
+    print(f"[{label}] {result['messages']} mensagens em {result['requests']} requisições, {result['errors']} erros, {result['elapsed_s']:.2f}s "
+          f"-> {result['msgs_per_s']:.0f} msgs/s | p50 {result['p50_ms']:.2f} ms | p90 {result['p90_ms']:.2f} ms | "
+          f"p99 {result['p99_ms']:.2f} ms | máx {result['max_ms']:.2f} ms | média {result['mean_ms']:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Teste de carga do /process_message (latência e vazão).")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="Servidor já em execução (ex.: http://127.0.0.1:5000).")
+    target.add_argument("--spawn", help="Sobe e testa os modos informados: flask, asgi ou flask,asgi.")
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--senders", type=int, default=1000)
+    parser.add_argument("--messages", default="opcao 1,opcao 2,opcao 3,oi", help="Mensagens enviadas em sequência por remetente.")
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=1, help="Mensagens por requisição; > 1 usa /process_messages.")
+    parser.add_argument("--database", help="Banco usado pelos servidores do --spawn (padrão: cópia temporária com fluxo sintético).")
+    parser.add_argument("--flow-edges", type=int, default=1000, help="Arestas do fluxo sintético.")
+    parser.add_argument("--log-level", default="WARNING", help="FLOW_LOG_LEVEL dos servidores iniciados com --spawn.")
+    args = parser.parse_args()
+    messages = [m.strip() for m in args.messages.split(",")]
+
+    if args.url:
+        print_report(args.url, asyncio.run(run_load(args.url, args.requests, args.concurrency, args.senders, messages, args.warmup, args.batch_size)))
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            database_path = args.database or make_synthetic_database(tmp_dir, args.flow_edges, branching=4)
+            for mode in [m.strip() for m in args.spawn.split(",")]:
+                proc, url = spawn_server(mode, args.log_level, database_path)
+                try:
+                    print_report(mode, asyncio.run(run_load(url, args.requests, args.concurrency, args.senders, messages, args.warmup, args.batch_size)))
+                finally:
+                    proc.terminate()
+                    proc.wait(timeout=10)
@@ -0,0 +1,346 @@
+# benchmarks/run_suite.py
+# Suíte de benchmarks dos dois serviços Python, com comparação contra um baseline gravado.
+# Cada cenário roda num subprocesso novo (memória e imports não vazam entre cenários) e reporta
+# vazão (ops/s), latência por operação (p50/p90/p99 em ms) e memória (RSS e pico de RSS em MB):
+#   - next_node: determine_next_node num fluxo sintético (flows.elements, ver bench_flow_graph.build_elements)
+#   - replay: fluxo de mensagens passado por handle_message (núcleo do /process_message, sem HTTP), sintético
+#     ou gravado (--replay-file: JSONL com o corpo de cada requisição, ex. {"sender_id": ..., "message": ...})
+#   - generate_stub: /generate do llm_server via ASGI com um backend falso (fila, lotes e HTTP, sem modelo)
+#   - generate_model: /generate com um modelo local pequeno (--model-path ou $MODEL_PATH; ex.: TinyLlama)
+# Com --check, termina com código 1 se alguma métrica piorar além da tolerância do baseline
+# (benchmarks/baseline.json). O baseline depende da máquina: regrave com --update-baseline na máquina
+# que roda a verificação.
+# Uso:
+#   python benchmarks/run_suite.py --check
+#   python benchmarks/run_suite.py --scenarios next_node,replay --flow-edges 10000 --branching 8
+#   python benchmarks/run_suite.py --scenarios generate_model --model-path E:\MODELOS\TinyLlama-1.1B-Chat-v1.0
+#   python benchmarks/run_suite.py --update-baseline
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from benchmarks.bench_flow_graph import build_elements
+
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "baseline.json")
+SCENARIOS = ("next_node", "replay", "generate_stub", "generate_model")
+DEFAULT_SCENARIOS = "next_node,replay,generate_stub"
+# Métricas comparadas com o baseline: True = maior é melhor
+METRICS = {"ops_per_s": True, "p50_ms": False, "p99_ms": False, "peak_rss_mb": False}
+# Variação aceita em relação ao baseline (fração); p99 é mais ruidoso. O baseline pode sobrescrever
+# por métrica ("p99_ms") ou por cenário ("generate_stub.p99_ms").
+DEFAULT_TOLERANCES = {"ops_per_s": 0.3, "p50_ms": 0.35, "p99_ms": 1.0, "peak_rss_mb": 0.2}
+MESSAGES = ["opcao 1", "opcao 2", "opcao 3", "oi"]
+PROMPTS = ["Escreva um título curto para um anúncio de curso de marketing digital:",
+           "Sugira uma chamada para ação para uma campanha de leads:",
+           "Resuma em uma frase os benefícios de um CRM para pequenas empresas:"]
+
+
+def summarize(latencies: list[float], elapsed: float, operations: int | None = None) -> dict:
+    """Vazão e percentis (latências em segundos) mais a memória do processo no momento."""
+    from service_metrics import memory_bytes
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    current, peak = memory_bytes()
+    operations = operations if operations is not None else len(latencies)
+    return {
+        "operations": operations,
+        "elapsed_s": elapsed,
+        "ops_per_s": operations / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": quantiles[49] * 1000,
+        "p90_ms": quantiles[89] * 1000,
+        "p99_ms": quantiles[98] * 1000,
+        "max_ms": max(latencies) * 1000,
+        "rss_mb": current / 2**20 if current is not None else None,
+        "peak_rss_mb": peak / 2**20 if peak is not None else None,
+    }
+
+
+def synthetic_stream(count: int, senders: int) -> list[dict]:
+    """Cada remetente manda as MESSAGES em sequência (percorre o menu e volta ao início)."""
+    return [{"sender_id": f"55119{i % senders:08d}@s.whatsapp.net", "message": MESSAGES[(i // senders) % len(MESSAGES)]}
+            for i in range(count)]
+
+
+def load_stream(path: str) -> list[dict]:
+    """Mensagens gravadas: JSONL (uma requisição por linha) ou um array JSON."""
+    with open(path, encoding="utf-8") as stream_file:
+        content = stream_file.read().strip()
+    if content.startswith("["):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+# --- Cenários (executados no subprocesso) ---
+
+def scenario_next_node(args) -> dict:
+    import flow_controller
+    from flow_graph import compile_flow
+    flow = compile_flow(1, "bench", build_elements(args.flow_edges, args.branching))
+    rng = random.Random(args.seed)
+    sources = list(flow.outgoing)
+    options = [f"opcao {b + 1}" for b in range(args.branching)] + ["Opcao 2 ", "qualquer coisa"]
+    workload = [(rng.choice(sources), rng.choice(options)) for _ in range(args.operations)]
+    determine_next_node = flow_controller.determine_next_node
+    for node_id, message in workload[:args.warmup]:
+        determine_next_node(node_id, message, flow)
+
+    latencies = []
+    clock = time.perf_counter
+    started_at = clock()
+    for node_id, message in workload:
+        call_started_at = clock()
+        determine_next_node(node_id, message, flow)
+        latencies.append(clock() - call_started_at)
+    return summarize(latencies, clock() - started_at)
+
+
+def scenario_replay(args) -> dict:
+    import flow_controller
+    flow_controller.load_flow_from_db()
+    stream = load_stream(args.replay_file) if args.replay_file else synthetic_stream(args.operations, args.senders)
+    handle_message = flow_controller.handle_message
+    for data in stream[:args.warmup]:
+        handle_message(data)
+    for sender_id in {data.get("sender_id") for data in stream[:args.warmup]} - {None}:
+        flow_controller.user_states.delete(sender_id) # Sessões do aquecimento não influenciam a medição
+
+    latencies = []
+    errors = 0
+    clock = time.perf_counter
+    started_at = clock()
+    for data in stream:
+        call_started_at = clock()
+        _, status = handle_message(data)
+        latencies.append(clock() - call_started_at)
+        errors += status >= 500
+    result = summarize(latencies, clock() - started_at)
+    result["errors"] = errors
+    return result
+
+
+def scenario_generate(args, stub: bool) -> dict:
+    import httpx
+    import llm_server
+    if stub:
+        # Backend falso: mesmo caminho de fila/lotes/HTTP, resposta fixa após stub_token_ms por token
+        def stub_batch(batch):
+            time.sleep(args.stub_token_ms / 1000 * max(r.max_new_tokens for r in batch))
+            return [f"Resposta para: {r.prompt[:20]}" for r in batch]
+        llm_server.scheduler.run_batch = stub_batch
+        llm_server.model = llm_server.tokenizer = object()
+    else:
+        llm_server.load_model()
+        if llm_server.model_status != "ok":
+            raise RuntimeError(f"Modelo não carregou: {llm_server.model_error}")
+
+    requests = [{"prompt": f"{PROMPTS[i % len(PROMPTS)]} ({i})", "max_new_tokens": args.new_tokens, "do_sample": False}
+                for i in range(args.generate_requests)]
+
+    async def run() -> tuple[list[float], float, int]:
+        latencies = []
+        errors = 0
+        transport = httpx.ASGITransport(app=llm_server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://llm", timeout=600) as client:
+            for body in requests[:min(args.warmup, 2)]:
+                await client.post("/generate", json=body)
+            pending = iter(requests)
+
+            async def worker():
+                nonlocal errors
+                for body in pending:
+                    call_started_at = time.perf_counter()
+                    response = await client.post("/generate", json=body)
+                    latencies.append(time.perf_counter() - call_started_at)
+                    errors += response.status_code != 200
+
+            started_at = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+            return latencies, time.perf_counter() - started_at, errors
+
+    latencies, elapsed, errors = asyncio.run(run())
+    result = summarize(latencies, elapsed)
+    result["errors"] = errors
+    result["tokens_per_s"] = len(latencies) * args.new_tokens / elapsed if not stub and elapsed > 0 else None
+    return result
+
+
+def run_child(scenario: str, args) -> dict:
+    if scenario == "next_node":
+        return scenario_next_node(args)
+    if scenario == "replay":
+        return scenario_replay(args)
+    return scenario_generate(args, stub=scenario == "generate_stub")
+
+
+# --- Orquestração ---
+
+def child_env(scenario: str, args, tmp_dir: str) -> dict:
+    env = dict(os.environ, FLOW_LOG_LEVEL="ERROR", PYTHONWARNINGS="ignore", LLM_RESPONSE_CACHE="0",
+               FLOW_ANALYTICS_FLUSH_INTERVAL="3600")
+    if scenario in ("next_node", "replay"):
+        if args.database:
+            # Cópia: a replay grava sessões e métricas no banco
+            database_path = os.path.join(tmp_dir, "database.db")
+            shutil.copy(args.database, database_path)
+        else:
+            from benchmarks.load_test_flow_controller import make_synthetic_database
+            database_path = make_synthetic_database(tmp_dir, args.flow_edges, args.branching)
+        env["FLOW_DATABASE_PATH"] = database_path
+    if scenario == "generate_model":
+        env["MODEL_PATH"] = args.model_path
+    return env
+
+
+def run_scenario(scenario: str, args, argv: list[str]) -> dict:
+    """Roda o cenário args.repeat vezes (um subprocesso por vez) e fica com a mediana de cada métrica."""
+    runs = []
+    for _ in range(max(1, args.repeat)):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", scenario, *argv],
+                                  env=child_env(scenario, args, tmp_dir), cwd=ROOT, capture_output=True, text=True)
+        lines = [line for line in proc.stdout.splitlines() if line.startswith("{")]
+        if proc.returncode != 0 or not lines:
+            return {"error": (proc.stderr.strip().splitlines() or ["sem saída"])[-1]}
+        runs.append(json.loads(lines[-1]))
+    return {key: statistics.median(run[key] for run in runs) if runs[0][key] is not None else None for key in runs[0]}
+
+
+def compare(results: dict, baseline: dict) -> list[str]:
+    """Métricas piores que o baseline além da tolerância."""
+    tolerances = {**DEFAULT_TOLERANCES, **baseline.get("tolerances", {})}
+    regressions = []
+    for scenario, result in results.items():
+        expected = baseline.get("scenarios", {}).get(scenario)
+        if not expected or "error" in result:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            current, reference = result.get(metric), expected.get(metric)
+            if current is None or not reference:
+                continue
+            tolerance = tolerances.get(f"{scenario}.{metric}", tolerances[metric])
+            change = (current - reference) / reference
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{scenario}.{metric}: {current:.4g} vs baseline {reference:.4g} "
+                                   f"({change:+.0%}, tolerância {tolerance:.0%})")
+    return regressions
+
+
+def fmt(value, spec: str) -> str:
+    return format(value, spec) if value is not None else "-"
+
+
+def print_results(results: dict, baseline: dict):
+    print(f"{'cenário':>14} | {'ops/s':>10} | {'p50 (ms)':>9} | {'p90 (ms)':>9} | {'p99 (ms)':>9} | {'RSS (MB)':>8} | "
+          f"{'pico (MB)':>9} | {'baseline ops/s':>14}")
+    for scenario, result in results.items():
+        if "error" in result:
+            print(f"{scenario:>14} | falhou: {result['error']}")
+            continue
+        reference = baseline.get("scenarios", {}).get(scenario, {}).get("ops_per_s")
+        print(f"{scenario:>14} | {result['ops_per_s']:>10.1f} | {result['p50_ms']:>9.4f} | {result['p90_ms']:>9.4f} | "
+              f"{result['p99_ms']:>9.4f} | {fmt(result['rss_mb'], '8.0f')} | {fmt(result['peak_rss_mb'], '9.0f')} | "
+              f"{fmt(reference, '14.1f')}")
+        if result.get("errors"):
+            print(f"{'':>14}   {result['errors']} resposta(s) com erro")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks do flow_controller e do llm_server com verificação de regressão.")
+    parser.add_argument("--scenarios", default=DEFAULT_SCENARIOS, help=f"Lista separada por vírgula: {', '.join(SCENARIOS)}.")
+    parser.add_argument("--operations", type=int, default=20000, help="Chamadas medidas em next_node e replay (sintético).")
+    parser.add_argument("--warmup", type=int, default=1000)
+    parser.add_argument("--flow-edges", type=int, default=1000, help="Arestas do fluxo sintético.")
+    parser.add_argument("--branching", type=int, default=4, help="Opções por nó do fluxo sintético.")
+    parser.add_argument("--senders", type=int, default=1000, help="Remetentes do fluxo de mensagens sintético.")
+    parser.add_argument("--replay-file", help="Mensagens gravadas (JSONL ou array JSON) para o cenário replay.")
+    parser.add_argument("--database", help="Banco usado em next_node/replay (copiado; padrão: database.db com fluxo sintético).")
+    parser.add_argument("--generate-requests", type=int, default=1000, help="Requisições a /generate.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requisições simultâneas a /generate.")
+    parser.add_argument("--new-tokens", type=int, default=16)
+    parser.add_argument("--stub-token-ms", type=float, default=0.0, help="Tempo simulado por token no generate_stub.")
+    parser.add_argument("--model-path", default=os.environ.get("MODEL_PATH"), help="Modelo do generate_model (padrão: $MODEL_PATH).")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=3, help="Execuções de cada cenário (vale a mediana).")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--check", action="store_true", help="Falha (código 1) se houver regressão em relação ao baseline.")
+    parser.add_argument("--update-baseline", action="store_true", help="Grava os resultados como novo baseline.")
+    parser.add_argument("--json", help="Grava os resultados completos neste arquivo.")
+    parser.add_argument("--child", choices=SCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.child, args)))
+        return 0
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"cenário(s) desconhecido(s): {', '.join(sorted(unknown))}")
+    if "generate_model" in scenarios and not args.model_path:
+        parser.error("generate_model precisa de --model-path ou MODEL_PATH")
+
+    # Os subprocessos recebem as mesmas opções (caminhos absolutos)
+    child_argv = [f"--operations={args.operations}", f"--warmup={args.warmup}", f"--flow-edges={args.flow_edges}",
+                  f"--branching={args.branching}", f"--senders={args.senders}", f"--generate-requests={args.generate_requests}",
+                  f"--concurrency={args.concurrency}", f"--new-tokens={args.new_tokens}", f"--stub-token-ms={args.stub_token_ms}",
+                  f"--seed={args.seed}"]
+    if args.replay_file:
+        child_argv.append(f"--replay-file={os.path.abspath(args.replay_file)}")
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+
+    results = {}
+    for scenario in scenarios:
+        print(f"Executando {scenario}...", flush=True)
+        results[scenario] = run_scenario(scenario, args, child_argv)
+    print_results(results, baseline)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as json_file:
+            json.dump(results, json_file, indent=2)
+    if args.update_baseline:
+        scenarios_baseline = dict(baseline.get("scenarios", {}))
+        scenarios_baseline.update({scenario: {metric: float(f"{result[metric]:.4g}") for metric in METRICS if result.get(metric) is not None}
+                                   for scenario, result in results.items() if "error" not in result})
+        baseline = {
+            "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+            "tolerances": {**DEFAULT_TOLERANCES, **baseline.get("tolerances", {})},
+            "options": {"operations": args.operations, "flow_edges": args.flow_edges, "branching": args.branching,
+                        "senders": args.senders, "generate_requests": args.generate_requests,
+                        "concurrency": args.concurrency, "new_tokens": args.new_tokens, "repeat": args.repeat},
+            "scenarios": scenarios_baseline,
+        }
+        with open(args.baseline, "w", encoding="utf-8") as baseline_file:
+            json.dump(baseline, baseline_file, indent=2)
+            baseline_file.write("\n")
+        print(f"Baseline gravado em {args.baseline}")
+
+    failed = [scenario for scenario, result in results.items() if "error" in result]
+    if args.check:
+        if not baseline:
+            print(f"Sem baseline em {args.baseline}: rode com --update-baseline primeiro.")
+            return 1
+        regressions = compare(results, baseline)
+        for regression in regressions:
+            print(f"REGRESSÃO {regression}")
+        if regressions or failed:
+            return 1
+        print("Sem regressões em relação ao baseline.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
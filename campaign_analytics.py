@@ -0,0 +1,235 @@
+# campaign_analytics.py
+# Análise em lote das campanhas e copies do database.db (mesmos dados das telas de Métricas e
+# Alertas do Next.js): CTR, taxa de conversão, ROAS, CPL e ritmo do orçamento (pacing) calculados
+# de forma vetorizada (pandas/NumPy) e alertas de limite gravados na tabela alerts em um único lote.
+#
+# As copies são agregadas por campanha no próprio SQLite, lendo só o índice de cobertura
+# idx_copies_campaign_id (sem tocar no texto das copies); históricos de 1M de copies levam segundos.
+# A leitura usa uma conexão somente leitura compartilhada por banco.
+#
+# Custo da campanha: o orçamento (budget), como em pages/Projection.tsx, pois o banco não guarda o gasto.
+# Uso: python campaign_analytics.py [--database database.db] [--dry-run] [--min-ctr 1.0] ...
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from urllib.request import pathname2url
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+DATABASE_PATH = os.environ.get("CAMPAIGN_DATABASE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database.db'))
+
+# Limites dos alertas. CTR e conversão em %, como nas telas (Metrics.tsx: CTR <= 1% é negativo;
+# alerts.tsx: conversão crítica abaixo de 2.5%). max_cpl None = sem alerta de CPL.
+DEFAULT_THRESHOLDS = {
+    "min_ctr": 1.0,
+    "min_cvr": 2.5,
+    "min_roas": 1.0,
+    "max_cpl": None,
+    "max_pacing": 1.1, # daily_budget * duration acima de 110% do budget
+    "min_impressions": 1000, # Volume mínimo para avaliar CTR
+    "min_clicks": 100, # Volume mínimo para avaliar conversão, ROAS e CPL
+}
+
+# Índices usados pela análise (e pelas telas que filtram copies por campanha). O de copies cobre as
+# colunas agregadas: o GROUP BY percorre só o índice, em ordem, sem ler as linhas da tabela.
+INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_copies_campaign_id ON copies(campaign_id, clicks, impressions, conversions, created_date)",
+    "CREATE INDEX IF NOT EXISTS idx_alerts_read ON alerts(read, metric)",
+)
+
+_read_connections = {}  # {caminho absoluto: (conexão somente leitura, lock)}
+_read_connections_lock = threading.Lock()
+
+
+def read_connection(database_path: str = DATABASE_PATH) -> tuple[sqlite3.Connection, threading.Lock]:
+    """Conexão somente leitura compartilhada do banco (criada na primeira chamada) e o lock que serializa seu uso."""
+    path = os.path.abspath(database_path)
+    with _read_connections_lock:
+        entry = _read_connections.get(path)
+        if entry is None:
+            conn = sqlite3.connect(f"file:{pathname2url(path)}?mode=ro", uri=True, check_same_thread=False)
+            conn.execute("PRAGMA query_only = ON")
+            conn.execute("PRAGMA cache_size = -65536") # 64 MB de cache de páginas
+            conn.execute("PRAGMA mmap_size = 268435456")
+            entry = _read_connections[path] = (conn, threading.Lock())
+        return entry
+
+
+def close_read_connections():
+    with _read_connections_lock:
+        for conn, _ in _read_connections.values():
+            conn.close()
+        _read_connections.clear()
+
+
+def ensure_indexes(database_path: str = DATABASE_PATH):
+    """Cria os índices que faltam (operação de escrita; idempotente)."""
+    conn = sqlite3.connect(database_path, timeout=10)
+    try:
+        with conn:
+            for statement in INDEXES:
+                conn.execute(statement)
+    finally:
+        conn.close()
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> set:
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def load_data(database_path: str = DATABASE_PATH) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """(campanhas, totais das copies por campanha) lidos em bulk pela conexão compartilhada."""
+    conn, lock = read_connection(database_path)
+    with lock:
+        # Bancos criados pelo lib/db.js têm created_at; os antigos não (o início vem da primeira copy)
+        start_column = "created_at" if "created_at" in _columns(conn, "campaigns") else "NULL"
+        campaigns = pd.read_sql_query(
+            f"SELECT id, name, budget, daily_budget, duration, revenue, leads, clicks, sales, {start_column} AS created_at FROM campaigns",
+            conn)
+        copies = pd.read_sql_query(
+            "SELECT campaign_id, COUNT(*) AS copies, SUM(clicks) AS copy_clicks, SUM(impressions) AS impressions, "
+            "SUM(conversions) AS conversions, MIN(created_date) AS first_copy_date "
+            "FROM copies WHERE campaign_id IS NOT NULL GROUP BY campaign_id",
+            conn)
+    return campaigns, copies
+
+
+def compute_metrics(campaigns: pd.DataFrame, copies: pd.DataFrame, as_of: datetime | None = None) -> pd.DataFrame:
+    """Métricas por campanha (colunas ctr, cvr, roas, cpl, pacing, budget_used_pct, ...)."""
+    as_of = as_of or datetime.now(timezone.utc)
+    df = campaigns.merge(copies, how="left", left_on="id", right_on="campaign_id").drop(columns="campaign_id")
+    numeric = ["budget", "daily_budget", "duration", "revenue", "leads", "clicks", "sales", "copies", "copy_clicks", "impressions", "conversions"]
+    df[numeric] = df[numeric].apply(pd.to_numeric, errors="coerce").fillna(0.0)
+    df[["copies", "copy_clicks", "impressions", "conversions"]] = df[["copies", "copy_clicks", "impressions", "conversions"]].astype("int64")
+
+    budget = df["budget"].to_numpy(float)
+    daily_budget = df["daily_budget"].to_numpy(float)
+    duration = df["duration"].to_numpy(float)
+    revenue = df["revenue"].to_numpy(float)
+    leads = df["leads"].to_numpy(float)
+    impressions = df["impressions"].to_numpy(float)
+    copy_clicks = df["copy_clicks"].to_numpy(float)
+    conversions = df["conversions"].to_numpy(float)
+    campaign_clicks = df["clicks"].to_numpy(float)
+    sales = df["sales"].to_numpy(float)
+
+    # Início da campanha: created_at (quando existe) ou a primeira copy
+    started_at = pd.to_datetime(df["created_at"].fillna(df["first_copy_date"]), errors="coerce", utc=True, format="mixed")
+    elapsed_days = ((pd.Timestamp(as_of) - started_at).dt.total_seconds() / 86400).to_numpy(float)
+    elapsed_days = np.clip(elapsed_days, 0, np.where(duration > 0, duration, np.inf))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        df["ctr"] = np.where(impressions > 0, copy_clicks / impressions * 100, np.nan)
+        # Conversão pelas copies; sem cliques nas copies, pelas vendas/cliques da campanha
+        df["cvr"] = np.where(copy_clicks > 0, conversions / copy_clicks * 100,
+                             np.where(campaign_clicks > 0, sales / campaign_clicks * 100, np.nan))
+        df["roas"] = np.where(budget > 0, revenue / budget, np.nan)
+        df["cpl"] = np.where(leads > 0, budget / leads, np.nan)
+        planned_spend = daily_budget * duration
+        df["planned_spend"] = planned_spend
+        df["pacing"] = np.where(budget > 0, planned_spend / budget, np.nan)
+        df["elapsed_days"] = elapsed_days
+        df["budget_used_pct"] = np.where(budget > 0, daily_budget * elapsed_days / budget * 100, np.nan)
+    df["volume_clicks"] = np.maximum(copy_clicks, campaign_clicks)
+    return df
+
+
+def _iso_now() -> str:
+    # Mesmo formato do new Date().toISOString() usado pelo Next.js em alerts.created_date
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def build_alerts(metrics: pd.DataFrame, thresholds: dict | None = None) -> pd.DataFrame:
+    """Linhas para a tabela alerts (type, message, metric, value, threshold) das campanhas fora dos limites."""
+    limits = {**DEFAULT_THRESHOLDS, **(thresholds or {})}
+    has_clicks = metrics["volume_clicks"] >= limits["min_clicks"]
+    rules = [
+        # (tipo, métrica, coluna, condição, limite, mensagem)
+        ("warning", "CTR", "ctr", (metrics["impressions"] >= limits["min_impressions"]) & (metrics["ctr"] < limits["min_ctr"]),
+         limits["min_ctr"], "CTR de {value:.2f}% na campanha '{name}' (mínimo: {threshold:.2f}%)"),
+        ("error", "Taxa de Conversão", "cvr", has_clicks & (metrics["cvr"] < limits["min_cvr"]),
+         limits["min_cvr"], "Taxa de conversão de {value:.2f}% na campanha '{name}' (mínimo: {threshold:.2f}%)"),
+        ("error", "ROAS", "roas", has_clicks & (metrics["roas"] < limits["min_roas"]),
+         limits["min_roas"], "ROAS de {value:.2f} na campanha '{name}' (mínimo: {threshold:.2f})"),
+        ("warning", "Pacing", "pacing", metrics["pacing"] > limits["max_pacing"],
+         limits["max_pacing"], "Orçamento diário x duração soma {value:.0%} do orçamento da campanha '{name}' (limite: {threshold:.0%})"),
+    ]
+    if limits["max_cpl"] is not None:
+        rules.append(("warning", "CPL", "cpl", has_clicks & (metrics["cpl"] > limits["max_cpl"]),
+                      limits["max_cpl"], "CPL de R$ {value:.2f} na campanha '{name}' (limite: R$ {threshold:.2f})"))
+
+    frames = []
+    for alert_type, metric, column, mask, threshold, template in rules:
+        selected = metrics.loc[mask.fillna(False), ["name", column]]
+        if selected.empty:
+            continue
+        values = selected[column].round(4)
+        frames.append(pd.DataFrame({
+            "type": alert_type,
+            "message": [template.format(value=value, name=name, threshold=threshold) for name, value in zip(selected["name"], values)],
+            "metric": metric,
+            "value": values.to_numpy(),
+            "threshold": float(threshold),
+        }))
+    if not frames:
+        return pd.DataFrame(columns=["type", "message", "metric", "value", "threshold"])
+    return pd.concat(frames, ignore_index=True)
+
+
+def insert_alerts(alerts: pd.DataFrame, database_path: str = DATABASE_PATH) -> int:
+    """Grava os alertas numa única transação, sem repetir alertas ainda não lidos com a mesma mensagem."""
+    if alerts.empty:
+        return 0
+    conn = sqlite3.connect(database_path, timeout=10)
+    try:
+        unread = {row for row in conn.execute("SELECT metric, message FROM alerts WHERE read = 0")}
+        created_date = _iso_now()
+        rows = [(alert_type, message, metric, float(value), float(threshold), created_date, 0)
+                for alert_type, message, metric, value, threshold in alerts[["type", "message", "metric", "value", "threshold"]].itertuples(index=False)
+                if (metric, message) not in unread]
+        if rows:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO alerts (type, message, metric, value, threshold, created_date, read) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+    finally:
+        conn.close()
+
+
+def run(database_path: str = DATABASE_PATH, thresholds: dict | None = None, create_indexes: bool = True,
+        write_alerts: bool = True) -> tuple[pd.DataFrame, pd.DataFrame, int]:
+    """Executa a análise completa. Retorna (métricas por campanha, alertas, alertas gravados)."""
+    if create_indexes:
+        ensure_indexes(database_path)
+    campaigns, copies = load_data(database_path)
+    metrics = compute_metrics(campaigns, copies)
+    alerts = build_alerts(metrics, thresholds)
+    written = insert_alerts(alerts, database_path) if write_alerts else 0
+    logger.info(f"Análise de campanhas: {len(metrics)} campanha(s), {int(metrics['copies'].sum())} copies, "
+                f"{len(alerts)} alerta(s) ({written} novo(s) gravado(s)).")
+    return metrics, alerts, written
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - [%(levelname)s] - %(name)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Métricas das campanhas (CTR, conversão, ROAS, CPL, pacing) e alertas de limite.")
+    parser.add_argument("--database", default=DATABASE_PATH)
+    parser.add_argument("--dry-run", action="store_true", help="Só calcula e mostra; não grava alertas nem cria índices.")
+    for key, value in DEFAULT_THRESHOLDS.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=float, default=value)
+    args = parser.parse_args()
+    limits = {key: getattr(args, key) for key in DEFAULT_THRESHOLDS}
+
+    metrics, alerts, written = run(args.database, limits, create_indexes=not args.dry_run, write_alerts=not args.dry_run)
+    columns = ["name", "copies", "impressions", "ctr", "cvr", "roas", "cpl", "pacing", "budget_used_pct"]
+    with pd.option_context("display.max_rows", 50, "display.width", 160, "display.float_format", "{:.2f}".format):
+        print(metrics[columns].to_string(index=False))
+    print(f"\n{len(alerts)} alerta(s); {written} gravado(s).")
+    for message in alerts["message"]:
+        print(f"  - {message}")
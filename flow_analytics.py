@@ -0,0 +1,203 @@
+# flow_analytics.py
+# Métricas dos fluxos por versão: visitas e mensagens sem correspondência (no-match) por nó,
+# transições por aresta e sessões encerradas em cada nó.
+# O caminho das mensagens só enfileira o percurso (deque.append, sem lock); uma thread agrega a
+# fila em contadores a cada segundo e grava os deltas periodicamente nas tabelas flow_node_stats /
+# flow_edge_stats numa única transação. A gravação soma aos valores existentes, então vários
+# workers podem compartilhar o banco.
+import logging
+import sqlite3
+import threading
+import time
+from collections import Counter, deque
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ANALYTICS_FLUSH_INTERVAL = 10.0 # Segundos entre gravações dos contadores no SQLite
+AGGREGATE_INTERVAL = 1.0 # Segundos entre agregações da fila de eventos (limita a memória da fila)
+
+
+class FlowAnalytics:
+    """Contadores por (flow_id, versão, nó) e (flow_id, versão, origem, destino).
+
+    Os passos vêm de WalkResult.path (flow_engine): tuplas (flow_id, versão, node_id).
+    """
+
+    def __init__(self, database_path: str, flush_interval: float = DEFAULT_ANALYTICS_FLUSH_INTERVAL, enabled: bool = True):
+        self.database_path = database_path
+        self.flush_interval = flush_interval
+        self.enabled = enabled
+        self._events = deque() # (origin, path, ended, no_match, started) ainda não agregados
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._visits = Counter()
+        self._no_match = Counter()
+        self._completions = Counter()
+        self._transitions = Counter()
+        self._schema_ready = False
+        self._closed = threading.Event()
+        self._flusher = None
+        if enabled and flush_interval > 0:
+            self._flusher = threading.Thread(target=self._flush_loop, name="flow-analytics-flusher", daemon=True)
+            self._flusher.start()
+
+    def record(self, origin: tuple, path: list, ended: bool, no_match: bool = False, started: bool = False):
+        """Registra uma execução a partir do nó origin (onde a mensagem chegou).
+
+        path: nós executados, na ordem; ended: a sessão terminou no último nó do path (sair do fluxo
+        por goToFlow também conta como encerramento no nó de origem);
+        no_match: nenhuma saída de origin aceitou a mensagem; started: origin é o nó inicial de uma sessão nova.
+        """
+        if self.enabled:
+            self._events.append((origin, path, ended, no_match, started)) # Atômico: dispensa lock
+
+    def aggregate(self):
+        """Consome a fila de eventos e soma nos contadores."""
+        events = self._events
+        with self._lock:
+            visits, no_match_counts, completions, transitions = self._visits, self._no_match, self._completions, self._transitions
+            while events:
+                origin, path, ended, no_match, started = events.popleft()
+                if started:
+                    visits[origin] += 1
+                if no_match:
+                    no_match_counts[origin] += 1
+                previous = origin
+                for step in path:
+                    visits[step] += 1
+                    if step[0] == previous[0] and step[1] == previous[1]:
+                        transitions[previous + (step[2],)] += 1
+                    else:
+                        completions[previous] += 1 # goToFlow: a sessão saiu do fluxo neste nó
+                    previous = step
+                if ended and path:
+                    completions[path[-1]] += 1
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.database_path, timeout=10)
+        if not self._schema_ready:
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS flow_node_stats (
+                        flow_id INTEGER NOT NULL,
+                        flow_version TEXT NOT NULL,
+                        node_id TEXT NOT NULL,
+                        visits INTEGER NOT NULL DEFAULT 0,
+                        no_match INTEGER NOT NULL DEFAULT 0,
+                        completions INTEGER NOT NULL DEFAULT 0,
+                        updated_at REAL NOT NULL,
+                        PRIMARY KEY (flow_id, flow_version, node_id)
+                    )""")
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS flow_edge_stats (
+                        flow_id INTEGER NOT NULL,
+                        flow_version TEXT NOT NULL,
+                        source_node_id TEXT NOT NULL,
+                        target_node_id TEXT NOT NULL,
+                        transitions INTEGER NOT NULL DEFAULT 0,
+                        updated_at REAL NOT NULL,
+                        PRIMARY KEY (flow_id, flow_version, source_node_id, target_node_id)
+                    )""")
+            self._schema_ready = True
+        return conn
+
+    def flush(self) -> int:
+        """Grava os contadores acumulados numa única transação. Retorna quantas linhas foram gravadas."""
+        with self._write_lock:
+            self.aggregate()
+            with self._lock:
+                visits, self._visits = self._visits, Counter()
+                no_match, self._no_match = self._no_match, Counter()
+                completions, self._completions = self._completions, Counter()
+                transitions, self._transitions = self._transitions, Counter()
+            if not (visits or no_match or completions or transitions):
+                return 0
+            now = time.time()
+            node_rows = [(key[0], key[1] or "", key[2], visits[key], no_match[key], completions[key], now)
+                         for key in visits.keys() | no_match.keys() | completions.keys()]
+            edge_rows = [(flow_id, version or "", source, target, count, now)
+                         for (flow_id, version, source, target), count in transitions.items()]
+            try:
+                conn = self._connect()
+                try:
+                    with conn:
+                        conn.executemany(
+                            "INSERT INTO flow_node_stats (flow_id, flow_version, node_id, visits, no_match, completions, updated_at) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(flow_id, flow_version, node_id) DO UPDATE SET "
+                            "visits = visits + excluded.visits, no_match = no_match + excluded.no_match, "
+                            "completions = completions + excluded.completions, updated_at = excluded.updated_at",
+                            node_rows)
+                        conn.executemany(
+                            "INSERT INTO flow_edge_stats (flow_id, flow_version, source_node_id, target_node_id, transitions, updated_at) "
+                            "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(flow_id, flow_version, source_node_id, target_node_id) DO UPDATE SET "
+                            "transitions = transitions + excluded.transitions, updated_at = excluded.updated_at",
+                            edge_rows)
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                logger.error(f"Erro ao gravar métricas dos fluxos ({len(node_rows)} nó(s), {len(edge_rows)} aresta(s)): {e}")
+                # Devolve os deltas para a próxima tentativa, somados aos que chegaram nesse meio tempo
+                with self._lock:
+                    self._visits.update(visits)
+                    self._no_match.update(no_match)
+                    self._completions.update(completions)
+                    self._transitions.update(transitions)
+                raise
+            return len(node_rows) + len(edge_rows)
+
+    def funnel(self, flow_id: int, version: str | None = None) -> dict:
+        """Contadores gravados de uma versão do fluxo (padrão: a versão mais recente com dados)."""
+        self.flush()
+        conn = self._connect()
+        try:
+            versions = [row[0] for row in conn.execute(
+                "SELECT flow_version FROM flow_node_stats WHERE flow_id = ? GROUP BY flow_version ORDER BY flow_version DESC",
+                (flow_id,))]
+            if version is None:
+                version = versions[0] if versions else ""
+            nodes = conn.execute(
+                "SELECT node_id, visits, no_match, completions FROM flow_node_stats WHERE flow_id = ? AND flow_version = ?",
+                (flow_id, version)).fetchall()
+            edges = conn.execute(
+                "SELECT source_node_id, target_node_id, transitions FROM flow_edge_stats WHERE flow_id = ? AND flow_version = ? "
+                "ORDER BY transitions DESC", (flow_id, version)).fetchall()
+        finally:
+            conn.close()
+        exits = Counter()
+        for source, _, count in edges:
+            exits[source] += count
+        return {
+            "flow_id": flow_id,
+            "version": version,
+            "versions": versions,
+            "nodes": [{"node_id": node_id, "visits": visits, "no_match": no_match, "completions": completions,
+                       "exits": exits[node_id],
+                       # Sessões que pararam neste nó sem seguir nem terminar (esperando ou desistentes)
+                       "drop_off": max(0, visits - exits[node_id] - completions)}
+                      for node_id, visits, no_match, completions in nodes],
+            "edges": [{"source": source, "target": target, "transitions": count} for source, target, count in edges],
+        }
+
+    def _flush_loop(self):
+        last_flush = time.monotonic()
+        while not self._closed.wait(min(AGGREGATE_INTERVAL, self.flush_interval)):
+            try:
+                if time.monotonic() - last_flush < self.flush_interval:
+                    self.aggregate()
+                    continue
+                last_flush = time.monotonic()
+                self.flush()
+            except sqlite3.Error:
+                pass  # Já registrado em flush(); tenta de novo no próximo ciclo
+            except Exception as e:
+                logger.error(f"Erro inesperado na gravação das métricas dos fluxos: {e}", exc_info=True)
+
+    def close(self):
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=5)
+        if self.enabled:
+            try:
+                self.flush()
+            except sqlite3.Error:
+                pass
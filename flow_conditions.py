@@ -0,0 +1,240 @@
+# flow_conditions.py
+# Linguagem de condições das edges (edge.data.condition), compilada uma vez no carregamento do fluxo.
+#
+# Sintaxe (comparações de texto ignoram maiúsculas/minúsculas e espaços nas pontas):
+#   sim                  igualdade com a mensagem (comportamento original)
+#   = sim  /  == sim     igualdade explícita (permite valores que começam com operadores)
+#   != sim               diferente de
+#   contains:promo       a mensagem contém o texto
+#   startswith:oi        a mensagem começa com o texto
+#   endswith:obrigado    a mensagem termina com o texto
+#   in:sim|s|yes         conjunto de palavras-chave (separadas por | ou ,)
+#   regex:^\d{5}-?\d{3}$ expressão regular (também aceita /padrão/)
+#   > 10, >= 10, < 5, <= 5   comparação numérica (aceita vírgula decimal)
+#   isset / isnotset     a variável está (ou não) definida
+#
+# Prefixo {{variavel}} aplica a condição a uma variável da sessão em vez da mensagem:
+#   {{idade}} >= 18      {{cidade}} in:sp|são paulo      {{email}} isset
+# O valor comparado também pode referenciar variáveis: {{plano}} == {{plano_escolhido}}
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+_SUBJECT_RE = re.compile(r"^\{\{\s*([\w.-]+)\s*\}\}\s*(.*)$", re.DOTALL)
+VARIABLE_RE = re.compile(r"\{\{\s*([\w.-]+)\s*\}\}")
+_NUMERIC_OPS = {
+    ">=": lambda a, b: a >= b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    "<": lambda a, b: a < b,
+}
+_PREFIX_OPS = ("contains:", "startswith:", "endswith:", "in:", "regex:")
+
+
+def parse_number(value) -> float | None:
+    """Converte '18', '18,5' ou '1.5' em float; None se não for numérico."""
+    if value is None:
+        return None
+    try:
+        return float(str(value).strip().replace(",", "."))
+    except ValueError:
+        return None
+
+
+def render_variables(text: str, variables: dict | None) -> str:
+    """Substitui {{variavel}} pelos valores da sessão (variáveis ausentes viram texto vazio)."""
+    if not variables:
+        return VARIABLE_RE.sub("", text)
+    return VARIABLE_RE.sub(lambda m: str(variables.get(m.group(1), "")), text)
+
+
+class Condition:
+    """Condição compilada. hash_keys != None indica igualdade/conjunto sobre a mensagem,
+    que pode ser resolvida por consulta em dicionário (ver EdgeRouter)."""
+    __slots__ = ("source", "kind", "variable", "hash_keys", "_test")
+
+    def __init__(self, source: str, kind: str, test, variable: str | None = None, hash_keys: frozenset | None = None):
+        self.source = source
+        self.kind = kind
+        self.variable = variable
+        self.hash_keys = hash_keys
+        self._test = test
+
+    def matches(self, message: str, message_clean: str, variables: dict | None = None) -> bool:
+        """message: texto com strip(); message_clean: texto com strip().lower()."""
+        if self.variable is not None:
+            value = (variables or {}).get(self.variable)
+            text = "" if value is None else str(value).strip()
+            return self._test(text, text.lower(), value is not None, variables)
+        return self._test(message, message_clean, True, variables)
+
+    def __repr__(self):
+        return f"Condition({self.kind}: {self.source!r})"
+
+
+def _never(text, text_clean, is_set, variables):
+    return False
+
+
+def _operand(raw: str):
+    """Retorna uma função que produz o operando normalizado (estático ou com {{variáveis}})."""
+    raw = raw.strip()
+    if VARIABLE_RE.search(raw):
+        return lambda variables: render_variables(raw, variables).strip().lower()
+    value = raw.lower()
+    return lambda variables: value
+
+
+def compile_condition(condition: str) -> Condition | None:
+    """Compila o texto da condição. Retorna None para condição vazia (edge padrão).
+
+    Condições inválidas (ex.: regex malformada) são registradas e nunca são satisfeitas,
+    para não impedir o carregamento do fluxo inteiro.
+    """
+    if not condition:
+        return None
+    source = str(condition)
+    expr = source.strip()
+    variable = None
+    subject_match = _SUBJECT_RE.match(expr)
+    if subject_match:
+        variable, expr = subject_match.group(1), subject_match.group(2).strip()
+        if not expr:
+            expr = "isset"
+
+    lowered = expr.lower()
+    dynamic = bool(VARIABLE_RE.search(expr))
+
+    if lowered in ("isset", "isnotset"):
+        expected = lowered == "isset"
+        return Condition(source, lowered, lambda t, tc, is_set, v: is_set == expected, variable)
+
+    for prefix in _PREFIX_OPS:
+        if lowered.startswith(prefix):
+            arg = expr[len(prefix):].strip()
+            kind = prefix[:-1]
+            if kind == "regex":
+                return _compile_regex(source, arg, variable)
+            if kind == "in":
+                keywords = frozenset(k.strip().lower() for k in re.split(r"[|,]", arg) if k.strip())
+                if dynamic:
+                    keywords_fn = lambda v: {k.strip().lower() for k in re.split(r"[|,]", render_variables(arg, v)) if k.strip()}
+                    return Condition(source, kind, lambda t, tc, is_set, v: tc in keywords_fn(v), variable)
+                return Condition(source, kind, lambda t, tc, is_set, v: tc in keywords, variable,
+                                 hash_keys=keywords if variable is None else None)
+            operand = _operand(arg)
+            if kind == "contains":
+                return Condition(source, kind, lambda t, tc, is_set, v: operand(v) in tc, variable)
+            if kind == "startswith":
+                return Condition(source, kind, lambda t, tc, is_set, v: tc.startswith(operand(v)), variable)
+            return Condition(source, kind, lambda t, tc, is_set, v: tc.endswith(operand(v)), variable)
+
+    if len(expr) > 2 and expr.startswith("/") and expr.endswith("/"):
+        return _compile_regex(source, expr[1:-1], variable)
+
+    for op, compare in _NUMERIC_OPS.items():
+        if expr.startswith(op):
+            return _compile_numeric(source, op, compare, expr[len(op):], variable)
+
+    if expr.startswith("!="):
+        operand = _operand(expr[2:])
+        return Condition(source, "ne", lambda t, tc, is_set, v: tc != operand(v), variable)
+
+    if expr.startswith("=="):
+        expr = expr[2:]
+    elif expr.startswith("="):
+        expr = expr[1:]
+    operand = _operand(expr)
+    if dynamic:
+        return Condition(source, "eq", lambda t, tc, is_set, v: tc == operand(v), variable)
+    value = operand(None)
+    return Condition(source, "eq", lambda t, tc, is_set, v: tc == value, variable,
+                     hash_keys=frozenset((value,)) if variable is None else None)
+
+
+# Comparações do nó "condition" do editor -> expressão equivalente nesta linguagem
+_NODE_COMPARISONS = {
+    "equals": "== {value}",
+    "contains": "contains:{value}",
+    "startsWith": "startswith:{value}",
+    "isSet": "isset",
+    "isNotSet": "isnotset",
+    "greaterThan": "> {value}",
+    "lessThan": "< {value}",
+}
+
+
+def compile_node_condition(data: dict) -> Condition | None:
+    """Compila um nó condition ({variableName, comparison, value}) numa condição sobre a variável."""
+    variable = (data.get("variableName") or "").strip()
+    template = _NODE_COMPARISONS.get(data.get("comparison") or "equals")
+    if not variable or template is None:
+        logger.error(f"Nó condition inválido (variável '{variable}', comparação '{data.get('comparison')}'). A condição nunca será satisfeita.")
+        return Condition(str(data), "invalid", _never)
+    return compile_condition(f"{{{{{variable}}}}} " + template.format(value=data.get("value") or ""))
+
+
+def _compile_regex(source: str, pattern: str, variable: str | None) -> Condition:
+    try:
+        regex = re.compile(pattern, re.IGNORECASE)
+    except re.error as e:
+        logger.error(f"Regex inválida na condição '{source}': {e}. A condição nunca será satisfeita.")
+        return Condition(source, "invalid", _never, variable)
+    return Condition(source, "regex", lambda t, tc, is_set, v: regex.search(t) is not None, variable)
+
+
+def _compile_numeric(source: str, op: str, compare, arg: str, variable: str | None) -> Condition:
+    arg = arg.strip()
+    if VARIABLE_RE.search(arg):
+        def test(t, tc, is_set, v):
+            left, right = parse_number(t), parse_number(render_variables(arg, v))
+            return left is not None and right is not None and compare(left, right)
+        return Condition(source, op, test, variable)
+    right = parse_number(arg)
+    if right is None:
+        logger.error(f"Valor numérico inválido na condição '{source}'. A condição nunca será satisfeita.")
+        return Condition(source, "invalid", _never, variable)
+
+    def test(t, tc, is_set, v):
+        left = parse_number(t)
+        return left is not None and compare(left, right)
+    return Condition(source, op, test, variable)
+
+
+class EdgeRouter:
+    """Seleção da edge de saída de um nó, preservando a prioridade pela ordem das edges.
+
+    Edges de igualdade/conjunto de palavras sobre a mensagem vão para um índice hash
+    {texto normalizado: posição}; as demais condições são avaliadas em sequência, mas só
+    as que aparecem antes da posição encontrada no índice. Menus com dezenas de opções
+    resolvem com uma consulta em dicionário.
+    """
+    __slots__ = ("edges", "keyword_index", "scan", "default_edge")
+
+    def __init__(self, edges: tuple):
+        self.edges = edges
+        self.keyword_index = {}  # {texto normalizado: posição da primeira edge que o aceita}
+        scan = []
+        self.default_edge = None
+        for position, edge in enumerate(edges):
+            if edge.matcher is None:
+                if self.default_edge is None:
+                    self.default_edge = edge
+            elif edge.matcher.hash_keys is not None:
+                for key in edge.matcher.hash_keys:
+                    self.keyword_index.setdefault(key, position)
+            else:
+                scan.append((position, edge))
+        self.scan = tuple(scan)
+
+    def select(self, message: str, message_clean: str, variables: dict | None = None):
+        hit = self.keyword_index.get(message_clean, len(self.edges))
+        for position, edge in self.scan:
+            if position > hit:
+                break
+            if edge.matcher.matches(message, message_clean, variables):
+                return edge
+        if hit < len(self.edges):
+            return self.edges[hit]
+        return self.default_edge
@@ -5,7 +5,21 @@ import logging
 import os
 import sqlite3
 import json
-from logging.handlers import RotatingFileHandler
+import atexit
+import functools
+import queue
+import time
+import urllib.error
+import urllib.request
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from flow_analytics import DEFAULT_ANALYTICS_FLUSH_INTERVAL, FlowAnalytics
+from flow_conditions import compile_condition
+from flow_engine import DEFAULT_MAX_STEPS, FlowEngine, WalkResult
+from flow_graph import CompiledFlow
+from flow_registry import DEFAULT_MAX_COMPILED_FLOWS, DEFAULT_MAX_PINNED_VERSIONS, DEFAULT_POLL_INTERVAL, FlowRegistry, FlowReloadWatcher
+from flow_scheduler import DEFAULT_TIMER_WORKERS, TimerScheduler
+from service_metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsRegistry, SlowRequestProfiler, add_process_metrics
+from session_store import DEFAULT_FLUSH_INTERVAL, DEFAULT_LOCK_STRIPES, DEFAULT_MAX_SESSIONS, DEFAULT_SESSION_TTL, SenderLocks, SessionBatch, create_session_store
 
 app = Flask(__name__)
 
@@ -15,306 +29,539 @@ log_file_path = os.path.join(os.path.dirname(__file__), 'flow_controller.log') #
 log_handler = RotatingFileHandler(log_file_path, maxBytes=10*1024*1024, backupCount=3) # 10MB por arquivo, 3 backups
 log_handler.setFormatter(log_formatter)
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO) # Mude para DEBUG para mais detalhes
-logger.addHandler(log_handler)
+# Nível e handlers ficam no logger raiz: os módulos do serviço (flow_registry, session_store,
+# flow_scheduler, ...) registram com logging.getLogger(__name__) e também vão para o arquivo
+root_logger = logging.getLogger()
+root_logger.setLevel(os.environ.get("FLOW_LOG_LEVEL", "INFO").upper()) # DEBUG para mais detalhes; WARNING em produção
 # Adiciona também um handler para o console
 console_handler = logging.StreamHandler()
 console_handler.setFormatter(log_formatter)
-logger.addHandler(console_handler)
+# Arquivo e console são escritos por uma thread própria: o processamento das mensagens só enfileira o registro
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(log_queue, log_handler, console_handler)
+root_logger.addHandler(QueueHandler(log_queue))
+log_listener.start()
+atexit.register(log_listener.stop) # Registrado antes dos demais: roda por último e grava os logs finais
 logger.info("Logging configurado.")
 
 
 # --- Configuração do Banco de Dados ---
 # Assume que database.db está na MESMA pasta que este script .py
-DATABASE_PATH = os.path.join(os.path.dirname(__file__), 'database.db')
+DATABASE_PATH = os.environ.get("FLOW_DATABASE_PATH", os.path.join(os.path.dirname(__file__), 'database.db')) # FLOW_DATABASE_PATH: outro banco (ex.: testes de carga)
 logger.info(f"Caminho do banco de dados SQLite configurado para: {DATABASE_PATH}")
 
 # --- Armazenamento de Estado e Fluxo ---
-user_states = {} # {sender_id: current_node_id}
-current_flow_definition = { # Definição carregada do DB
-    "id": None,
-    "name": None,
-    "nodes": {}, # {node_id: node_data}
-    "edges": [], # [edge_data]
-    "start_node_id": None
-}
-
-def load_flow_from_db():
-    """Carrega a definição do fluxo ativo do banco de dados SQLite."""
-    global current_flow_definition
-    logger.info(f"Tentando carregar fluxo ativo do banco de dados: {DATABASE_PATH}")
-    conn = None
-    try:
-        if not os.path.exists(DATABASE_PATH):
-            logger.error(f"Arquivo do banco de dados NÃO ENCONTRADO em: {DATABASE_PATH}")
-            current_flow_definition = {"id": None, "name": None, "nodes": {}, "edges": [], "start_node_id": None}
-            return False
-
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        # Busca o fluxo marcado como 'active'
-        cursor.execute("SELECT id, name, elements FROM flows WHERE status = 'active' LIMIT 1")
-        row = cursor.fetchone()
-
-        if row:
-            flow_id, flow_name, elements_json = row
-            logger.info(f"Fluxo ativo encontrado: ID={flow_id}, Nome='{flow_name}'")
+# Sessões: {sender_id: {"flow_id": ..., "version": ..., "node_id": ...}} - fluxo/versão em que o remetente está
+# FLOW_SESSION_STORE=memory (padrão, TTL + LRU) ou sqlite (tabela flow_sessions no database.db,
+# compartilhada entre workers do gunicorn e preservada entre reinícios)
+# FLOW_SESSION_FLUSH_INTERVAL > 0 ativa a escrita em lote do sqlite, que só vale para um único worker
+session_flush_interval = float(os.environ.get("FLOW_SESSION_FLUSH_INTERVAL", DEFAULT_FLUSH_INTERVAL))
+if session_flush_interval > 0 and int(os.environ.get("WEB_CONCURRENCY", 1)) > 1:
+    logger.warning(f"FLOW_SESSION_FLUSH_INTERVAL={session_flush_interval} ignorado com WEB_CONCURRENCY={os.environ['WEB_CONCURRENCY']}: "
+                   "com vários workers as sessões são gravadas na hora (write-through).")
+    session_flush_interval = 0.0
+user_states = create_session_store(
+    os.environ.get("FLOW_SESSION_STORE", "memory"),
+    DATABASE_PATH,
+    ttl_seconds=float(os.environ.get("FLOW_SESSION_TTL", DEFAULT_SESSION_TTL)),
+    max_sessions=int(os.environ.get("FLOW_MAX_SESSIONS", DEFAULT_MAX_SESSIONS)),
+    flush_interval=session_flush_interval,
+)
+atexit.register(user_states.close)
+EMPTY_RESPONSE = b"{}"
+MISSING_SENDER_RESULT = b'{"status": 400, "error": "sender_id is required"}'
+MAX_BATCH_MESSAGES = int(os.environ.get("FLOW_MAX_BATCH_MESSAGES", 5000)) # Limite de mensagens por chamada a /process_messages
+# Mensagens do mesmo remetente são processadas em ordem, uma por vez (servidor com threads ou ASGI)
+sender_locks = SenderLocks(int(os.environ.get("FLOW_SENDER_LOCK_STRIPES", DEFAULT_LOCK_STRIPES)))
+# Todos os fluxos ativos, por flows.id / campaign_id, compilados sob demanda (LRU limitado)
+flow_registry = FlowRegistry(DATABASE_PATH, max_compiled=int(os.environ.get("FLOW_MAX_COMPILED", DEFAULT_MAX_COMPILED_FLOWS)),
+                             max_pinned_versions=int(os.environ.get("FLOW_MAX_PINNED_VERSIONS", DEFAULT_MAX_PINNED_VERSIONS)))
+flow_watcher = None # FlowReloadWatcher iniciado em start_flow_watcher()
+# Motor de execução: percorre nós lógicos e mensagens encadeadas até um nó que espera o usuário
+# (FLOW_MAX_STEPS nós por mensagem no máximo). goToFlow só aceita fluxos ativos por flows.id.
+flow_engine = FlowEngine(lambda target_flow_id: flow_registry.get(flow_registry.resolve_flow_id(flow_id=target_flow_id))
+                         if target_flow_id not in (None, "") else None,
+                         max_steps=int(os.environ.get("FLOW_MAX_STEPS", DEFAULT_MAX_STEPS)))
+# Continuações de delays e timeouts de waitInput; as mensagens vão direto para a API do bot (POST /send)
+flow_timers = TimerScheduler(workers=int(os.environ.get("FLOW_TIMER_WORKERS", DEFAULT_TIMER_WORKERS)))
+atexit.register(flow_timers.close)
+BOT_API_URL = os.environ.get("WHATSAPP_BOT_API_URL", "http://localhost:3001") # Mesma variável do lib/whatsappSender.ts
+BOT_SEND_TIMEOUT = float(os.environ.get("FLOW_BOT_SEND_TIMEOUT", 15))
+# Contadores por nó/aresta de cada versão de fluxo, gravados em lote nas tabelas flow_node_stats e
+# flow_edge_stats (FLOW_ANALYTICS=0 desliga; FLOW_ANALYTICS_FLUSH_INTERVAL em segundos)
+flow_analytics = FlowAnalytics(DATABASE_PATH, enabled=os.environ.get("FLOW_ANALYTICS", "1") != "0",
+                               flush_interval=float(os.environ.get("FLOW_ANALYTICS_FLUSH_INTERVAL", DEFAULT_ANALYTICS_FLUSH_INTERVAL)))
+atexit.register(flow_analytics.close)
+
+# --- Métricas (/metrics, formato Prometheus) ---
+metrics = MetricsRegistry()
+add_process_metrics(metrics)
+request_latency = metrics.histogram("flow_request_duration_seconds", "Tempo de processamento por endpoint (sem o HTTP).", ("endpoint",))
+requests_total = metrics.counter("flow_requests_total", "Requisições por endpoint e status.", ("endpoint", "status"))
+batch_messages = metrics.histogram("flow_batch_messages", "Mensagens por chamada a /process_messages.",
+                                   buckets=(1, 5, 10, 50, 100, 500, 1000, 5000))
+reload_latency = metrics.histogram("flow_reload_duration_seconds", "Duração das recargas do registro de fluxos (manuais e automáticas).")
+reloads_total = metrics.counter("flow_reloads_total", "Recargas do registro de fluxos por resultado.", ("result",))
+metrics.gauge("flow_active_sessions", "Sessões de conversa ativas.", callback=lambda: len(user_states))
+metrics.gauge("flow_active_flows", "Fluxos com status 'active'.", callback=lambda: len(flow_registry.flow_infos()))
+metrics.gauge("flow_compiled_flows", "Grafos compilados em memória (versão corrente).", callback=flow_registry.compiled_count)
+metrics.gauge("flow_pinned_versions", "Versões anteriores fixadas para sessões em andamento.", callback=flow_registry.pinned_count)
+metrics.gauge("flow_pending_timers", "Delays e timeouts de waitInput agendados.", callback=flow_timers.pending)
+metrics.counter("flow_timers_fired_total", "Timers de delay/timeout disparados.", callback=lambda: flow_timers.fired)
+
+def _observe_reload(elapsed: float, succeeded: bool):
+    reload_latency.observe(elapsed)
+    reloads_total.inc(labels=("ok" if succeeded else "error",))
+
+flow_registry.on_refresh = _observe_reload
+# Profiling opcional: FLOW_PROFILE_SLOW_MS > 0 grava um .prof (cProfile) de cada requisição que
+# passar desse tempo em FLOW_PROFILE_DIR; FLOW_PROFILE_SAMPLE_RATE perfila só uma fração delas
+request_profiler = SlowRequestProfiler(float(os.environ.get("FLOW_PROFILE_SLOW_MS", 0)),
+                                       os.environ.get("FLOW_PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles")),
+                                       sample_rate=float(os.environ.get("FLOW_PROFILE_SAMPLE_RATE", 1)), name="flow")
+
+def instrumented(endpoint: str):
+    """Mede latência e status de um handler que retorna (corpo, status), com profiling opcional."""
+    labels = (endpoint,)
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            started_at = time.perf_counter()
+            status = 500
             try:
-                elements = json.loads(elements_json)
-                nodes_list = elements.get('nodes', [])
-                edges_list = elements.get('edges', [])
-
-                # Validação básica da estrutura
-                if not isinstance(nodes_list, list) or not isinstance(edges_list, list):
-                     raise ValueError("Estrutura de 'nodes' ou 'edges' inválida no JSON.")
-
-                nodes_dict = {node['id']: node for node in nodes_list if 'id' in node} # Cria dicionário de nós por ID
-
-                # Encontra o nó inicial
-                # 1. Procura por um nó com ID específico 'start-node' (convenção comum)
-                start_node = nodes_dict.get('start-node')
-                # 2. Se não encontrar, procura pelo primeiro nó do tipo 'input' (outra convenção)
-                if not start_node:
-                    start_node = next((node for node in nodes_list if node.get('type') == 'input'), None)
-                # 3. Se ainda não encontrar, pega o primeiro nó da lista como fallback
-                if not start_node and nodes_list:
-                    start_node = nodes_list[0]
-                    logger.warning(f"Nó inicial 'start-node' ou tipo 'input' não encontrado. Usando o primeiro nó da lista como fallback: {start_node.get('id')}")
-
-                current_flow_definition = {
-                    "id": flow_id,
-                    "name": flow_name,
-                    "nodes": nodes_dict,
-                    "edges": edges_list,
-                    "start_node_id": start_node['id'] if start_node else None
-                }
-
-                if not current_flow_definition['start_node_id']:
-                     logger.error("Não foi possível determinar um nó inicial para o fluxo!")
-                     return False
-
-                logger.info(f"Fluxo '{flow_name}' (ID: {flow_id}) carregado com {len(nodes_dict)} nós e {len(edges_list)} arestas. Nó inicial: {current_flow_definition['start_node_id']}")
-                return True
-
-            except json.JSONDecodeError as e:
-                logger.error(f"Erro ao decodificar JSON do fluxo ID {flow_id}: {e}")
-                current_flow_definition = {"id": None, "name": None, "nodes": {}, "edges": [], "start_node_id": None}
-                return False
-            except Exception as e:
-                 logger.error(f"Erro inesperado ao processar elementos do fluxo ID {flow_id}: {e}", exc_info=True)
-                 current_flow_definition = {"id": None, "name": None, "nodes": {}, "edges": [], "start_node_id": None}
-                 return False
-        else:
-            logger.warning("Nenhum fluxo com status 'active' encontrado no banco de dados.")
-            current_flow_definition = {"id": None, "name": None, "nodes": {}, "edges": [], "start_node_id": None}
-            return False
-
+                if request_profiler.enabled:
+                    with request_profiler.profile(endpoint):
+                        response_data, status = handler(*args, **kwargs)
+                else:
+                    response_data, status = handler(*args, **kwargs)
+                return response_data, status
+            finally:
+                request_latency.observe(time.perf_counter() - started_at, labels)
+                requests_total.inc(labels=(endpoint, status))
+        return wrapper
+    return decorator
+
+def load_flow_from_db(force: bool = False):
+    """Carrega os metadados de todos os fluxos ativos do banco de dados SQLite (force: recompila os já compilados)."""
+    logger.info(f"Tentando carregar fluxos ativos do banco de dados: {DATABASE_PATH}")
+    flow_registry.database_path = DATABASE_PATH
+    flow_analytics.database_path = DATABASE_PATH
+    if not os.path.exists(DATABASE_PATH):
+        logger.error(f"Arquivo do banco de dados NÃO ENCONTRADO em: {DATABASE_PATH}")
+        return False
+    try:
+        active_count = flow_registry.refresh(force)
     except sqlite3.Error as e:
-        logger.error(f"Erro de banco de dados ao carregar fluxo: {e}")
-        current_flow_definition = {"id": None, "name": None, "nodes": {}, "edges": [], "start_node_id": None}
+        logger.error(f"Erro de banco de dados ao carregar fluxos: {e}")
         return False
-    finally:
-        if conn:
-            conn.close()
-            logger.debug("Conexão com o banco de dados fechada.")
-
-def get_node_by_id(node_id: str):
-    """Busca a definição do nó pelo ID na definição carregada."""
-    if not node_id: return None
-    return current_flow_definition["nodes"].get(node_id)
-
-def get_response_message_for_node(node_id: str) -> dict | None:
-    """Obtém o payload da mensagem a ser enviada para um nó específico."""
-    node = get_node_by_id(node_id)
-    if not node: return None
-
-    node_type = node.get("type")
-    node_data = node.get("data", {})
-
-    if node_type == "textMessage":
-        text = node_data.get("text")
-        return {"text": text} if text else None
-    elif node_type == "imageMessage":
-        url = node_data.get("url")
-        caption = node_data.get("caption")
-        if not url: return None
-        message = {"image": {"url": url}}
-        if caption: message["caption"] = caption
-        return message
-    elif node_type == "buttonMessage":
-        text = node_data.get("text", "")
-        buttons_data = node_data.get("buttons", [])
-        # Formato Baileys para botões simples (pode precisar de adaptação)
-        buttons_payload = [{"buttonId": btn.get("id", f"btn_{i}"), "buttonText": {"displayText": btn.get("text", f"Opção {i+1}")}, "type": 1} for i, btn in enumerate(buttons_data)]
-        if not text or not buttons_payload: return None # Precisa de texto e botões
-        return {"text": text, "buttons": buttons_payload, "headerType": 1} # Exemplo simples
-    elif node_type == "listMessage":
-        text = node_data.get("text", "")
-        title = node_data.get("title", "Opções")
-        buttonText = node_data.get("buttonText", "Ver Opções")
-        sections_data = node_data.get("sections", [])
-        if not sections_data: return None
-        # Formato Baileys para listas
-        sections_payload = [{
-            "title": sec.get("title", f"Seção {i+1}"),
-            "rows": [{"title": row.get("title", f"Item {j+1}"), "rowId": row.get("id", f"row_{i}_{j}"), "description": row.get("description", "")} for j, row in enumerate(sec.get("rows", []))]
-        } for i, sec in enumerate(sections_data)]
-        return {"text": text, "footer": "", "title": title, "buttonText": buttonText, "sections": sections_payload}
-
-    # Outros tipos de nós (lógicos, de espera) não geram mensagem direta
-    logger.debug(f"Nó tipo '{node_type}' (ID: {node_id}) não gera mensagem de resposta direta.")
-    return None
-
+    if not active_count:
+        logger.warning("Nenhum fluxo com status 'active' encontrado no banco de dados.")
+        return False
+    # O fluxo padrão é compilado já na carga (os demais, sob demanda): um fluxo ativo inválido é reportado aqui
+    if flow_registry.get(flow_registry.default_flow_id) is None:
+        logger.error(f"Fluxo padrão (ID: {flow_registry.default_flow_id}) não pôde ser compilado.")
+        return False
+    failed_flow_ids = flow_registry.failed_flow_ids()
+    if failed_flow_ids:
+        logger.error(f"Fluxo(s) ativo(s) com erro de compilação: {failed_flow_ids}.")
+        return False
+    return True
+
+def start_flow_watcher():
+    """Inicia o monitoramento das versões dos fluxos ativos (recarga automática em segundo plano)."""
+    global flow_watcher
+    interval = float(os.environ.get("FLOW_POLL_INTERVAL", DEFAULT_POLL_INTERVAL))
+    if interval <= 0 or flow_watcher is not None:
+        return
+    flow_watcher = FlowReloadWatcher(flow_registry, interval)
+    flow_watcher.start()
+
+def resolve_flow(state: dict | None, flow_id=None, campaign_id=None) -> CompiledFlow | None:
+    """Escolhe o fluxo da mensagem: flow_id/campaign_id explícitos, senão o fluxo da sessão, senão o padrão."""
+    if flow_id is None and campaign_id is None and state and flow_registry.is_active(state["flow_id"]):
+        return flow_registry.get(state["flow_id"])
+    return flow_registry.get(flow_registry.resolve_flow_id(flow_id, campaign_id))
+
+def resume_session(state: dict | None, flow: CompiledFlow) -> tuple[CompiledFlow, str]:
+    """Retoma a sessão no fluxo resolvido, tratando sessões criadas em versões anteriores.
+
+    Se o nó atual ainda existe na versão corrente, a sessão migra para ela; senão continua na
+    versão fixada (se ainda disponível) ou reinicia no nó inicial.
+    """
+    if not state or state["flow_id"] != flow.id:
+        return flow, flow.start_node_id
+    node_id = state["node_id"]
+    if state["version"] == flow.version or node_id in flow.nodes:
+        return flow, node_id
+    pinned = flow_registry.get_version(flow.id, state["version"])
+    if pinned is not None:
+        logger.debug(f"Sessão no nó {node_id} continua na versão fixada {pinned.version} do fluxo {flow.id}.")
+        return pinned, node_id
+    logger.info(f"Nó {node_id} não existe na versão {flow.version} do fluxo {flow.id} e a versão {state['version']} expirou. Reiniciando.")
+    return flow, flow.start_node_id
+
+def capture_variable(flow: CompiledFlow, node_id: str, message_text: str, variables: dict):
+    """Se o nó atual espera entrada (waitInput), guarda a mensagem na variável configurada."""
+    node = flow.get_node(node_id)
+    if node and node.get("type") == "waitInput":
+        variable_name = (node.get("data") or {}).get("variableName")
+        if variable_name:
+            variables[variable_name] = message_text
+
+def get_node_by_id(node_id: str, flow: CompiledFlow | None = None):
+    """Busca a definição do nó pelo ID no fluxo informado (ou no fluxo padrão)."""
+    flow = flow or flow_registry.get(flow_registry.default_flow_id)
+    if not node_id or flow is None: return None
+    return flow.get_node(node_id)
+
+def get_response_message_for_node(node_id: str, flow: CompiledFlow | None = None, variables: dict | None = None) -> dict | None:
+    """Obtém o payload da mensagem a ser enviada para um nó específico (pré-computado na compilação)."""
+    flow = flow or flow_registry.get(flow_registry.default_flow_id)
+    payload = flow.get_payload(node_id) if flow is not None and node_id else None
+    if payload is None:
+        # Nós lógicos/de espera (ou inexistentes) não geram mensagem direta
+        logger.debug(f"Nó {node_id} não gera mensagem de resposta direta.")
+        return None
+    return payload.render_data(variables)
+
+def response_body(payloads: list) -> bytes:
+    """Corpo JSON de /process_message montado a partir dos payloads já serializados.
+
+    response_payloads traz todas as mensagens da execução, na ordem de envio; response_payload
+    (a primeira) é mantido para clientes que enviam uma mensagem por chamada.
+    """
+    if not payloads:
+        return EMPTY_RESPONSE
+    return b'{"response_payload": ' + payloads[0] + b', "response_payloads": [' + b", ".join(payloads) + b']}'
+
+
+@functools.lru_cache(maxsize=1024)
+def _compiled_condition(condition: str):
+    return compile_condition(condition)
 
 def evaluate_condition(condition: str, user_message: str, variables: dict) -> bool:
-    """Avalia uma condição. Por enquanto, verifica apenas igualdade ou se a condição está vazia."""
-    if not condition:
+    """Avalia uma condição avulsa (sintaxe em flow_conditions.py). Condição vazia é verdadeira.
+
+    O caminho quente usa as condições já compiladas no grafo (CompiledFlow.select_edge).
+    """
+    matcher = _compiled_condition(condition) if condition else None
+    if matcher is None:
         logger.debug("Condição vazia, retornando True (padrão).")
         return True # Condição vazia é considerada verdadeira
-
-    # Limpa a mensagem do usuário e a condição para comparação simples
-    user_msg_clean = user_message.strip().lower()
-    condition_clean = condition.strip().lower()
-
-    # Comparação simples de igualdade (case-insensitive)
-    is_match = user_msg_clean == condition_clean
-    logger.debug(f"Avaliando condição: '{condition_clean}' == '{user_msg_clean}' -> {is_match}")
+    user_message = user_message.strip()
+    is_match = matcher.matches(user_message, user_message.lower(), variables)
+    logger.debug(f"Avaliando condição {matcher!r} para '{user_message}' -> {is_match}")
     return is_match
-    # TODO: Implementar lógica mais robusta aqui se necessário (regex, contains, >, <, etc.)
 
 
-def determine_next_node(current_node_id: str, user_message: str) -> str | None:
-    """Determina o próximo nó baseado nas edges e condições."""
-    start_node_id = current_flow_definition.get("start_node_id")
+def determine_next_node(current_node_id: str, user_message: str, flow: CompiledFlow | None = None, variables: dict | None = None) -> str | None:
+    """Determina o próximo nó baseado nas edges e condições (consultas O(1) no grafo compilado)."""
+    flow = flow or flow_registry.get(flow_registry.default_flow_id)
+    start_node_id = flow.start_node_id if flow is not None else None
     if not current_node_id or not start_node_id:
         logger.warning("Fluxo não carregado ou ID do nó atual inválido, reiniciando.")
         return start_node_id
 
     # Nós de input/início não têm edges de entrada relevantes para decisão aqui
-    current_node = get_node_by_id(current_node_id)
-    if not current_node:
+    if current_node_id not in flow.nodes:
          logger.error(f"Nó atual {current_node_id} não encontrado na definição do fluxo. Reiniciando.")
          return start_node_id
 
-    # A transição é determinada pelas EDGES que SAEM do nó atual
-    outgoing_edges = [edge for edge in current_flow_definition.get("edges", []) if edge.get('source') == current_node_id]
-    logger.debug(f"Edges saindo de {current_node_id}: {len(outgoing_edges)}")
-
-    if not outgoing_edges:
+    # A transição é determinada pelas EDGES que SAEM do nó atual (índice pré-computado)
+    if flow.is_end_node(current_node_id):
         logger.info(f"Nó {current_node_id} é um nó final (sem edges de saída).")
         return None # Nó final
 
-    # Prioriza edges com condição que corresponda à mensagem do usuário
-    matched_edge = None
-    for edge in outgoing_edges:
-        # A condição geralmente está em edge.data.condition ou similar
-        condition = edge.get('data', {}).get('condition', '')
-        logger.debug(f"Verificando edge (ID: {edge.get('id', 'N/A')}) de {current_node_id} para {edge.get('target')} com condição: '{condition}'")
-        # Simplificação: variáveis não usadas na condição por enquanto
-        if condition and evaluate_condition(condition, user_message, {}):
-            matched_edge = edge
-            logger.info(f"Condição da edge '{condition}' satisfeita para a mensagem '{user_message}'. Indo para {edge.get('target')}")
-            break # Usa a primeira condição que bater
-
-    # Se nenhuma condição específica bateu, procura uma edge sem condição (padrão)
+    # Prioriza a primeira edge com condição satisfeita; senão usa a edge padrão (sem condição)
+    matched_edge = flow.select_edge(current_node_id, user_message, variables)
     if not matched_edge:
-        default_edge = next((edge for edge in outgoing_edges if not edge.get('data', {}).get('condition')), None)
-        if default_edge:
-            matched_edge = default_edge
-            logger.info(f"Nenhuma condição específica satisfeita. Usando edge padrão para {matched_edge.get('target')}")
-        else:
-            # Se não há condição nem edge padrão, o fluxo pode estar "preso" ou esperando
-            # uma resposta específica que não foi dada.
-            logger.warning(f"Nenhuma edge de saída válida (condicional ou padrão) encontrada para o nó {current_node_id} com a mensagem '{user_message}'.")
-            # Decide o que fazer: repetir a mensagem anterior? enviar erro? voltar ao início?
-            # Retornar None indica que não há próximo passo definido para esta entrada.
-            # O webhook pode lidar com isso enviando uma msg padrão de "não entendi".
-            return None # Indica que não há transição definida para esta entrada
+        # Se não há condição nem edge padrão, o fluxo pode estar "preso" ou esperando
+        # uma resposta específica que não foi dada.
+        # Retornar None indica que não há próximo passo definido para esta entrada.
+        # O webhook pode lidar com isso enviando uma msg padrão de "não entendi".
+        logger.warning(f"Nenhuma edge de saída válida (condicional ou padrão) encontrada para o nó {current_node_id} com a mensagem '{user_message}'.")
+        return None
 
+    logger.debug(f"Edge {matched_edge.id} selecionada a partir de {current_node_id}. Indo para {matched_edge.target}")
+    return matched_edge.target
 
-    return matched_edge.get('target') if matched_edge else None
 
+@instrumented("process_message")
+def handle_message(data: dict) -> tuple[bytes | dict, int]:
+    """Processa uma mensagem recebida e retorna (corpo da resposta, status HTTP).
 
-@app.route('/process_message', methods=['POST'])
-def process_message():
-    data = request.json
+    O corpo vem já serializado (bytes) no caminho normal e como dict nas respostas de erro.
+
+    Núcleo compartilhado pelo servidor Flask e pelo modo ASGI (flow_controller_asgi.py).
+    """
     sender_id = data.get('sender_id') # Espera o JID completo (ex: 55119... @s.whatsapp.net)
     message_text = data.get('message', '')
     logger.info(f"API /process_message: Recebido de {sender_id}: '{message_text}'")
 
     if not sender_id:
         logger.error("API /process_message: sender_id faltando.")
-        return jsonify({"error": "sender_id is required"}), 400
-
-    start_node_id = current_flow_definition.get("start_node_id")
-    if not start_node_id:
+        return {"error": "sender_id is required"}, 400
+
+    # Leitura e gravação do estado do remetente acontecem sob o mesmo lock: sem corrida entre mensagens dele
+    # (sender_transaction estende isso aos demais workers que usam o mesmo banco de sessões)
+    with sender_locks(sender_id), user_states.sender_transaction(sender_id):
+        return _process_sender_message(sender_id, message_text, data.get('flow_id'), data.get('campaign_id'))
+
+def _process_sender_message(sender_id: str, message_text: str, flow_id=None, campaign_id=None, sessions=None,
+                            timers: list | None = None) -> tuple[bytes | dict, int]:
+    sessions = sessions if sessions is not None else user_states # SessionBatch em /process_messages
+    # Fluxo opcional por mensagem: flow_id ou campaign_id (senão segue o fluxo da sessão ou o padrão)
+    state = sessions.get(sender_id)
+    flow = resolve_flow(state, flow_id, campaign_id)
+    if flow is None:
          logger.error("API /process_message: Nenhum fluxo ativo carregado ou sem nó inicial definido.")
-         return jsonify({"response_message": "Desculpe, o sistema de fluxo não está configurado corretamente."}), 503
-
-    # Obtem o estado atual ou inicia o usuário no nó inicial do fluxo
-    current_node_id = user_states.get(sender_id, start_node_id)
-    logger.info(f"API /process_message: Estado atual de {sender_id}: {current_node_id}")
-
-    # Determina o próximo nó com base na mensagem recebida e no estado ATUAL
-    next_node_id = determine_next_node(current_node_id, message_text)
-    logger.info(f"API /process_message: Próximo nó determinado para {sender_id}: {next_node_id}")
-
-    response_payload = None # Payload completo da mensagem a ser enviada
-    if next_node_id:
-        # Obtem o payload da mensagem associada ao *próximo* nó
-        response_payload = get_response_message_for_node(next_node_id)
-        logger.info(f"API /process_message: Payload de resposta para {next_node_id}: {json.dumps(response_payload)}")
-
-        # Verifica se o próximo nó é final (sem edges de saída)
-        is_end_node = not any(edge.get('source') == next_node_id for edge in current_flow_definition.get("edges", []))
-
-        if is_end_node:
-            logger.info(f"API /process_message: Fluxo encerrado para {sender_id} no nó final {next_node_id}.")
-            if sender_id in user_states:
-                del user_states[sender_id] # Limpa o estado
-        else:
-            # Atualiza o estado do usuário para o próximo nó
-            user_states[sender_id] = next_node_id
-            logger.info(f"API /process_message: Estado atualizado para {sender_id}: {next_node_id}")
-
+         return {"response_message": "Desculpe, o sistema de fluxo não está configurado corretamente."}, 503
+
+    # Obtem o estado atual (na versão fixada da sessão) ou inicia o usuário no nó inicial do fluxo
+    flow, current_node_id = resume_session(state, flow)
+    logger.info(f"API /process_message: Estado atual de {sender_id}: fluxo {flow.id}, nó {current_node_id}")
+
+    # Variáveis da sessão (usadas nas condições); nós waitInput guardam a resposta em variableName
+    variables = dict(state.get("variables", {})) if state and state["flow_id"] == flow.id else {}
+
+    origin = (flow.id, flow.version, current_node_id) # Nó em que a mensagem chegou (métricas)
+    no_match = False
+    resume_at = state.get("resume_at") if state and state["flow_id"] == flow.id and state["node_id"] == current_node_id else None
+    if resume_at is not None:
+        # Sessão pausada num nó delay: mensagens recebidas durante a pausa não mudam o fluxo
+        if resume_at > time.time():
+            logger.info(f"API /process_message: {sender_id} em pausa no nó {current_node_id}; mensagem ignorada.")
+            return EMPTY_RESPONSE, 200
+        # Timer perdido (ex.: reinício do processo): continua agora, a partir do delay
+        logger.info(f"API /process_message: Retomando {sender_id} após o delay no nó {current_node_id}.")
+        result = flow_engine.resume(flow, current_node_id, variables)
     else:
-        # O fluxo terminou (determine_next_node retornou None) ou não houve transição válida
-        logger.info(f"API /process_message: Nenhuma transição válida ou fim de fluxo para {sender_id} a partir do nó {current_node_id}.")
-        if sender_id in user_states:
-            del user_states[sender_id] # Limpa estado ao final ou em erro de transição
-        # Define uma mensagem padrão de "não entendi" ou "obrigado" se não houver payload
-        if not response_payload:
-             # Poderia ter uma mensagem padrão configurável
-             # response_payload = {"text": "Não entendi sua resposta. Poderia tentar novamente?"}
-             # Ou apenas não responde nada se for o fim real do fluxo
-             pass
+        capture_variable(flow, current_node_id, message_text, variables)
 
+        # Determina o próximo nó com base na mensagem recebida e no estado ATUAL
+        next_node_id = determine_next_node(current_node_id, message_text, flow, variables)
+        logger.info(f"API /process_message: Próximo nó determinado para {sender_id}: {next_node_id}")
+        no_match = next_node_id is None and not flow.is_end_node(current_node_id)
+
+        # Executa a partir do próximo nó até um nó que espera resposta (payloads pré-serializados,
+        # só as {{variáveis}} são preenchidas aqui)
+        result = flow_engine.walk(flow, next_node_id, variables)
+    save_walk_result(sender_id, result, variables, sessions, timers)
+    flow_analytics.record(origin, result.path, result.node_id is None, no_match, started=current_node_id == flow.start_node_id)
 
     # Monta a resposta para o Next.js
-    # Envia o payload completo da mensagem, não apenas o texto
-    response_data = {"response_payload": response_payload} if response_payload else {}
-    logger.info(f"API /process_message: Respondendo ao Next.js para {sender_id}: {json.dumps(response_data)}")
-    return jsonify(response_data)
+    # Envia os payloads completos das mensagens, não apenas o texto
+    response_data = response_body(result.payloads)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(f"API /process_message: Respondendo ao Next.js para {sender_id} ({result.steps} nó(s) executado(s)): {response_data.decode('utf-8')}")
+    return response_data, 200
+
+def save_walk_result(sender_id: str, result: WalkResult, variables: dict, sessions, timers: list | None = None):
+    """Grava onde a execução parou e agenda a continuação (delay ou timeout do waitInput).
+
+    Com timers (lista), o agendamento fica para depois do commit do lote em /process_messages.
+    """
+    due_at = None
+    if result.node_id is None:
+        logger.info(f"Fluxo encerrado para {sender_id}.")
+        sessions.delete(sender_id) # Limpa o estado
+    else:
+        # Atualiza o estado do usuário para o nó em que parou (com fluxo e versão em que ele está)
+        flow = result.flow
+        new_state = {"flow_id": flow.id, "version": flow.version, "node_id": result.node_id}
+        if variables:
+            new_state["variables"] = variables
+        if result.resume_at is not None:
+            new_state["resume_at"] = due_at = result.resume_at
+        elif result.timeout_at is not None:
+            new_state["timeout_at"] = due_at = result.timeout_at
+        sessions.set(sender_id, new_state)
+        logger.info(f"Estado atualizado para {sender_id}: {result.node_id}")
+    if timers is not None:
+        timers.append((sender_id, due_at))
+    else:
+        schedule_continuation(sender_id, due_at)
+
+def schedule_continuation(sender_id: str, due_at: float | None):
+    """Agenda continue_session para due_at; None cancela o timer pendente do remetente."""
+    if due_at is None:
+        flow_timers.cancel(sender_id)
+    else:
+        flow_timers.schedule(sender_id, due_at, functools.partial(continue_session, sender_id, due_at))
+
+def continue_session(sender_id: str, due_at: float):
+    """Timer vencido: continua a sessão após o delay (ou pela saída de timeout do waitInput)
+    e envia as mensagens geradas pela API do bot."""
+    with sender_locks(sender_id), user_states.sender_transaction(sender_id):
+        state = user_states.get(sender_id)
+        if not state or due_at not in (state.get("resume_at"), state.get("timeout_at")):
+            return # A sessão já avançou ou expirou desde o agendamento
+        flow = resolve_flow(state)
+        flow, node_id = resume_session(state, flow) if flow is not None else (None, None)
+        if flow is None or flow.id != state["flow_id"] or node_id != state["node_id"]:
+            logger.warning(f"Timer de {sender_id}: nó {state['node_id']} do fluxo {state['flow_id']} não está mais disponível. Encerrando a sessão.")
+            user_states.delete(sender_id)
+            return
+        variables = dict(state.get("variables", {}))
+        result = flow_engine.resume(flow, node_id, variables, timed_out=state.get("resume_at") != due_at)
+        save_walk_result(sender_id, result, variables, user_states)
+    flow_analytics.record((flow.id, flow.version, node_id), result.path, result.node_id is None)
+    logger.info(f"Timer de {sender_id}: {len(result.payloads)} mensagem(ns) após o nó {node_id}.")
+    for payload in result.payloads:
+        send_to_bot(sender_id, payload)
+
+def send_to_bot(sender_id: str, payload_json: bytes) -> bool:
+    """Envia uma mensagem pela API interna do bot (mesmo contrato do lib/whatsappSender.ts)."""
+    body = b'{"jid": ' + json.dumps(sender_id).encode("ascii") + b', "options": ' + payload_json + b'}'
+    send_request = urllib.request.Request(f"{BOT_API_URL}/send", data=body, headers={"Content-Type": "application/json"}, method="POST")
+    try:
+        with urllib.request.urlopen(send_request, timeout=BOT_SEND_TIMEOUT) as response:
+            response.read()
+        return True
+    except (urllib.error.URLError, OSError) as e:
+        logger.error(f"Falha ao enviar mensagem agendada para {sender_id} via {BOT_API_URL}/send: {e}")
+        return False
+
+@instrumented("process_messages")
+def handle_messages(items: list) -> tuple[bytes | dict, int]:
+    """Processa um lote de mensagens [{sender_id, message, ...}] na ordem recebida.
+
+    As mensagens são agrupadas por remetente e cada grupo roda só com o lock do seu remetente:
+    as dele avançam em sequência e os demais remetentes não esperam o lote inteiro. As sessões
+    de cada remetente são gravadas juntas (uma transação no backend SQLite) antes de liberar o
+    lock. Retorna um resultado por mensagem, na mesma ordem, com o status que /process_message
+    teria devolvido.
+    """
+    if len(items) > MAX_BATCH_MESSAGES:
+        return {"error": f"Lote com {len(items)} mensagens excede o limite de {MAX_BATCH_MESSAGES}."}, 413
+    batch_messages.observe(len(items))
+    results = [MISSING_SENDER_RESULT] * len(items)
+    by_sender = {} # {sender_id: [posições no lote]}, na ordem da primeira mensagem de cada um
+    for index, item in enumerate(items):
+        if isinstance(item, dict) and item.get('sender_id'):
+            by_sender.setdefault(item['sender_id'], []).append(index)
+    changed_sessions = 0
+    for sender_id, indexes in by_sender.items():
+        batch = SessionBatch(user_states)
+        timers = [] # (sender_id, vencimento): agendados só depois do commit do remetente
+        with sender_locks(sender_id), user_states.sender_transaction(sender_id):
+            for index in indexes:
+                item = items[index]
+                response_data, status = _process_sender_message(sender_id, item.get('message', ''), item.get('flow_id'),
+                                                                 item.get('campaign_id'), sessions=batch, timers=timers)
+                results[index] = _batch_result(sender_id, status, response_data)
+            changed_sessions += len(batch.changes)
+            batch.commit()
+            if timers:
+                schedule_continuation(sender_id, timers[-1][1]) # Vale o último agendamento
+    logger.info(f"API /process_messages: Lote de {len(items)} mensagem(ns) de {len(by_sender)} remetente(s) processado; "
+                f"{changed_sessions} sessão(ões) alterada(s).")
+    return b'{"results": [' + b", ".join(results) + b"]}", 200
+
+def _batch_result(sender_id: str, status: int, response_data: bytes | dict) -> bytes:
+    """Resultado de uma mensagem do lote: {"sender_id", "status", ...corpo de /process_message}."""
+    head = json.dumps({"sender_id": sender_id, "status": status}).encode("ascii")
+    if isinstance(response_data, dict):
+        response_data = json.dumps(response_data).encode("ascii")
+    if response_data == EMPTY_RESPONSE:
+        return head
+    return head[:-1] + b", " + response_data[1:] # Junta os dois objetos JSON sem desserializar o payload
+
+@instrumented("reload_flow")
+def reload_flows() -> tuple[dict, int]:
+    logger.info("API /reload_flow: Recebida solicitação para recarregar fluxos.")
+    # Recompila mesmo sem mudança de versão detectada: a recarga manual não depende do updated_at
+    success = load_flow_from_db(force=True)
+    if success:
+        # As sessões são preservadas: seguem na versão fixada ou migram para a nova versão
+        logger.info(f"API /reload_flow: Fluxos recarregados. {len(user_states)} sessão(ões) preservada(s).")
+        return {"message": "Fluxos ativos recarregados com sucesso."}, 200
+    failed_flow_ids = flow_registry.failed_flow_ids()
+    if failed_flow_ids:
+        # Fluxos já em uso seguem na versão anterior até a edição ser corrigida
+        return {"error": "Falha ao compilar fluxo(s) ativo(s).", "failed_flow_ids": failed_flow_ids}, 500
+    return {"error": "Falha ao recarregar fluxos ativos do banco de dados."}, 500
+
+def list_flows() -> dict:
+    """Lista os fluxos ativos atendidos por este processo."""
+    flows = [{"id": info.id, "name": info.name, "campaign_id": info.campaign_id, "version": info.version}
+             for info in flow_registry.flow_infos()]
+    return {"default_flow_id": flow_registry.default_flow_id, "compiled": flow_registry.compiled_count(),
+            "pinned_versions": flow_registry.pinned_count(), "flows": flows}
+
+
+def flow_funnel(flow_id: int, version: str | None = None) -> tuple[dict, int]:
+    """Funil de uma versão do fluxo: visitas, no-match, encerramentos e desistências por nó, e transições por aresta."""
+    try:
+        funnel = flow_analytics.funnel(flow_id, version)
+    except sqlite3.Error as e:
+        logger.error(f"API /flows/{flow_id}/funnel: Erro ao consultar as métricas: {e}")
+        return {"error": "Falha ao consultar as métricas do fluxo."}, 500
+    # Tipo e rótulo dos nós vêm da versão compilada, se ainda estiver disponível
+    flow = flow_registry.get(flow_id) if flow_registry.is_active(flow_id) else None
+    if flow is not None and flow.version != funnel["version"]:
+        flow = flow_registry.get_version(flow_id, funnel["version"])
+    sessions = 0
+    if flow is not None:
+        funnel["start_node_id"] = flow.start_node_id
+        for node in funnel["nodes"]:
+            definition = flow.get_node(node["node_id"]) or {}
+            node["type"] = definition.get("type")
+            node["label"] = (definition.get("data") or {}).get("label")
+            if node["node_id"] == flow.start_node_id:
+                sessions = node["visits"]
+    funnel["sessions"] = sessions
+    for node in funnel["nodes"]:
+        node["reach"] = node["visits"] / sessions if sessions else None # Fração das sessões que chegou ao nó
+    funnel["nodes"].sort(key=lambda node: node["visits"], reverse=True)
+    return funnel, 200
+
+
+def _json_response(response_data: bytes | dict, status: int):
+    if isinstance(response_data, bytes):
+        return app.response_class(response_data, status=status, mimetype="application/json")
+    return jsonify(response_data), status
+
+@app.route('/process_message', methods=['POST'])
+def process_message():
+    return _json_response(*handle_message(request.json or {}))
+
+@app.route('/process_messages', methods=['POST'])
+def process_messages():
+    data = request.get_json(silent=True)
+    items = data.get('messages') if isinstance(data, dict) else data # Aceita a lista pura ou {"messages": [...]}
+    if not isinstance(items, list):
+        return jsonify({"error": "Envie uma lista de mensagens [{sender_id, message}]"}), 400
+    return _json_response(*handle_messages(items))
 
 @app.route('/reload_flow', methods=['POST'])
 def reload_flow_endpoint():
-    logger.info("API /reload_flow: Recebida solicitação para recarregar fluxo.")
-    success = load_flow_from_db()
-    if success:
-        # Limpa todos os estados de usuário ao recarregar o fluxo
-        user_states.clear()
-        logger.info("API /reload_flow: Estados de usuário limpos após recarga.")
-        return jsonify({"message": "Fluxo ativo recarregado com sucesso."}), 200
-    else:
-        return jsonify({"error": "Falha ao recarregar fluxo ativo do banco de dados."}), 500
+    response_data, status = reload_flows()
+    return jsonify(response_data), status
+
+@app.route('/flows', methods=['GET'])
+def list_flows_endpoint():
+    return jsonify(list_flows())
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return app.response_class(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/flows/<int:flow_id>/funnel', methods=['GET'])
+def flow_funnel_endpoint(flow_id: int):
+    response_data, status = flow_funnel(flow_id, request.args.get('version'))
+    return jsonify(response_data), status
 
 
 if __name__ == '__main__':
-    # Carrega o fluxo inicial ao iniciar o servidor
+    # Carrega os fluxos ativos ao iniciar o servidor e passa a monitorar alterações
     load_flow_from_db()
+    start_flow_watcher()
 
     port = int(os.environ.get("FLOW_CONTROLLER_PORT", 5000))
     host = os.environ.get("HOST", "0.0.0.0") # Escuta em todas as interfaces por padrão
     logger.info(f"Iniciando Servidor de Fluxo Flask em http://{host}:{port}")
     # use_reloader=False é importante para não perder o estado em memória (user_states) durante o desenvolvimento
+    # (com FLOW_SESSION_STORE=sqlite as sessões sobrevivem a reinícios)
+    # Servidor de desenvolvimento; em produção use o modo ASGI: python flow_controller_asgi.py
     app.run(debug=True, port=port, host=host, use_reloader=False)
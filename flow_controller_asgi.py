@@ -0,0 +1,126 @@
+# flow_controller_asgi.py
+# Modo de produção do flow_controller: mesmas rotas, servidas por ASGI (uvicorn) em vez do
+# servidor de desenvolvimento do Flask. O processamento de cada mensagem é o mesmo
+# (flow_controller.handle_message). Com as sessões em memória ele roda direto no event loop
+# (dezenas de µs, sem I/O: o threadpool custaria mais que o processamento); com
+# FLOW_SESSION_STORE=sqlite, que lê e grava o banco, roda no threadpool para não bloquear o loop.
+# Mensagens do mesmo remetente são processadas na ordem de chegada, uma por vez (no threadpool,
+# via uma fila asyncio por remetente).
+#
+# Uso: python flow_controller_asgi.py   (ou: uvicorn flow_controller_asgi:app --port 5000)
+# Um processo por porta: a ordem por remetente vale dentro do processo. Para escalar em vários
+# processos use FLOW_SESSION_STORE=sqlite e distribua as mensagens por sender_id.
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response
+
+import flow_controller
+from flow_controller import (METRICS_CONTENT_TYPE, flow_funnel, handle_message, handle_messages, list_flows, load_flow_from_db, logger, metrics,
+                             reload_flows, start_flow_watcher)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await run_in_threadpool(load_flow_from_db)
+    start_flow_watcher()
+    yield
+    flow_controller.user_states.flush()
+
+
+app = FastAPI(title="Flow Controller", description="Processamento de mensagens dos fluxos do WhatsApp.", lifespan=lifespan)
+
+_sender_turns = {}  # {sender_id: [asyncio.Lock, requisições aguardando ou em andamento]}
+
+
+@asynccontextmanager
+async def _sender_turn(sender_id: str):
+    """Vez do remetente no event loop: asyncio.Lock é FIFO, então as mensagens dele seguem para o
+    threadpool na ordem de chegada. A entrada sai do dicionário quando não há mais ninguém na fila."""
+    entry = _sender_turns.get(sender_id)
+    if entry is None:
+        entry = _sender_turns[sender_id] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _sender_turns[sender_id]
+
+
+async def _json_body(request: Request):
+    try:
+        return await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None
+
+
+def _json_response(response_data: bytes | dict, status: int) -> Response:
+    # O caminho normal devolve o JSON pré-serializado pelo flow_controller; erros vêm como dict
+    if isinstance(response_data, bytes):
+        return Response(response_data, status_code=status, media_type="application/json")
+    return JSONResponse(response_data, status_code=status)
+
+
+@app.post("/process_message")
+async def process_message(request: Request):
+    data = await _json_body(request)
+    if not isinstance(data, dict):
+        return JSONResponse({"error": "JSON body is required"}, status_code=400)
+    sender_id = data.get("sender_id")
+    if not flow_controller.user_states.blocking_io or not isinstance(sender_id, str):
+        # Sem await entre ler e gravar a sessão: mensagens do mesmo remetente nunca se intercalam
+        return _json_response(*handle_message(data))
+    async with _sender_turn(sender_id):
+        return _json_response(*await run_in_threadpool(handle_message, data))
+
+
+@app.post("/process_messages")
+async def process_messages(request: Request):
+    data = await _json_body(request)
+    items = data.get("messages") if isinstance(data, dict) else data # Aceita a lista pura ou {"messages": [...]}
+    if not isinstance(items, list):
+        return JSONResponse({"error": "Envie uma lista de mensagens [{sender_id, message}]"}, status_code=400)
+    # Lotes grandes (e a gravação da transação) rodam fora do event loop; os locks por remetente
+    # impedem que mensagens avulsas dos mesmos remetentes se intercalem com o lote
+    return _json_response(*await run_in_threadpool(handle_messages, items))
+
+
+@app.post("/reload_flow")
+async def reload_flow_endpoint():
+    # Lê o banco: roda fora do event loop
+    response_data, status = await run_in_threadpool(reload_flows)
+    return JSONResponse(response_data, status_code=status)
+
+
+@app.get("/flows")
+async def list_flows_endpoint():
+    return list_flows()
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    # A contagem de sessões pode consultar o SQLite: roda fora do event loop
+    return Response(await run_in_threadpool(metrics.render), media_type=METRICS_CONTENT_TYPE)
+
+
+@app.get("/flows/{flow_id}/funnel")
+async def flow_funnel_endpoint(flow_id: int, version: str | None = None):
+    # Grava os contadores pendentes e consulta o banco: roda fora do event loop
+    response_data, status = await run_in_threadpool(flow_funnel, flow_id, version)
+    return JSONResponse(response_data, status_code=status)
+
+
+if __name__ == "__main__":
+    port = int(os.environ.get("FLOW_CONTROLLER_PORT", 5000))
+    host = os.environ.get("HOST", "0.0.0.0")
+    logger.info(f"Iniciando Servidor de Fluxo ASGI em http://{host}:{port}")
+    # access_log desligado: o flow_controller já registra cada mensagem (nível via FLOW_LOG_LEVEL)
+    uvicorn.run(app, host=host, port=port, access_log=False, log_level=os.environ.get("UVICORN_LOG_LEVEL", "warning"))
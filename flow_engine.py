@@ -0,0 +1,155 @@
+# flow_engine.py
+# Motor de execução do flow_controller: a partir do nó alcançado por uma mensagem, percorre o
+# grafo compilado executando os nós que não dependem do usuário e junta as mensagens a enviar,
+# até chegar a um nó que espera resposta (ou a um delay, ou ao fim do fluxo).
+#
+# Semântica dos nós (editor em pages/zap.tsx):
+#   textMessage, imageMessage   envia e segue sozinho se as saídas não têm condição
+#   buttonMessage, listMessage  envia e espera a escolha do usuário
+#   waitInput                   envia a pergunta (opcional) e espera; timeoutSeconds agenda a saída source-timeout
+#   delay                       pausa por duration (seconds/minutes); a continuação é entregue pelo agendador
+#   setVariable                 variables[variableName] = value (aceita {{variáveis}})
+#   condition                   segue source-true ou source-false conforme a comparação
+#   goToFlow                    continua no nó inicial do fluxo targetFlowId
+#   endFlow, assignAgent        encerram a sessão (assignAgent envia o aviso, se houver)
+#   tagContact, input           seguem pela edge padrão
+#   apiCall e tipos desconhecidos param e esperam a próxima mensagem
+# Limites: no máximo max_steps nós por chamada, e um nó revisitado com as mesmas variáveis
+# (laço sem saída) encerra a sessão.
+import json
+import logging
+import time
+from typing import Callable
+
+from flow_conditions import render_variables
+from flow_graph import TIMEOUT_HANDLE, CompiledFlow
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_STEPS = 50
+WAITING_NODE_TYPES = frozenset(("buttonMessage", "listMessage", "waitInput"))
+ENDING_NODE_TYPES = frozenset(("endFlow", "assignAgent"))
+
+
+class WalkResult:
+    """Resultado de uma execução: mensagens (JSON em bytes) e onde a sessão parou.
+
+    node_id None = fluxo encerrado. resume_at (delay) e timeout_at (waitInput) são instantes
+    epoch em que o agendador deve continuar a sessão. path lista os nós executados como
+    (flow_id, versão, node_id), para as métricas do flow_analytics.
+    """
+    __slots__ = ("payloads", "flow", "node_id", "resume_at", "timeout_at", "path")
+
+    def __init__(self, payloads: list, flow: CompiledFlow, node_id: str | None, resume_at: float | None = None,
+                 timeout_at: float | None = None, path: list | None = None):
+        self.payloads = payloads
+        self.flow = flow
+        self.node_id = node_id
+        self.resume_at = resume_at
+        self.timeout_at = timeout_at
+        self.path = path if path is not None else []
+
+    @property
+    def steps(self) -> int:
+        return len(self.path)
+
+
+def delay_seconds(node_data: dict) -> float:
+    try:
+        duration = float(node_data.get("duration") or 0)
+    except (TypeError, ValueError):
+        return 0.0
+    return duration * 60 if node_data.get("unit") == "minutes" else duration
+
+
+class FlowEngine:
+    """Percorre um CompiledFlow. get_flow(flow_id) resolve os destinos de goToFlow."""
+
+    def __init__(self, get_flow: Callable[[object], CompiledFlow | None], max_steps: int = DEFAULT_MAX_STEPS):
+        self.get_flow = get_flow
+        self.max_steps = max(1, max_steps)
+
+    def resume(self, flow: CompiledFlow, node_id: str, variables: dict, timed_out: bool = False) -> WalkResult:
+        """Continua uma sessão parada num delay (ou num waitInput cujo tempo esgotou)."""
+        edge = flow.edge_for_handle(node_id, TIMEOUT_HANDLE) if timed_out else flow.auto_edges.get(node_id)
+        if edge is None:
+            return WalkResult([], flow, None)
+        return self.walk(flow, edge.target, variables)
+
+    def walk(self, flow: CompiledFlow, node_id: str | None, variables: dict) -> WalkResult:
+        """Executa a partir de node_id (inclusive). variables é alterado no lugar por setVariable."""
+        payloads = []
+        path = []
+        visited = set()
+        while node_id is not None:
+            if len(path) >= self.max_steps:
+                logger.error(f"Fluxo {flow.id}: limite de {self.max_steps} nós por mensagem atingido no nó {node_id}. Encerrando a sessão.")
+                return WalkResult(payloads, flow, None, path=path)
+            state_key = (flow.id, node_id, json.dumps(variables, sort_keys=True, default=str))
+            if state_key in visited:
+                logger.error(f"Fluxo {flow.id}: laço detectado no nó {node_id} (mesmas variáveis). Encerrando a sessão.")
+                return WalkResult(payloads, flow, None, path=path)
+            visited.add(state_key)
+
+            node = flow.get_node(node_id)
+            if node is None:
+                # Edge apontando para nó inexistente: fim do fluxo, como no determine_next_node
+                return WalkResult(payloads, flow, None, path=path)
+            path.append((flow.id, flow.version, node_id))
+            node_type = node.get("type")
+            node_data = node.get("data") or {}
+
+            payload = flow.get_payload(node_id)
+            if payload is not None:
+                payloads.append(payload.render(variables))
+
+            if node_type in ENDING_NODE_TYPES:
+                return WalkResult(payloads, flow, None, path=path)
+
+            if node_type in WAITING_NODE_TYPES and not flow.is_end_node(node_id):
+                timeout_at = None
+                if node_type == "waitInput" and flow.edge_for_handle(node_id, TIMEOUT_HANDLE) is not None:
+                    timeout = delay_seconds({"duration": node_data.get("timeoutSeconds")})
+                    timeout_at = time.time() + timeout if timeout > 0 else None
+                return WalkResult(payloads, flow, node_id, timeout_at=timeout_at, path=path)
+
+            if node_type == "delay":
+                seconds = delay_seconds(node_data)
+                if seconds > 0:
+                    return WalkResult(payloads, flow, node_id, resume_at=time.time() + seconds, path=path)
+
+            elif node_type == "setVariable":
+                variable_name = node_data.get("variableName")
+                if variable_name:
+                    variables[variable_name] = render_variables(str(node_data.get("value") or ""), variables)
+
+            elif node_type == "condition":
+                matcher = flow.node_conditions.get(node_id)
+                branch = "source-true" if matcher is not None and matcher.matches("", "", variables) else "source-false"
+                edge = flow.edge_for_handle(node_id, branch)
+                node_id = edge.target if edge is not None else None
+                continue
+
+            elif node_type == "goToFlow":
+                target_flow = self.get_flow(node_data.get("targetFlowId"))
+                if target_flow is None:
+                    logger.error(f"Fluxo {flow.id}: goToFlow no nó {node_id} aponta para o fluxo '{node_data.get('targetFlowId')}', que não está ativo. Encerrando.")
+                    return WalkResult(payloads, flow, None, path=path)
+                flow, node_id = target_flow, target_flow.start_node_id
+                continue
+
+            elif node_type == "tagContact":
+                logger.info(f"Fluxo {flow.id}: tag '{node_data.get('tagName')}' ({node_data.get('action', 'add')}) no nó {node_id}.")
+
+            elif node_type == "apiCall":
+                logger.warning(f"Fluxo {flow.id}: nó apiCall {node_id} não é executado pelo flow_controller. Aguardando a próxima mensagem.")
+                return WalkResult(payloads, flow, node_id, path=path)
+
+            if flow.is_end_node(node_id):
+                return WalkResult(payloads, flow, None, path=path)
+            edge = flow.auto_edges.get(node_id)
+            if edge is None:
+                # Saídas com condição: o nó espera a resposta do usuário (comportamento original)
+                return WalkResult(payloads, flow, node_id, path=path)
+            node_id = edge.target
+        return WalkResult(payloads, flow, None, path=path)
@@ -0,0 +1,134 @@
+# flow_graph.py
+# Grafo de fluxo pré-compilado usado pelo flow_controller.
+# A compilação acontece uma única vez no carregamento do fluxo; o caminho quente
+# (/process_message) faz apenas consultas em dicionários.
+import logging
+from types import MappingProxyType
+
+from flow_conditions import Condition, EdgeRouter, compile_condition, compile_node_condition
+from flow_payloads import NodePayload, compile_node_payload
+
+logger = logging.getLogger(__name__)
+
+# Saída de tempo esgotado do waitInput: seguida só pelo agendador, nunca por uma mensagem do usuário
+TIMEOUT_HANDLE = "source-timeout"
+
+
+class CompiledEdge:
+    """Aresta imutável com a condição já compilada (None = edge padrão, sem condição)."""
+    __slots__ = ("id", "source", "target", "condition", "matcher", "source_handle")
+
+    def __init__(self, edge_id, source: str, target: str | None, condition: str, source_handle: str | None = None):
+        self.id = edge_id
+        self.source = source
+        self.target = target
+        self.condition = condition
+        self.matcher: Condition | None = compile_condition(condition)
+        self.source_handle = source_handle  # Saída do nó no editor (ex.: source-true, source-timeout, id do botão)
+
+    def __repr__(self):
+        return f"CompiledEdge({self.source!r} -> {self.target!r}, condition={self.condition!r})"
+
+
+class CompiledFlow:
+    """Definição de fluxo compilada: nós, índice de adjacência e payloads de resposta.
+
+    Para o motor de execução (flow_engine): saídas por handle do editor, condições dos nós
+    condition e a edge seguida automaticamente por nós que não esperam resposta.
+    """
+    __slots__ = ("id", "name", "version", "campaign_id", "nodes", "start_node_id", "outgoing", "routers", "edge_count",
+                 "payloads", "handles", "node_conditions", "auto_edges")
+
+    def __init__(self, flow_id, name, nodes: dict, start_node_id: str, outgoing: dict, edge_count: int,
+                 version: str | None = None, campaign_id: str | None = None):
+        self.id = flow_id
+        self.name = name
+        self.version = version  # flow_registry.flow_version (updated_at + hash de elements) no momento da compilação
+        self.campaign_id = campaign_id
+        self.nodes = MappingProxyType(nodes)  # {node_id: node_data}
+        self.start_node_id = start_node_id
+        self.outgoing = MappingProxyType(outgoing)  # {node_id: (CompiledEdge, ...)} na ordem original
+        # Mensagens do usuário nunca seguem a saída de timeout
+        routed = {node_id: tuple(e for e in edges if e.source_handle != TIMEOUT_HANDLE) for node_id, edges in outgoing.items()}
+        self.routers = MappingProxyType({node_id: EdgeRouter(edges) for node_id, edges in routed.items() if edges})
+        handles = {}
+        for node_id, edges in outgoing.items():
+            for edge in edges:
+                handles.setdefault((node_id, edge.source_handle), edge)
+        self.handles = MappingProxyType(handles)  # {(node_id, source_handle): primeira edge dessa saída}
+        self.node_conditions = MappingProxyType({node_id: compile_node_condition(node.get("data") or {})
+                                                 for node_id, node in nodes.items() if node.get("type") == "condition"})
+        # Nós cujas saídas não têm condição avançam sozinhos pela edge padrão
+        self.auto_edges = MappingProxyType({node_id: router.default_edge for node_id, router in self.routers.items()
+                                            if router.default_edge is not None and not router.scan and not router.keyword_index})
+        self.edge_count = edge_count
+        payloads = ((node_id, compile_node_payload(node)) for node_id, node in nodes.items())
+        self.payloads = MappingProxyType({node_id: payload for node_id, payload in payloads if payload is not None})
+
+    def get_node(self, node_id: str) -> dict | None:
+        if not node_id: return None
+        return self.nodes.get(node_id)
+
+    def get_payload(self, node_id: str) -> NodePayload | None:
+        """Payload pré-serializado do nó (None para nós que não enviam mensagem)."""
+        return self.payloads.get(node_id)
+
+    def edge_for_handle(self, node_id: str, source_handle: str) -> CompiledEdge | None:
+        return self.handles.get((node_id, source_handle))
+
+    def is_end_node(self, node_id: str) -> bool:
+        """Nó final = nenhuma edge saindo dele (vale também para alvos fora de 'nodes')."""
+        return node_id not in self.outgoing
+
+    def select_edge(self, node_id: str, user_message: str, variables: dict | None = None) -> CompiledEdge | None:
+        """Escolhe a edge de saída: primeira condição satisfeita, senão a edge padrão (sem condição)."""
+        router = self.routers.get(node_id)
+        if router is None:
+            return None
+        user_message = user_message.strip()
+        return router.select(user_message, user_message.lower(), variables)
+
+
+def find_start_node(nodes_list: list, nodes_dict: dict) -> dict | None:
+    """Encontra o nó inicial seguindo as convenções do editor de fluxos."""
+    # 1. Procura por um nó com ID específico 'start-node' (convenção comum)
+    start_node = nodes_dict.get('start-node')
+    # 2. Se não encontrar, procura pelo primeiro nó do tipo 'input' (outra convenção)
+    if not start_node:
+        start_node = next((node for node in nodes_list if node.get('type') == 'input'), None)
+    # 3. Se ainda não encontrar, pega o primeiro nó da lista como fallback
+    if not start_node and nodes_list:
+        start_node = nodes_list[0]
+        logger.warning(f"Nó inicial 'start-node' ou tipo 'input' não encontrado. Usando o primeiro nó da lista como fallback: {start_node.get('id')}")
+    return start_node
+
+
+def compile_flow(flow_id, flow_name, elements: dict, version: str | None = None, campaign_id: str | None = None) -> CompiledFlow:
+    """Compila o JSON 'elements' (nodes/edges do editor) em um CompiledFlow.
+
+    Lança ValueError se a estrutura for inválida ou se não houver nó inicial.
+    """
+    nodes_list = elements.get('nodes', [])
+    edges_list = elements.get('edges', [])
+
+    # Validação básica da estrutura
+    if not isinstance(nodes_list, list) or not isinstance(edges_list, list):
+        raise ValueError("Estrutura de 'nodes' ou 'edges' inválida no JSON.")
+
+    nodes_dict = {node['id']: node for node in nodes_list if 'id' in node} # Cria dicionário de nós por ID
+    start_node = find_start_node(nodes_list, nodes_dict)
+    if not start_node or not start_node.get('id'):
+        raise ValueError("Não foi possível determinar um nó inicial para o fluxo!")
+
+    outgoing = {}
+    for edge in edges_list:
+        source = edge.get('source')
+        if source is None:
+            continue
+        condition = (edge.get('data') or {}).get('condition') or ''
+        compiled_edge = CompiledEdge(edge.get('id', 'N/A'), source, edge.get('target'), str(condition), edge.get('sourceHandle'))
+        outgoing.setdefault(source, []).append(compiled_edge)
+
+    outgoing = {source: tuple(edges) for source, edges in outgoing.items()}
+    return CompiledFlow(flow_id, flow_name, nodes_dict, start_node['id'], outgoing, len(edges_list),
+                        version=version, campaign_id=campaign_id)
@@ -0,0 +1,112 @@
+# flow_payloads.py
+# Payloads de resposta (formato Baileys) dos nós de mensagem, pré-computados na compilação do fluxo.
+# Cada nó de mensagem vira um NodePayload com o JSON já serializado em bytes; como o CompiledFlow
+# é recriado a cada recarga, os payloads de uma versão nunca ficam desatualizados.
+# Textos podem interpolar variáveis da sessão com {{variavel}}: o JSON é dividido nos marcadores
+# uma única vez e, por mensagem, só os valores das variáveis são serializados e concatenados.
+import json
+import logging
+import re
+from json.encoder import encode_basestring_ascii
+from types import MappingProxyType
+
+from flow_conditions import VARIABLE_RE
+
+logger = logging.getLogger(__name__)
+
+NON_ASCII_RE = re.compile(r"[^\x00-\x7f]")
+
+
+def _escape_non_ascii(serialized: str) -> str:
+    """Trecho de JSON serializado com ensure_ascii=False no mesmo formato \\uXXXX do json.dumps padrão."""
+    return NON_ASCII_RE.sub(lambda match: json.dumps(match.group())[1:-1], serialized)
+
+
+def build_node_payload(node: dict) -> dict | None:
+    """Monta o payload da mensagem de um nó. None para nós que não enviam mensagem."""
+    node_type = node.get("type")
+    node_data = node.get("data", {})
+
+    if node_type == "textMessage":
+        text = node_data.get("text")
+        return {"text": text} if text else None
+    elif node_type == "imageMessage":
+        url = node_data.get("url")
+        caption = node_data.get("caption")
+        if not url: return None
+        message = {"image": {"url": url}}
+        if caption: message["caption"] = caption
+        return message
+    elif node_type == "buttonMessage":
+        text = node_data.get("text", "")
+        buttons_data = node_data.get("buttons", [])
+        # Formato Baileys para botões simples (pode precisar de adaptação)
+        buttons_payload = [{"buttonId": btn.get("id", f"btn_{i}"), "buttonText": {"displayText": btn.get("text", f"Opção {i+1}")}, "type": 1} for i, btn in enumerate(buttons_data)]
+        if not text or not buttons_payload: return None # Precisa de texto e botões
+        return {"text": text, "buttons": buttons_payload, "headerType": 1} # Exemplo simples
+    elif node_type == "listMessage":
+        text = node_data.get("text", "")
+        title = node_data.get("title", "Opções")
+        buttonText = node_data.get("buttonText", "Ver Opções")
+        sections_data = node_data.get("sections", [])
+        if not sections_data: return None
+        # Formato Baileys para listas
+        sections_payload = [{
+            "title": sec.get("title", f"Seção {i+1}"),
+            "rows": [{"title": row.get("title", f"Item {j+1}"), "rowId": row.get("id", f"row_{i}_{j}"), "description": row.get("description", "")} for j, row in enumerate(sec.get("rows", []))]
+        } for i, sec in enumerate(sections_data)]
+        return {"text": text, "footer": "", "title": title, "buttonText": buttonText, "sections": sections_payload}
+    elif node_type in ("waitInput", "assignAgent"):
+        # Pergunta do waitInput / aviso de transferência para atendente (opcionais)
+        message = node_data.get("message")
+        return {"text": message} if message else None
+
+    # Outros tipos de nós (lógicos, de espera) não geram mensagem direta
+    return None
+
+
+class NodePayload:
+    """Payload de um nó pré-serializado. Sem variáveis, render() devolve sempre os mesmos bytes."""
+    __slots__ = ("data", "json", "parts", "variables")
+
+    def __init__(self, data: dict):
+        self.data = MappingProxyType(data)  # Compartilhado entre requisições: somente leitura
+        # Divide antes de escapar: com \uXXXX, {{variável}} não casaria mais com VARIABLE_RE
+        serialized = json.dumps(data, ensure_ascii=False)
+        # split com grupo de captura alterna [estático, variável, estático, ..., estático]
+        pieces = VARIABLE_RE.split(serialized)
+        # ASCII (\uXXXX), como o jsonify do Flask: bytes válidos mesmo com surrogates soltos na entrada
+        self.parts = tuple(_escape_non_ascii(piece).encode("ascii") for piece in pieces[0::2])
+        self.variables = tuple(pieces[1::2])
+        self.json = self.parts[0] if not self.variables else None
+
+    @property
+    def is_template(self) -> bool:
+        return bool(self.variables)
+
+    def render(self, variables: dict | None = None) -> bytes:
+        """JSON do payload em bytes, com {{variáveis}} substituídas (ausentes viram texto vazio)."""
+        if self.json is not None:
+            return self.json
+        variables = variables or {}
+        chunks = [self.parts[0]]
+        for name, static in zip(self.variables, self.parts[1:]):
+            value = variables.get(name)
+            # Valor serializado como conteúdo de string JSON (escapa aspas, barras e quebras de linha)
+            chunks.append(encode_basestring_ascii("" if value is None else str(value))[1:-1].encode("ascii"))
+            chunks.append(static)
+        return b"".join(chunks)
+
+    def render_data(self, variables: dict | None = None) -> dict:
+        """Payload como dict (sempre uma cópia nova; o JSON pré-serializado é compartilhado)."""
+        return json.loads(self.render(variables))
+
+
+def compile_node_payload(node: dict) -> NodePayload | None:
+    """Pré-computa o payload do nó. Nós malformados são registrados e não enviam mensagem."""
+    try:
+        data = build_node_payload(node)
+    except (AttributeError, TypeError) as e:
+        logger.error(f"Dados inválidos no nó {node.get('id')} (tipo '{node.get('type')}'): {e}. O nó não enviará mensagem.")
+        return None
+    return NodePayload(data) if data else None
@@ -0,0 +1,284 @@
+# flow_registry.py
+# Registro de fluxos ativos: permite que um único flow_controller atenda todas as campanhas.
+# Mantém em memória apenas os metadados dos fluxos ativos; o JSON 'elements' é lido e
+# compilado sob demanda, com um limite LRU de grafos compilados.
+# A versão de um fluxo é flows.updated_at + hash do JSON elements (updated_at tem resolução de
+# 1 s e não distingue edições no mesmo segundo). Uma versão nova é compilada fora do caminho quente
+# e trocada de forma atômica; versões anteriores ficam fixadas para as sessões em andamento.
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from flow_graph import CompiledFlow, compile_flow
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_COMPILED_FLOWS = 32
+DEFAULT_MAX_PINNED_VERSIONS = 3 # Versões antigas mantidas por fluxo para sessões em andamento
+DEFAULT_POLL_INTERVAL = 5.0 # Segundos entre verificações de alterações nos fluxos ativos
+
+
+def flow_version(updated_at, elements_json: str | None) -> str:
+    """Versão de um fluxo: "<updated_at>#<hash de elements>" (ordena por updated_at)."""
+    digest = hashlib.blake2b((elements_json or "").encode("utf-8"), digest_size=8).hexdigest()
+    return f"{updated_at}#{digest}"
+
+
+class FlowInfo:
+    """Metadados de um fluxo ativo (linha de 'flows' sem o JSON de elementos)."""
+    __slots__ = ("id", "name", "campaign_id", "version")
+
+    def __init__(self, flow_id, name, campaign_id, version):
+        self.id = flow_id
+        self.name = name
+        self.campaign_id = campaign_id
+        self.version = version
+
+
+class FlowRegistry:
+    """Fluxos ativos indexados por flows.id e campaign_id, compilados de forma preguiçosa."""
+
+    def __init__(self, database_path: str, max_compiled: int = DEFAULT_MAX_COMPILED_FLOWS,
+                 max_pinned_versions: int = DEFAULT_MAX_PINNED_VERSIONS):
+        self.database_path = database_path
+        self.max_compiled = max(1, max_compiled)
+        self.max_pinned_versions = max(0, max_pinned_versions)
+        self._lock = threading.RLock()
+        self._flows = {}  # {flow_id: FlowInfo}
+        self._by_campaign = {}  # {campaign_id: flow_id}
+        self._compiled = OrderedDict()  # {flow_id: CompiledFlow} versão corrente, em ordem LRU
+        self._pinned = {}  # {flow_id: OrderedDict{version: CompiledFlow}} versões anteriores
+        self._failed = {}  # {flow_id: version} fluxos cuja compilação falhou nesta versão
+        self._signature = None  # (id, versão) dos fluxos ativos na última atualização
+        self.default_flow_id = None  # Fluxo usado quando a mensagem não informa fluxo/campanha
+        self.on_refresh: Callable[[float, bool], None] | None = None  # (duração em s, sucesso) de cada refresh(); métricas
+
+    def _connect(self):
+        return sqlite3.connect(self.database_path)
+
+    def refresh(self, force: bool = False) -> int:
+        """Relê os metadados dos fluxos ativos. Retorna quantos fluxos ativos existem.
+
+        Fluxos já compilados cuja versão mudou são recompilados aqui, fora do caminho das
+        mensagens, e trocados de forma atômica; até lá a versão anterior continua atendendo.
+        Com force, todos os fluxos compilados são recompilados (e falhas anteriores esquecidas).
+        Versões que não compilam ficam em failed_flow_ids(). Grafos de fluxos desativados são descartados.
+        Lança sqlite3.Error em caso de falha no banco.
+        """
+        started_at = time.perf_counter()
+        succeeded = False
+        try:
+            active_count = self._refresh(force)
+            succeeded = True
+            return active_count
+        finally:
+            if self.on_refresh is not None:
+                self.on_refresh(time.perf_counter() - started_at, succeeded)
+
+    def _refresh(self, force: bool = False) -> int:
+        conn = self._connect()
+        try:
+            rows = [(flow_id, name, campaign_id, flow_version(updated_at, elements_json))
+                    for flow_id, name, campaign_id, updated_at, elements_json in conn.execute(
+                        "SELECT id, name, campaign_id, updated_at, elements FROM flows WHERE status = 'active' ORDER BY id")]
+        finally:
+            conn.close()
+
+        flows = {flow_id: FlowInfo(flow_id, name, campaign_id, version) for flow_id, name, campaign_id, version in rows}
+        by_campaign = {}
+        for info in flows.values():
+            # Se houver mais de um fluxo ativo por campanha, vale o de menor ID (mesma regra do LIMIT 1 antigo)
+            if info.campaign_id is not None and info.campaign_id not in by_campaign:
+                by_campaign[info.campaign_id] = info.id
+
+        with self._lock:
+            self._flows = flows
+            self._by_campaign = by_campaign
+            self.default_flow_id = rows[0][0] if rows else None
+            self._signature = tuple((flow_id, version) for flow_id, _, _, version in rows)
+            stale = []
+            for flow_id in list(self._compiled):
+                info = flows.get(flow_id)
+                if info is None:
+                    del self._compiled[flow_id]
+                elif force or info.version != self._compiled[flow_id].version:
+                    stale.append(info)
+            for flow_id in list(self._pinned):
+                if flow_id not in flows:
+                    del self._pinned[flow_id]
+            self._failed = {} if force else {flow_id: version for flow_id, version in self._failed.items()
+                                             if flow_id in flows and flows[flow_id].version == version}
+
+        # Compila as novas versões sem segurar o lock: as mensagens seguem na versão anterior
+        for info in stale:
+            self._swap(info)
+        logger.info(f"Registro de fluxos atualizado: {len(flows)} fluxo(s) ativo(s), {len(by_campaign)} campanha(s). Fluxo padrão: {self.default_flow_id}")
+        return len(flows)
+
+    def poll(self) -> bool:
+        """Verifica a versão dos fluxos ativos e atualiza o registro se algo mudou. Retorna True se atualizou."""
+        conn = self._connect()
+        try:
+            signature = tuple((flow_id, flow_version(updated_at, elements_json)) for flow_id, updated_at, elements_json in conn.execute(
+                "SELECT id, updated_at, elements FROM flows WHERE status = 'active' ORDER BY id"))
+        finally:
+            conn.close()
+        if signature == self._signature:
+            return False
+        logger.info("Alteração detectada nos fluxos ativos. Recarregando.")
+        self.refresh()
+        return True
+
+    def _swap(self, info: FlowInfo):
+        """Compila a versão atual do fluxo e a troca atomicamente, fixando a versão anterior."""
+        new_flow = self._compile(info)
+        with self._lock:
+            old_flow = self._compiled.get(info.id)
+            if new_flow is None:
+                # Mantém a versão anterior atendendo; a falha fica registrada para esta versão
+                self._failed[info.id] = info.version
+                logger.error(f"Nova versão do fluxo {info.id} não compilou. Mantendo a versão {old_flow.version if old_flow else None}.")
+                return
+            if info.id not in self._flows:
+                return  # Desativado enquanto compilava
+            self._compiled[info.id] = new_flow
+            if old_flow is not None and old_flow.version != new_flow.version:
+                self._pin(old_flow)
+        logger.info(f"Fluxo {info.id} atualizado para a versão {new_flow.version}.")
+
+    def _pin(self, flow: CompiledFlow):
+        if not self.max_pinned_versions:
+            return
+        versions = self._pinned.setdefault(flow.id, OrderedDict())
+        versions[flow.version] = flow
+        versions.move_to_end(flow.version)
+        while len(versions) > self.max_pinned_versions:
+            versions.popitem(last=False)
+
+    def get_version(self, flow_id, version) -> CompiledFlow | None:
+        """Retorna uma versão específica do fluxo (a corrente ou uma versão anterior fixada)."""
+        with self._lock:
+            flow = self._compiled.get(flow_id)
+            if flow is not None and flow.version == version:
+                return flow
+            versions = self._pinned.get(flow_id)
+            return versions.get(version) if versions else None
+
+    def resolve_flow_id(self, flow_id=None, campaign_id=None):
+        """Resolve qual fluxo atende a mensagem: flow_id explícito > campanha > fluxo padrão."""
+        if flow_id is not None:
+            try:
+                flow_id = int(flow_id)
+            except (TypeError, ValueError):
+                return None
+            return flow_id if flow_id in self._flows else None
+        if campaign_id is not None:
+            return self._by_campaign.get(str(campaign_id))
+        return self.default_flow_id
+
+    def is_active(self, flow_id) -> bool:
+        return flow_id in self._flows
+
+    def flow_infos(self) -> list[FlowInfo]:
+        return list(self._flows.values())
+
+    def get(self, flow_id) -> CompiledFlow | None:
+        """Retorna o grafo compilado do fluxo, compilando-o na primeira vez (LRU limitado)."""
+        if flow_id is None:
+            return None
+        with self._lock:
+            flow = self._compiled.get(flow_id)
+            if flow is not None:
+                self._compiled.move_to_end(flow_id)
+                return flow
+            info = self._flows.get(flow_id)
+            if info is None or self._failed.get(flow_id) == info.version:
+                return None
+
+        # Leitura e compilação fora do lock: compilar um fluxo não bloqueia get() dos demais
+        flow = self._compile(info)
+        with self._lock:
+            current = self._compiled.get(flow_id)
+            if current is not None:
+                # Outra thread (ou um refresh) publicou o fluxo enquanto este compilava
+                self._compiled.move_to_end(flow_id)
+                return current
+            if flow is None:
+                if self._flows.get(flow_id) is info:
+                    self._failed[flow_id] = info.version
+                return None
+            if self._flows.get(flow_id) is not info or flow.version != info.version:
+                # Os metadados mudaram durante a compilação: atende esta mensagem sem publicar no
+                # cache; a próxima chamada compila a versão que o refresh registrou
+                return flow
+            self._compiled[flow_id] = flow
+            while len(self._compiled) > self.max_compiled:
+                evicted_id, _ = self._compiled.popitem(last=False)
+                logger.debug(f"Grafo do fluxo {evicted_id} removido do cache LRU.")
+            return flow
+
+    def _compile(self, info: FlowInfo) -> CompiledFlow | None:
+        conn = None
+        try:
+            conn = self._connect()
+            row = conn.execute("SELECT elements, updated_at FROM flows WHERE id = ?", (info.id,)).fetchone()
+            if not row:
+                logger.warning(f"Fluxo ID {info.id} não encontrado no banco ao compilar.")
+                return None
+            elements_json, updated_at = row
+            flow = compile_flow(info.id, info.name, json.loads(elements_json or '{}'), version=flow_version(updated_at, elements_json),
+                                campaign_id=info.campaign_id)
+            logger.info(f"Fluxo '{info.name}' (ID: {info.id}) compilado com {len(flow.nodes)} nós e {flow.edge_count} arestas. Nó inicial: {flow.start_node_id}")
+            return flow
+        except json.JSONDecodeError as e:
+            logger.error(f"Erro ao decodificar JSON do fluxo ID {info.id}: {e}")
+        except ValueError as e:
+            logger.error(f"Fluxo ID {info.id} inválido: {e}")
+        except sqlite3.Error as e:
+            logger.error(f"Erro de banco de dados ao compilar fluxo ID {info.id}: {e}")
+        except Exception as e:
+            logger.error(f"Erro inesperado ao processar elementos do fluxo ID {info.id}: {e}", exc_info=True)
+        finally:
+            if conn:
+                conn.close()
+        return None
+
+    def failed_flow_ids(self) -> list:
+        """IDs dos fluxos ativos cuja versão atual não compilou (a anterior, se houver, segue atendendo)."""
+        with self._lock:
+            return sorted(flow_id for flow_id, version in self._failed.items()
+                          if flow_id in self._flows and self._flows[flow_id].version == version)
+
+    def compiled_count(self) -> int:
+        return len(self._compiled)
+
+    def pinned_count(self) -> int:
+        return sum(len(versions) for versions in self._pinned.values())
+
+
+class FlowReloadWatcher(threading.Thread):
+    """Thread que consulta a versão dos fluxos ativos periodicamente e recarrega o registro quando muda."""
+
+    def __init__(self, registry: FlowRegistry, interval: float = DEFAULT_POLL_INTERVAL):
+        super().__init__(name="flow-reload-watcher", daemon=True)
+        self.registry = registry
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        logger.info(f"Monitor de recarga de fluxos iniciado (intervalo: {self.interval}s).")
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.registry.poll()
+            except sqlite3.Error as e:
+                logger.error(f"Erro de banco de dados ao verificar alterações nos fluxos: {e}")
+            except Exception as e:
+                logger.error(f"Erro inesperado no monitor de recarga de fluxos: {e}", exc_info=True)
+
+    def stop(self):
+        self._stop_event.set()
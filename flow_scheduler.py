@@ -0,0 +1,83 @@
+# flow_scheduler.py
+# Agendador de timers do flow_controller (nós delay e timeout do waitInput).
+# Uma única thread dorme até o próximo vencimento num heap de timers; callbacks vencidos rodam
+# num pool pequeno, então nenhum worker HTTP fica bloqueado esperando um delay.
+# Timers são mantidos só em memória: a sessão guarda o horário de retomada e o flow_controller
+# retoma sessões atrasadas na próxima mensagem do remetente (ex.: após reinício do processo).
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMER_WORKERS = 4
+
+
+class TimerScheduler:
+    """Timers por chave (ex.: sender_id): agendar de novo a mesma chave substitui o timer anterior."""
+
+    def __init__(self, workers: int = DEFAULT_TIMER_WORKERS, name: str = "flow-timers"):
+        self.name = name
+        self._heap = []  # [(vence_em (time.time()), sequência, chave)]
+        self._timers = {}  # {chave: (sequência, callback)} - só o timer mais recente de cada chave vale
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=name)
+        self._thread = None
+        self._closed = False
+        self.fired = 0
+
+    def schedule(self, key, due_at: float, callback: Callable[[], None]):
+        """Agenda callback() para o instante due_at (epoch, segundos)."""
+        with self._condition:
+            sequence = next(self._sequence)
+            self._timers[key] = (sequence, callback)
+            heapq.heappush(self._heap, (due_at, sequence, key))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def cancel(self, key):
+        with self._condition:
+            self._timers.pop(key, None)  # A entrada no heap é descartada ao vencer
+
+    def pending(self) -> int:
+        with self._condition:
+            return len(self._timers)
+
+    def _run(self):
+        with self._condition:
+            while not self._closed:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                due_at, sequence, key = self._heap[0]
+                timeout = due_at - time.time()
+                if timeout > 0:
+                    self._condition.wait(timeout)
+                    continue
+                heapq.heappop(self._heap)
+                timer = self._timers.get(key)
+                if timer is None or timer[0] != sequence:
+                    continue  # Cancelado ou substituído
+                del self._timers[key]
+                self.fired += 1
+                self._executor.submit(self._fire, key, timer[1])
+
+    @staticmethod
+    def _fire(key, callback):
+        try:
+            callback()
+        except Exception as e:
+            logger.error(f"Erro no timer de {key}: {e}", exc_info=True)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._executor.shutdown(wait=False)
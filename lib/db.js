@@ -93,6 +93,9 @@ async function initializeDatabaseStructure(dbInstance) {
    await dbInstance.exec(`CREATE TRIGGER IF NOT EXISTS update_flow_updated_at AFTER UPDATE ON flows FOR EACH ROW BEGIN UPDATE flows SET updated_at = CURRENT_TIMESTAMP WHERE id = OLD.id; END;`);
    await dbInstance.exec(`CREATE TRIGGER IF NOT EXISTS update_campaign_updated_at AFTER UPDATE ON campaigns FOR EACH ROW BEGIN UPDATE campaigns SET updated_at = CURRENT_TIMESTAMP WHERE id = OLD.id; END;`);
    await dbInstance.exec(`CREATE TRIGGER IF NOT EXISTS update_copy_updated_at AFTER UPDATE ON copies FOR EACH ROW BEGIN UPDATE copies SET updated_at = CURRENT_TIMESTAMP WHERE id = OLD.id; END;`);
+   // Mesmos índices do campaign_analytics.py (copies por campanha, alertas não lidos)
+   await dbInstance.exec(`CREATE INDEX IF NOT EXISTS idx_copies_campaign_id ON copies(campaign_id, clicks, impressions, conversions, created_date);`);
+   await dbInstance.exec(`CREATE INDEX IF NOT EXISTS idx_alerts_read ON alerts(read, metric);`);
 
   console.log("Estrutura DB verificada/criada.");
 }
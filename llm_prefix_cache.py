@@ -0,0 +1,144 @@
+# llm_prefix_cache.py
+# Cache de KV (past_key_values) por prefixo de tokens para o llm_server.
+# Prompts de copy compartilham longos prefixos de sistema/instrução; guardando o estado do
+# prefill desses prefixos, a geração retoma do cache e só processa os tokens novos.
+# Prefixos são alinhados em blocos de block_size tokens e identificados pelo hash dos IDs.
+import copy
+import hashlib
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PREFIX_CACHE_MB = 256
+DEFAULT_PREFIX_BLOCK_TOKENS = 64
+
+
+def cache_nbytes(past_key_values) -> int:
+    """Estima a memória ocupada por um past_key_values (DynamicCache ou tupla legada)."""
+    tensors = []
+    layers = getattr(past_key_values, "layers", None)
+    if layers is not None:  # transformers >= 4.56
+        for layer in layers:
+            tensors.extend(t for t in (getattr(layer, "keys", None), getattr(layer, "values", None)) if t is not None)
+    elif hasattr(past_key_values, "key_cache"):
+        tensors.extend(past_key_values.key_cache)
+        tensors.extend(past_key_values.value_cache)
+    else:
+        for layer in past_key_values:
+            tensors.extend(layer)
+    return sum(t.element_size() * t.nelement() for t in tensors if hasattr(t, "nelement"))
+
+
+def crop_cache(past_key_values, n_tokens: int):
+    """Reduz o past_key_values aos primeiros n_tokens (in-place quando o cache suporta crop)."""
+    if hasattr(past_key_values, "crop"):
+        # Valor negativo = quantos tokens remover do fim (aceito por todas as versões com crop)
+        past_key_values.crop(n_tokens - past_key_values.get_seq_length())
+        return past_key_values
+    return tuple(tuple(t[..., :n_tokens, :] for t in layer) for layer in past_key_values)
+
+
+class PrefixCache:
+    """LRU limitado por memória de prefixos de tokens -> past_key_values.
+
+    Cada prefixo guardado é indexado em todas as suas fronteiras de bloco: um prompt que
+    compartilha só os primeiros blocos reaproveita o cache recortado até o ponto em comum.
+    """
+
+    def __init__(self, max_bytes: int, block_size: int = DEFAULT_PREFIX_BLOCK_TOKENS):
+        self.max_bytes = max_bytes
+        self.block_size = max(1, block_size)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # {digest: (n_tokens, past_key_values, nbytes, digests das fronteiras)}
+        self._index = {}  # {digest da fronteira: (digest da entrada, n_tokens)}
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.tokens_reused = 0
+
+    def _boundaries(self, token_ids: list[int], include_last: bool = False) -> list[tuple[int, bytes]]:
+        """Hashes dos prefixos alinhados em bloco, do menor para o maior.
+
+        Por padrão o último token do prompt nunca entra no prefixo: o modelo precisa processar
+        ao menos um token novo para produzir os logits do primeiro token gerado.
+        """
+        hasher = hashlib.blake2b(digest_size=16)
+        boundaries = []
+        limit = len(token_ids) if include_last else len(token_ids) - 1
+        for end in range(self.block_size, limit + 1, self.block_size):
+            hasher.update(array("q", token_ids[end - self.block_size:end]).tobytes())
+            boundaries.append((end, hasher.copy().digest()))
+        return boundaries
+
+    def lookup(self, token_ids: list[int]):
+        """Retorna (n_tokens, cópia do past_key_values) do maior prefixo em cache, ou None."""
+        boundaries = self._boundaries(token_ids)
+        with self._lock:
+            for n_tokens, digest in reversed(boundaries):
+                target = self._index.get(digest)
+                if target is not None:
+                    entry_digest = target[0]
+                    self._entries.move_to_end(entry_digest)
+                    self.hits += 1
+                    self.tokens_reused += n_tokens
+                    entry_tokens, past_key_values = self._entries[entry_digest][:2]
+                    break
+            else:
+                self.misses += 1
+                return None
+        # generate() altera o cache recebido: entrega uma cópia e preserva o original
+        past_key_values = copy.deepcopy(past_key_values)
+        if n_tokens < entry_tokens:
+            past_key_values = crop_cache(past_key_values, n_tokens)
+        return n_tokens, past_key_values
+
+    def prefix_length(self, prompt_length: int) -> int:
+        """Tamanho do maior prefixo alinhado em bloco que pode ser guardado para este prompt."""
+        return ((prompt_length - 1) // self.block_size) * self.block_size if prompt_length > 1 else 0
+
+    def store(self, token_ids: list[int], past_key_values):
+        """Guarda o past_key_values do prefixo token_ids (len múltiplo de block_size)."""
+        if not token_ids or len(token_ids) % self.block_size:
+            return
+        boundaries = self._boundaries(token_ids, include_last=True)
+        digest = boundaries[-1][1]
+        nbytes = cache_nbytes(past_key_values)
+        if nbytes > self.max_bytes:
+            logger.debug(f"Prefixo de {len(token_ids)} tokens ({nbytes} bytes) maior que o cache. Ignorado.")
+            return
+        with self._lock:
+            if digest in self._entries:
+                self._remove(digest)
+            self._entries[digest] = (len(token_ids), past_key_values, nbytes, [d for _, d in boundaries])
+            for n_tokens, boundary_digest in boundaries:
+                self._index[boundary_digest] = (digest, n_tokens)
+            self.bytes_used += nbytes
+            while self.bytes_used > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, digest: bytes):
+        _, _, nbytes, boundary_digests = self._entries.pop(digest)
+        self.bytes_used -= nbytes
+        for boundary_digest in boundary_digests:
+            target = self._index.get(boundary_digest)
+            if target is not None and target[0] == digest:
+                del self._index[boundary_digest]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes_used": self.bytes_used,
+            "max_bytes": self.max_bytes,
+            "block_size": self.block_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "tokens_reused": self.tokens_reused,
+        }
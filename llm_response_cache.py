@@ -0,0 +1,199 @@
+# llm_response_cache.py
+# Cache de respostas do llm_server endereçado por conteúdo (modelo + prompt + parâmetros).
+# Duas camadas: LRU em memória e SQLite em disco (sobrevive a reinícios), com TTL opcional.
+# O disco é limitado: a cada purge_every gravações (e na abertura) as entradas expiradas são
+# removidas e, acima de max_disk_entries, as mais antigas.
+# Requisições idênticas em andamento são agrupadas: só a primeira executa o modelo.
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_MAX_ENTRIES = 1024
+DEFAULT_CACHE_MAX_DISK_ENTRIES = 100_000
+DEFAULT_PURGE_EVERY = 256 # Gravações em disco entre limpezas
+
+
+def make_cache_key(model_path: str, prompt: str, params: dict) -> str:
+    """Chave SHA-256 do conteúdo; params já devem estar normalizados."""
+    payload = json.dumps({"model": model_path, "prompt": prompt, "params": params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Cache em duas camadas (memória + SQLite) com TTL opcional e coalescência de requisições."""
+
+    def __init__(self, db_path: str | None = None, max_entries: int = DEFAULT_CACHE_MAX_ENTRIES, ttl_seconds: float = 0,
+                 max_disk_entries: int = DEFAULT_CACHE_MAX_DISK_ENTRIES, purge_every: int = DEFAULT_PURGE_EVERY):
+        self.db_path = db_path or None
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_entries = max(1, max_disk_entries)
+        self.purge_every = max(1, purge_every)
+        self._disk_writes = 0
+        self._memory = OrderedDict()  # {key: (expires_at | None, response)}
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._db_lock = threading.Lock()
+        self._conn = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evicted = 0
+        if self.db_path:
+            self._init_db()
+
+    def _init_db(self):
+        try:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            with self._conn:
+                self._conn.execute("""
+                    CREATE TABLE IF NOT EXISTS llm_response_cache (
+                        key TEXT PRIMARY KEY,
+                        response TEXT NOT NULL,
+                        created_at REAL NOT NULL,
+                        expires_at REAL
+                    )""")
+                self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_response_cache_created_at ON llm_response_cache(created_at)")
+            logger.info(f"Cache de respostas em disco: {self.db_path} (até {self.max_disk_entries} entradas)")
+            self.purge()
+        except sqlite3.Error as e:
+            logger.error(f"Não foi possível abrir o cache de respostas em disco ({self.db_path}): {e}. Usando só memória.")
+            self._conn = None
+
+    def _expires_at(self) -> float | None:
+        return time.time() + self.ttl_seconds if self.ttl_seconds > 0 else None
+
+    def _memory_get(self, key: str) -> str | None:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        expires_at, response = entry
+        if expires_at is not None and expires_at < time.time():
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return response
+
+    def _memory_set(self, key: str, response: str, expires_at: float | None):
+        self._memory[key] = (expires_at, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_get(self, key: str):
+        if self._conn is None:
+            return None
+        try:
+            with self._db_lock:
+                row = self._conn.execute("SELECT response, expires_at FROM llm_response_cache WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao ler o cache de respostas em disco: {e}")
+            return None
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return row
+
+    def _disk_set(self, key: str, response: str, expires_at: float | None):
+        if self._conn is None:
+            return
+        try:
+            with self._db_lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO llm_response_cache (key, response, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                    (key, response, time.time(), expires_at))
+                self._disk_writes += 1
+                if self._disk_writes % self.purge_every == 0:
+                    self._purge_locked()
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao gravar no cache de respostas em disco: {e}")
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[str]]) -> str:
+        """Retorna a resposta em cache ou executa compute() uma única vez por chave em andamento."""
+        response = self._memory_get(key)
+        if response is not None:
+            self.memory_hits += 1
+            return response
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        # Evita o aviso "exception was never retrieved" quando ninguém mais aguardava
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+        try:
+            row = await asyncio.to_thread(self._disk_get, key) if self._conn is not None else None
+            if row is not None:
+                self.disk_hits += 1
+                response = row[0]
+                self._memory_set(key, response, row[1])
+            else:
+                self.misses += 1
+                response = await compute()
+                expires_at = self._expires_at()
+                self._memory_set(key, response, expires_at)
+                await asyncio.to_thread(self._disk_set, key, response, expires_at)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e if isinstance(e, Exception) else RuntimeError("Geração cancelada."))
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def purge_expired(self) -> int:
+        if self._conn is None:
+            return 0
+        with self._db_lock, self._conn:
+            return self._conn.execute("DELETE FROM llm_response_cache WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),)).rowcount
+
+    def purge(self) -> int:
+        """Remove as entradas expiradas e as mais antigas acima de max_disk_entries. Retorna quantas removeu."""
+        if self._conn is None:
+            return 0
+        try:
+            with self._db_lock, self._conn:
+                return self._purge_locked()
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao limpar o cache de respostas em disco: {e}")
+            return 0
+
+    def _purge_locked(self) -> int:
+        """Chamado com _db_lock e dentro da transação."""
+        removed = self._conn.execute("DELETE FROM llm_response_cache WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),)).rowcount
+        removed += self._conn.execute(
+            "DELETE FROM llm_response_cache WHERE key IN (SELECT key FROM llm_response_cache ORDER BY created_at "
+            "LIMIT max(0, (SELECT COUNT(*) FROM llm_response_cache) - ?))", (self.max_disk_entries,)).rowcount
+        self.evicted += removed
+        if removed:
+            logger.info(f"Cache de respostas em disco: {removed} entrada(s) expirada(s) ou excedente(s) removida(s).")
+        return removed
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_entries": len(self._memory),
+            "max_entries": self.max_entries,
+            "disk": self.db_path if self._conn is not None else None,
+            "max_disk_entries": self.max_disk_entries,
+            "disk_evicted": self.evicted,
+            "ttl_seconds": self.ttl_seconds,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "inflight": len(self._inflight),
+        }
@@ -0,0 +1,94 @@
+# llm_scheduler.py
+# Agendador de inferência em lote para o llm_server.
+# Requisições concorrentes entram numa fila asyncio; um worker agrupa as que chegam dentro de
+# uma janela de espera (até max_batch_size), separa por parâmetros de amostragem compatíveis
+# e executa cada grupo numa thread dedicada, fora do event loop. Enquanto um lote roda, as
+# novas requisições se acumulam e formam o próximo lote.
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BATCH_SIZE = 8
+DEFAULT_BATCH_WAIT_MS = 15.0
+
+
+class BatchScheduler:
+    """Agrupa itens submetidos concorrentemente e os executa em lote com run_batch.
+
+    run_batch(itens) -> resultados (mesma ordem) roda numa única thread de inferência.
+    batch_key(item) define quais itens podem compartilhar um lote (ex.: mesmos parâmetros
+    de amostragem); itens com chaves diferentes viram lotes separados.
+    """
+
+    def __init__(self, run_batch: Callable[[list], list], batch_key: Callable[[Any], Hashable] = lambda item: None,
+                 max_batch_size: int = DEFAULT_MAX_BATCH_SIZE, max_wait_ms: float = DEFAULT_BATCH_WAIT_MS,
+                 name: str = "llm-inference"):
+        self.run_batch = run_batch
+        self.batch_key = batch_key
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+        self.batches_run = 0
+        self.items_run = 0
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, item) -> Any:
+        """Enfileira o item e aguarda o resultado do lote em que ele for executado."""
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = self._queue or asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def _collect(self) -> list:
+        """Espera o primeiro item e junta os que chegarem dentro da janela de espera."""
+        pending = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(pending) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                # Janela encerrada: ainda aproveita o que já está na fila, sem esperar
+                while len(pending) < self.max_batch_size and not self._queue.empty():
+                    pending.append(self._queue.get_nowait())
+                break
+            try:
+                pending.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                continue
+        return pending
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = await self._collect()
+            groups = {}
+            for item, future in pending:
+                if future.cancelled():
+                    continue  # Cliente desistiu antes do lote começar
+                groups.setdefault(self.batch_key(item), []).append((item, future))
+            for group in groups.values():
+                items = [item for item, _ in group]
+                try:
+                    results = await loop.run_in_executor(self.executor, self.run_batch, items)
+                except Exception as e:
+                    for _, future in group:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                self.batches_run += 1
+                self.items_run += len(items)
+                for (_, future), result in zip(group, results):
+                    if not future.done():
+                        future.set_result(result)
@@ -2,13 +2,25 @@
 import os
 import torch
 import json
+import asyncio
+import copy
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, HTTPException
-from transformers import AutoModelForCausalLM, AutoTokenizer, PreTrainedTokenizer, PreTrainedModel
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from transformers import __version__ as transformers_version, AutoModelForCausalLM, AutoTokenizer, PreTrainedTokenizer, PreTrainedModel, StoppingCriteria, StoppingCriteriaList, TextStreamer
 from pydantic import BaseModel, Field
 import uvicorn
 import logging
 import sys
 
+from llm_prefix_cache import DEFAULT_PREFIX_BLOCK_TOKENS, DEFAULT_PREFIX_CACHE_MB, PrefixCache
+from llm_response_cache import DEFAULT_CACHE_MAX_DISK_ENTRIES, DEFAULT_CACHE_MAX_ENTRIES, ResponseCache, make_cache_key
+from llm_scheduler import DEFAULT_BATCH_WAIT_MS, DEFAULT_MAX_BATCH_SIZE, BatchScheduler
+from service_metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsRegistry, SlowRequestProfiler, add_process_metrics
+
 # ... (resto do código, logging, carregamento do modelo, etc. - MANTIDO IGUAL) ...
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - [%(levelname)s] - %(name)s - %(message)s')
@@ -31,30 +43,115 @@ DEFAULT_TEMP = 0.7
 DEFAULT_MAX_TOKENS = 1024
 DEFAULT_REPEAT_PENALTY = 1.1
 DEFAULT_CONTEXT_SIZE = 2048
+# Lotes de inferência: quantas requisições concorrentes juntar e quanto esperar por elas
+MAX_BATCH_SIZE = int(os.environ.get("LLM_MAX_BATCH_SIZE", DEFAULT_MAX_BATCH_SIZE))
+BATCH_WAIT_MS = float(os.environ.get("LLM_BATCH_WAIT_MS", DEFAULT_BATCH_WAIT_MS))
+# Gerações em streaming simultâneas (cada uma ocupa uma thread própria)
+MAX_CONCURRENT_STREAMS = int(os.environ.get("LLM_MAX_STREAMS", 2))
+# Cache de KV por prefixo de prompt (0 desativa)
+PREFIX_CACHE_MB = float(os.environ.get("LLM_PREFIX_CACHE_MB", DEFAULT_PREFIX_CACHE_MB))
+PREFIX_BLOCK_TOKENS = int(os.environ.get("LLM_PREFIX_BLOCK_TOKENS", DEFAULT_PREFIX_BLOCK_TOKENS))
+# Cache de respostas: determinísticas (do_sample=False) sempre; amostradas só com LLM_CACHE_SAMPLED=1
+RESPONSE_CACHE_ENABLED = os.environ.get("LLM_RESPONSE_CACHE", "1") != "0"
+RESPONSE_CACHE_DB = os.environ.get("LLM_CACHE_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_cache.db"))
+RESPONSE_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", 0)) # Segundos; 0 = sem expiração
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", DEFAULT_CACHE_MAX_ENTRIES))
+RESPONSE_CACHE_MAX_DISK_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_DISK_ENTRIES", DEFAULT_CACHE_MAX_DISK_ENTRIES)) # Entradas no SQLite (as mais antigas saem)
+CACHE_SAMPLED = os.environ.get("LLM_CACHE_SAMPLED", "0") == "1"
+
+# Carregamento: fp32 (original), bf16 (metade da RAM) ou int8 (quantização dinâmica das camadas Linear, só CPU)
+LOAD_MODES = ("fp32", "bf16", "int8")
+LOAD_MODE = os.environ.get("LLM_LOAD_MODE", "fp32").lower()
+if LOAD_MODE not in LOAD_MODES:
+    logger.warning(f"LLM_LOAD_MODE '{LOAD_MODE}' desconhecido. Usando fp32. Opções: {', '.join(LOAD_MODES)}")
+    LOAD_MODE = "fp32"
+# Tipo efetivo dos pesos (int8 só quantiza em CPU); entra na chave do cache de respostas
+MODEL_DTYPE = "bfloat16" if LOAD_MODE == "bf16" else "qint8" if LOAD_MODE == "int8" and DEVICE.type == "cpu" else "float32"
+NUM_THREADS = int(os.environ.get("LLM_NUM_THREADS", 0)) # Threads intra-op do torch; 0 = padrão (núcleos físicos)
+NUM_INTEROP_THREADS = int(os.environ.get("LLM_NUM_INTEROP_THREADS", 0))
+
+if NUM_THREADS > 0:
+    torch.set_num_threads(NUM_THREADS)
+if NUM_INTEROP_THREADS > 0:
+    try:
+        torch.set_num_interop_threads(NUM_INTEROP_THREADS)
+    except RuntimeError as e: # Só pode ser definido antes de qualquer trabalho paralelo
+        logger.warning(f"Não foi possível definir LLM_NUM_INTEROP_THREADS: {e}")
+logger.info(f"Threads do torch: intra-op {torch.get_num_threads()}, inter-op {torch.get_num_interop_threads()}")
 
 model: PreTrainedModel | None = None
 tokenizer: PreTrainedTokenizer | None = None
-try:
-    logger.info(f"Carregando tokenizer de: {MODEL_PATH}")
+model_status = "loading" # loading -> ok | error; o carregamento roda em segundo plano após o startup
+model_error: str | None = None
+model_load_seconds: float | None = None
+_load_started_at = time.perf_counter()
+
+def _has_safetensors(model_path: str) -> bool | None:
+    """True se a pasta local tem pesos .safetensors; None (decide o transformers) para IDs do Hub."""
+    if not os.path.isdir(model_path):
+        return None
+    return any(name.endswith(".safetensors") for name in os.listdir(model_path))
+
+def _load_model_weights(model_path: str, load_mode: str) -> PreTrainedModel:
+    """Carrega os pesos no modo pedido. safetensors é lido por mmap: os pesos não são copiados
+    para um buffer intermediário e low_cpu_mem_usage evita instanciar o modelo duas vezes."""
+    load_kwargs = {"trust_remote_code": True, "low_cpu_mem_usage": True, "use_safetensors": _has_safetensors(model_path)}
+    dtype_kwarg = "dtype" if int(transformers_version.split(".")[0]) >= 5 else "torch_dtype" # Renomeado no transformers 5
+    load_kwargs[dtype_kwarg] = torch.bfloat16 if load_mode == "bf16" else torch.float32
+
+    loaded_model = AutoModelForCausalLM.from_pretrained(model_path, **load_kwargs)
+    if load_mode == "int8":
+        if DEVICE.type != "cpu":
+            logger.warning("Quantização int8 dinâmica só é suportada em CPU. Mantendo os pesos em fp32.")
+        else:
+            # Pesos das camadas Linear em int8; ativações quantizadas em tempo de execução
+            from torch.ao.quantization import quantize_dynamic
+            loaded_model = quantize_dynamic(loaded_model, {torch.nn.Linear}, dtype=torch.qint8)
+    loaded_model.eval()
+    return loaded_model.to(DEVICE)
+
+def load_model():
+    """Carrega tokenizer e modelo e publica os dois juntos. Chamado pela thread de startup."""
+    global model, tokenizer, model_status, model_error, model_load_seconds
+    started_at = time.perf_counter()
     try:
-        tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH, trust_remote_code=True)
-    except Exception as auto_err:
-        logger.warning(f"AutoTokenizer falhou ({auto_err}), tentando LlamaTokenizerFast...")
-        from transformers import LlamaTokenizerFast
-        tokenizer = LlamaTokenizerFast.from_pretrained(MODEL_PATH, trust_remote_code=True)
-
-    logger.info(f"Carregando modelo de: {MODEL_PATH} para o dispositivo {DEVICE}")
-    model = AutoModelForCausalLM.from_pretrained(MODEL_PATH, trust_remote_code=True).to(DEVICE)
-    if tokenizer.pad_token_id is None:
-        tokenizer.pad_token_id = tokenizer.eos_token_id
-        if model.config.pad_token_id is None:
-             model.config.pad_token_id = model.config.eos_token_id
-        logger.info(f"pad_token_id definido como eos_token_id: {tokenizer.eos_token_id}")
-    logger.info("Modelo e tokenizer carregados com sucesso.")
-except Exception as e:
-    logger.exception(f"Falha CRÍTICA ao carregar o modelo ou tokenizer de {MODEL_PATH}: {e}")
-    model = None
-    tokenizer = None
+        logger.info(f"Carregando tokenizer de: {MODEL_PATH}")
+        try:
+            loaded_tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH, trust_remote_code=True)
+        except Exception as auto_err:
+            logger.warning(f"AutoTokenizer falhou ({auto_err}), tentando LlamaTokenizerFast...")
+            from transformers import LlamaTokenizerFast
+            loaded_tokenizer = LlamaTokenizerFast.from_pretrained(MODEL_PATH, trust_remote_code=True)
+
+        logger.info(f"Carregando modelo de: {MODEL_PATH} para o dispositivo {DEVICE} (modo {LOAD_MODE})")
+        loaded_model = _load_model_weights(MODEL_PATH, LOAD_MODE)
+        if loaded_tokenizer.pad_token_id is None:
+            loaded_tokenizer.pad_token_id = loaded_tokenizer.eos_token_id
+            if loaded_model.config.pad_token_id is None:
+                 loaded_model.config.pad_token_id = loaded_model.config.eos_token_id
+            logger.info(f"pad_token_id definido como eos_token_id: {loaded_tokenizer.eos_token_id}")
+        loaded_tokenizer.padding_side = "left" # Modelos causais geram a partir do fim: padding à esquerda nos lotes
+        tokenizer, model = loaded_tokenizer, loaded_model
+        model_load_seconds = time.perf_counter() - started_at
+        model_status = "ok"
+        logger.info(f"Modelo e tokenizer carregados com sucesso em {model_load_seconds:.1f}s (modo {LOAD_MODE}).")
+    except Exception as e:
+        logger.exception(f"Falha CRÍTICA ao carregar o modelo ou tokenizer de {MODEL_PATH}: {e}")
+        model = None
+        tokenizer = None
+        model_error = str(e)
+        model_status = "error"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # O servidor começa a responder (/health) imediatamente; o modelo carrega em segundo plano
+    threading.Thread(target=load_model, name="llm-model-loader", daemon=True).start()
+    yield
+
+def _unavailable_detail() -> str:
+    if model_status == "loading":
+        return "Modelo ainda está carregando. Tente novamente em instantes."
+    return "Modelo não está disponível."
 
 class GenerateRequest(BaseModel):
     prompt: str
@@ -65,21 +162,198 @@ class GenerateRequest(BaseModel):
     repetition_penalty: float = DEFAULT_REPEAT_PENALTY
     top_p: float | None = None
     top_k: int | None = None
+    use_cache: bool = True # False força nova geração (ignora e não consulta o cache de respostas)
 
-app = FastAPI( title="Servidor LLM Local", description="API para gerar texto.", version="0.1.0", )
+app = FastAPI( title="Servidor LLM Local", description="API para gerar texto.", version="0.1.0", lifespan=lifespan, )
 
 @app.get("/health")
 async def health_check():
-    if model is not None and tokenizer is not None:
-        return {"status": "ok", "model_loaded": True, "device": str(DEVICE)}
-    else:
-        return {"status": "error", "model_loaded": False, "message": "Modelo ou tokenizer não carregados."}
+    """Prontidão: 200 com o modelo carregado; 503 enquanto carrega ou se o carregamento falhou."""
+    if model_status == "ok" and model is not None and tokenizer is not None:
+        return {"status": "ok", "model_loaded": True, "device": str(DEVICE), "load_mode": LOAD_MODE,
+                "load_seconds": round(model_load_seconds, 2), "num_threads": torch.get_num_threads()}
+    if model_status == "loading":
+        return JSONResponse(status_code=503, content={"status": "loading", "model_loaded": False, "load_mode": LOAD_MODE,
+                                                      "elapsed_seconds": round(time.perf_counter() - _load_started_at, 2)})
+    return JSONResponse(status_code=503, content={"status": "error", "model_loaded": False,
+                                                  "message": f"Modelo ou tokenizer não carregados: {model_error}"})
+
+def _tokenizer_max_length(max_new_tokens: int) -> int:
+    tokenizer_max_length = DEFAULT_CONTEXT_SIZE - max_new_tokens
+    if tokenizer_max_length <= 10:
+         logger.warning(f"max_new_tokens ({max_new_tokens}) muito grande para contexto ({DEFAULT_CONTEXT_SIZE}). Max length do tokenizer será pequeno.")
+         tokenizer_max_length = max(1, tokenizer_max_length)
+    return tokenizer_max_length
+
+def _sampling_key(request_data: GenerateRequest) -> tuple:
+    """Parâmetros de amostragem que influenciam a saída."""
+    if not request_data.do_sample:
+        # Sem amostragem temperatura/top_p/top_k não influenciam a saída
+        return (False, request_data.repetition_penalty)
+    return (True, request_data.temperature, request_data.repetition_penalty, request_data.top_p, request_data.top_k)
+
+def _batch_key(request_data: GenerateRequest) -> tuple:
+    """Requisições que podem dividir um lote: mesma amostragem e mesmo max_new_tokens. Assim cada
+    prompt é truncado como numa geração avulsa (a saída não depende dos vizinhos de lote) e
+    nenhuma requisição espera por tokens que só outra pediu."""
+    return (_sampling_key(request_data), request_data.max_new_tokens)
+
+def _generation_params(request_data: GenerateRequest, max_new_tokens: int) -> dict:
+    generation_params = {
+        "max_new_tokens": max_new_tokens,
+        "temperature": request_data.temperature,
+        "do_sample": request_data.do_sample,
+        "repetition_penalty": request_data.repetition_penalty,
+        "pad_token_id": tokenizer.pad_token_id,
+        "eos_token_id": tokenizer.eos_token_id,
+    }
+    if request_data.top_p is not None: generation_params["top_p"] = request_data.top_p
+    if request_data.top_k is not None: generation_params["top_k"] = request_data.top_k
+    return generation_params
+
+prefix_cache = PrefixCache(int(PREFIX_CACHE_MB * 1024 * 1024), PREFIX_BLOCK_TOKENS) if PREFIX_CACHE_MB > 0 else None
+
+# --- Métricas (/metrics, formato Prometheus) ---
+metrics = MetricsRegistry()
+add_process_metrics(metrics)
+request_latency = metrics.histogram("llm_request_duration_seconds", "Duração das requisições (streaming: até o fim do stream).", ("endpoint",))
+requests_total = metrics.counter("llm_requests_total", "Requisições por endpoint e status (499 = cliente desconectou).", ("endpoint", "status"))
+batch_sizes = metrics.histogram("llm_batch_size", "Requisições por lote de inferência.", buckets=(1, 2, 4, 8, 16, 32, 64))
+prompt_tokens_total = metrics.counter("llm_prompt_tokens_total", "Tokens de prompt processados.", ("endpoint",))
+generated_tokens_total = metrics.counter("llm_generated_tokens_total", "Tokens gerados.", ("endpoint",))
+prefill_seconds = metrics.histogram("llm_prefill_seconds", "Tempo até o primeiro token (prefill) por lote/stream.", ("endpoint",))
+decode_seconds = metrics.histogram("llm_decode_seconds", "Tempo de decodificação após o primeiro token por lote/stream.", ("endpoint",))
+decode_tokens_per_second = metrics.histogram("llm_decode_tokens_per_second", "Vazão da decodificação (tokens/s somando as linhas do lote).",
+                                             ("endpoint",), buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000))
+active_streams = 0 # Streams abertos (atualizado no event loop)
+metrics.gauge("llm_queue_depth", "Requisições aguardando um lote de inferência.", callback=lambda: scheduler.queue_depth())
+metrics.gauge("llm_active_streams", "Streams SSE em andamento.", callback=lambda: active_streams)
+metrics.counter("llm_batches_total", "Lotes de inferência executados.", callback=lambda: scheduler.batches_run)
+metrics.gauge("llm_model_loaded", "1 com o modelo carregado e pronto.", callback=lambda: int(model_status == "ok"))
+metrics.gauge("llm_model_load_seconds", "Duração do carregamento do modelo.", callback=lambda: model_load_seconds)
+metrics.gauge("llm_prefix_cache_bytes", "Memória usada pelo cache de prefixos (KV).",
+              callback=lambda: prefix_cache.bytes_used if prefix_cache is not None else None)
+metrics.counter("llm_prefix_cache_lookups_total", "Consultas ao cache de prefixos por resultado.", ("result",),
+                callback=lambda: {("hit",): prefix_cache.hits, ("miss",): prefix_cache.misses} if prefix_cache is not None else None)
+metrics.counter("llm_response_cache_lookups_total", "Consultas ao cache de respostas por resultado.", ("result",),
+                callback=lambda: {("memory_hit",): response_cache.memory_hits, ("disk_hit",): response_cache.disk_hits,
+                                  ("miss",): response_cache.misses} if response_cache is not None else None)
+if torch.cuda.is_available():
+    metrics.gauge("llm_cuda_memory_allocated_bytes", "Memória CUDA alocada por tensores.", callback=torch.cuda.memory_allocated)
+    metrics.gauge("llm_cuda_memory_reserved_bytes", "Memória CUDA reservada pelo alocador.", callback=torch.cuda.memory_reserved)
+
+# Profiling opcional: LLM_PROFILE_SLOW_MS > 0 grava o trace de cada lote/stream que passar desse tempo
+# em LLM_PROFILE_DIR; LLM_PROFILE_MODE=cprofile (.prof) ou torch (trace .json do torch.profiler)
+request_profiler = SlowRequestProfiler(float(os.environ.get("LLM_PROFILE_SLOW_MS", 0)),
+                                       os.environ.get("LLM_PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles")),
+                                       mode=os.environ.get("LLM_PROFILE_MODE", "cprofile").lower(),
+                                       sample_rate=float(os.environ.get("LLM_PROFILE_SAMPLE_RATE", 1)), name="llm")
+
+def _observe_request(endpoint: str, started_at: float, status: int):
+    request_latency.observe(time.perf_counter() - started_at, (endpoint,))
+    requests_total.inc(labels=(endpoint, str(status)))
+
+class _TimingCriteria(StoppingCriteria):
+    """Não interrompe a geração: marca quando o primeiro token saiu (fim do prefill) para as métricas."""
+    def __init__(self):
+        self.first_token_at: float | None = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        return torch.zeros((input_ids.shape[0],), dtype=torch.bool, device=input_ids.device)
+
+def _observe_generation(endpoint: str, started_at: float, first_token_at: float | None, prompt_tokens: int,
+                        generated_tokens: int, rows: int = 1):
+    finished_at = time.perf_counter()
+    prompt_tokens_total.inc(prompt_tokens, (endpoint,))
+    generated_tokens_total.inc(generated_tokens, (endpoint,))
+    if first_token_at is None:
+        return
+    prefill_seconds.observe(first_token_at - started_at, (endpoint,))
+    decode_time = finished_at - first_token_at
+    decode_seconds.observe(decode_time, (endpoint,))
+    decode_tokens = generated_tokens - rows # O primeiro token de cada linha sai junto com o prefill
+    if decode_time > 0 and decode_tokens > 0:
+        decode_tokens_per_second.observe(decode_tokens / decode_time, (endpoint,))
+
+def _generate_single(input_ids: torch.Tensor, generation_params: dict, **extra):
+    """Gera para um único prompt, retomando do KV-cache do maior prefixo conhecido.
+
+    Na primeira vez que um prefixo aparece, o prefill dele é feito separadamente e guardado;
+    a geração então processa só o restante do prompt.
+    """
+    prompt_ids = input_ids[0].tolist()
+    prefix_length = prefix_cache.prefix_length(len(prompt_ids)) if prefix_cache is not None else 0
+    if not prefix_length:
+        return model.generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids), **generation_params, **extra)
+
+    hit = prefix_cache.lookup(prompt_ids)
+    cached_tokens, past_key_values = hit if hit is not None else (0, None)
+    if cached_tokens < prefix_length:
+        # Completa o prefill do prefixo a partir do que já estava em cache e guarda o resultado
+        prefix_out = model(input_ids=input_ids[:, cached_tokens:prefix_length], past_key_values=past_key_values, use_cache=True)
+        prefix_cache.store(prompt_ids[:prefix_length], prefix_out.past_key_values)
+        past_key_values = copy.deepcopy(prefix_out.past_key_values)
+    logger.debug(f"Prefix cache: {cached_tokens} de {len(prompt_ids)} tokens do prompt reaproveitados.")
+    return model.generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids),
+                          past_key_values=past_key_values, **generation_params, **extra)
+
+def _run_generation_batch(batch: list[GenerateRequest]) -> list[str]:
+    """Executa um lote (mesmos parâmetros de amostragem) com padding à esquerda. Roda na thread de inferência."""
+    # Cada prompt é truncado pelo próprio max_new_tokens, como em /generate avulso (_batch_key agrupa
+    # só requisições com o mesmo valor; o máximo abaixo é uma salvaguarda)
+    max_new_tokens = max(r.max_new_tokens for r in batch)
+    encoded = [tokenizer(r.prompt, truncation=True, max_length=_tokenizer_max_length(r.max_new_tokens))["input_ids"] for r in batch]
+    inputs = tokenizer.pad({"input_ids": encoded}, padding=True, return_tensors="pt").to(DEVICE)
+    input_ids_len = inputs['input_ids'].shape[1]
+    generation_params = _generation_params(batch[0], max_new_tokens)
+    logger.info(f"Lote de {len(batch)} requisição(ões): prompts de {min(map(len, encoded))}-{max(map(len, encoded))} tokens, parâmetros: {generation_params}")
+    batch_sizes.observe(len(batch))
+    timing = _TimingCriteria()
+    started_at = time.perf_counter()
+
+    with torch.no_grad(), request_profiler.profile("generate_batch"):
+        if len(batch) == 1:
+            outputs = _generate_single(inputs["input_ids"], generation_params, stopping_criteria=StoppingCriteriaList([timing]))
+        else:
+            # Com padding os prefixos não se alinham entre linhas: lotes maiores fazem o prefill completo
+            outputs = model.generate(**inputs, **generation_params, stopping_criteria=StoppingCriteriaList([timing]))
+
+    responses = []
+    token_count = 0
+    for r, output in zip(batch, outputs):
+        # Cada linha respeita o próprio max_new_tokens (o lote gera até o maior deles)
+        generated_tokens = output[input_ids_len:input_ids_len + r.max_new_tokens]
+        token_count += int((generated_tokens != tokenizer.pad_token_id).sum()) if tokenizer.pad_token_id is not None else len(generated_tokens)
+        responses.append(tokenizer.decode(generated_tokens, skip_special_tokens=True))
+    _observe_generation("generate", started_at, timing.first_token_at, sum(map(len, encoded)), token_count, len(batch))
+    return responses
+
+scheduler = BatchScheduler(_run_generation_batch, batch_key=_batch_key,
+                           max_batch_size=MAX_BATCH_SIZE, max_wait_ms=BATCH_WAIT_MS)
+
+response_cache = ResponseCache(RESPONSE_CACHE_DB, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL,
+                               max_disk_entries=RESPONSE_CACHE_MAX_DISK_ENTRIES) if RESPONSE_CACHE_ENABLED else None
+
+def _response_cache_key(request_data: GenerateRequest) -> str | None:
+    """Chave do cache de respostas, ou None se a requisição não deve ser cacheada."""
+    if response_cache is None or not request_data.use_cache:
+        return None
+    if request_data.do_sample and not CACHE_SAMPLED:
+        return None
+    # Modos de carregamento diferentes geram saídas diferentes: o cache em disco não os mistura
+    params = {"max_new_tokens": request_data.max_new_tokens, "sampling": list(_sampling_key(request_data)),
+              "load_mode": LOAD_MODE, "dtype": MODEL_DTYPE}
+    return make_cache_key(MODEL_PATH, request_data.prompt, params)
 
 @app.post("/generate")
 async def generate(request_data: GenerateRequest):
+    started_at = time.perf_counter()
     if model is None or tokenizer is None:
         logger.error("Tentativa de geração sem modelo/tokenizer carregado.")
-        raise HTTPException(status_code=503, detail="Modelo não está disponível.")
+        _observe_request("generate", started_at, 503)
+        raise HTTPException(status_code=503, detail=_unavailable_detail())
 
     logger.info(f"Recebida requisição (prompt: {request_data.prompt[:50]}...)")
 
@@ -87,50 +361,150 @@ async def generate(request_data: GenerateRequest):
         logger.warning("Schema JSON recebido, mas não utilizado ativamente.")
 
     try:
-        tokenizer_max_length = DEFAULT_CONTEXT_SIZE - request_data.max_new_tokens
-        if tokenizer_max_length <= 10:
-             logger.warning(f"max_new_tokens ({request_data.max_new_tokens}) muito grande para contexto ({DEFAULT_CONTEXT_SIZE}). Max length do tokenizer será pequeno.")
-             tokenizer_max_length = max(1, tokenizer_max_length)
-
-        inputs = tokenizer(request_data.prompt, return_tensors="pt", truncation=True, max_length=tokenizer_max_length).to(DEVICE)
-        input_ids_len = inputs['input_ids'].shape[1]
-        logger.info(f"Tamanho do prompt tokenizado: {input_ids_len} (max_length={tokenizer_max_length})")
-
-        generation_params = {
-            "max_new_tokens": request_data.max_new_tokens,
-            "temperature": request_data.temperature,
-            "do_sample": request_data.do_sample,
-            "repetition_penalty": request_data.repetition_penalty,
-            "pad_token_id": tokenizer.pad_token_id,
-            "eos_token_id": tokenizer.eos_token_id,
-        }
-        if request_data.top_p is not None: generation_params["top_p"] = request_data.top_p
-        if request_data.top_k is not None: generation_params["top_k"] = request_data.top_k
-
-        logger.info(f"Parâmetros de geração: {generation_params}")
-
-        with torch.no_grad():
-            outputs = model.generate(**inputs, **generation_params)
-
-        generated_tokens = outputs[0][input_ids_len:]
-        response_text = tokenizer.decode(generated_tokens, skip_special_tokens=True)
+        # A inferência roda em lote numa thread dedicada; o event loop fica livre
+        cache_key = _response_cache_key(request_data)
+        if cache_key is not None:
+            response_text = await response_cache.get_or_compute(cache_key, lambda: scheduler.submit(request_data))
+        else:
+            response_text = await scheduler.submit(request_data)
 
         logger.info(f"Texto gerado (tamanho: {len(response_text)}): {response_text[:100]}...")
+        _observe_request("generate", started_at, 200)
 
         return {"response": response_text.strip()}
 
     except Exception as e:
         logger.exception(f"Erro durante a geração: {e}")
+        _observe_request("generate", started_at, 500)
         raise HTTPException(status_code=500, detail=f"Erro interno ao gerar texto: {e}")
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """Contadores dos caches de inferência."""
+    return {
+        "prefix_cache": prefix_cache.stats() if prefix_cache is not None else None,
+        "response_cache": response_cache.stats() if response_cache is not None else None,
+    }
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Métricas no formato do Prometheus (fila, lotes, tokens/s, prefill/decode, memória)."""
+    return Response(metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+# --- Streaming ---
+_STREAM_END = object()
+stream_executor = ThreadPoolExecutor(max_workers=max(1, MAX_CONCURRENT_STREAMS), thread_name_prefix="llm-stream")
+
+class _CancelCriteria(StoppingCriteria):
+    """Interrompe a geração quando o cliente desconecta (evento sinalizado pelo endpoint)."""
+    def __init__(self, cancel_event: threading.Event):
+        self.cancel_event = cancel_event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.cancel_event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+class _QueueStreamer(TextStreamer):
+    """Entrega o texto decodificado incrementalmente numa asyncio.Queue e mede o primeiro token."""
+    def __init__(self, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue):
+        super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        self.loop = loop
+        self.queue = queue
+        self.first_token_at: float | None = None
+        self.token_count = 0
+
+    def put(self, value):
+        if not self.next_tokens_are_prompt:
+            if self.first_token_at is None:
+                self.first_token_at = time.perf_counter()
+            self.token_count += value.numel()
+        super().put(value)
+
+    def on_finalized_text(self, text: str, stream_end: bool = False):
+        if text:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, text)
+
+def _sse(data: dict, event: str | None = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/generate_stream")
+async def generate_stream(request_data: GenerateRequest, request: Request):
+    """Gera texto em streaming (Server-Sent Events): eventos 'data' com tokens e um evento 'done' com métricas."""
+    if model is None or tokenizer is None:
+        logger.error("Tentativa de geração (stream) sem modelo/tokenizer carregado.")
+        _observe_request("generate_stream", time.perf_counter(), 503)
+        raise HTTPException(status_code=503, detail=_unavailable_detail())
+
+    logger.info(f"Recebida requisição de streaming (prompt: {request_data.prompt[:50]}...)")
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    cancel_event = threading.Event()
+    streamer = _QueueStreamer(loop, queue)
+    started_at = time.perf_counter()
+
+    def run_generation():
+        try:
+            if cancel_event.is_set():
+                return  # Cliente saiu enquanto esperava uma thread livre
+            inputs = tokenizer(request_data.prompt, return_tensors="pt", truncation=True,
+                               max_length=_tokenizer_max_length(request_data.max_new_tokens)).to(DEVICE)
+            generation_started_at = time.perf_counter()
+            with torch.no_grad(), request_profiler.profile("generate_stream"):
+                _generate_single(inputs["input_ids"], _generation_params(request_data, request_data.max_new_tokens),
+                                 streamer=streamer, stopping_criteria=StoppingCriteriaList([_CancelCriteria(cancel_event)]))
+            _observe_generation("generate_stream", generation_started_at, streamer.first_token_at,
+                                inputs["input_ids"].shape[1], streamer.token_count)
+            if cancel_event.is_set():
+                logger.info(f"Geração em streaming cancelada após {streamer.token_count} tokens.")
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, _STREAM_END)
+
+    generation = loop.run_in_executor(stream_executor, run_generation)
+
+    async def event_stream():
+        global active_streams
+        active_streams += 1
+        finished = False
+        status = 200
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is _STREAM_END:
+                    break
+                if await request.is_disconnected():
+                    logger.info("Cliente desconectou durante o streaming. Cancelando geração.")
+                    cancel_event.set()
+                    break
+                yield _sse({"token": chunk})
+            await generation
+            total_ms = (time.perf_counter() - started_at) * 1000
+            ttft_ms = (streamer.first_token_at - started_at) * 1000 if streamer.first_token_at else None
+            logger.info(f"Streaming concluído: {streamer.token_count} tokens, TTFT {ttft_ms or 0:.0f} ms, total {total_ms:.0f} ms"
+                        f"{' (cancelado)' if cancel_event.is_set() else ''}")
+            finished = True
+            if not cancel_event.is_set():
+                yield _sse({"tokens": streamer.token_count, "ttft_ms": ttft_ms, "total_ms": total_ms}, event="done")
+        except Exception as e:
+            finished = True
+            status = 500
+            logger.exception(f"Erro durante a geração em streaming: {e}")
+            yield _sse({"detail": f"Erro interno ao gerar texto: {e}"}, event="error")
+        finally:
+            # Desconexão (inclusive cancelamento da tarefa pelo servidor) libera a thread de geração
+            if not finished:
+                logger.info("Streaming interrompido pelo cliente. Cancelando geração.")
+            if status == 200 and (cancel_event.is_set() or not finished):
+                status = 499 # Cliente desconectou
+            cancel_event.set()
+            active_streams -= 1
+            _observe_request("generate_stream", started_at, status)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # --- Execução ---
 if __name__ == "__main__":
-    if model is None or tokenizer is None:
-        logger.error("-" * 50)
-        logger.error("ERRO CRÍTICO: Modelo ou Tokenizer não carregados.")
-        logger.error(f"Verifique o caminho '{MODEL_PATH}' e o conteúdo da pasta.")
-        logger.error("Servidor iniciará, mas /generate falhará.")
-        logger.error("-" * 50)
+    # O modelo é carregado no startup do app (lifespan); falhas aparecem no log e em /health
 
     # *** MUDANÇA DA PORTA AQUI ***
     port = int(os.environ.get("PORT", 8001)) # Mudado de 8000 para 8001
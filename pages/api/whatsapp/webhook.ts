@@ -88,10 +88,16 @@ export default async function handler(
         const flowData = await flowResponse.json();
         console.log('[Webhook POST] Resposta do Flow Controller:', flowData);
 
-        if (flowData.response_message) {
-           console.log(`[Webhook POST] Enviando resposta via whatsappSender para ${normalizedSenderId}: "${flowData.response_message}"`);
-           // ** PONTO CRÍTICO: Chamar a função de envio REAL **
-           await sendMessageToWhatsApp(normalizedSenderId, { text: flowData.response_message });
+        // Uma mensagem pode percorrer vários nós: response_payloads traz todas as mensagens, em ordem
+        const payloads = flowData.response_payloads
+          || (flowData.response_payload ? [flowData.response_payload] : [])
+          .concat(flowData.response_message ? [{ text: flowData.response_message }] : []);
+        if (payloads.length > 0) {
+           console.log(`[Webhook POST] Enviando ${payloads.length} mensagem(ns) via whatsappSender para ${normalizedSenderId}`);
+           // ** PONTO CRÍTICO: Chamar a função de envio REAL ** (em sequência, para manter a ordem)
+           for (const payload of payloads) {
+             await sendMessageToWhatsApp(normalizedSenderId, payload);
+           }
            console.log('[Webhook POST] Mensagem enviada (ou enfileirada).');
         } else {
            console.log('[Webhook POST] Flow Controller não retornou mensagem de resposta.');
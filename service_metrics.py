@@ -0,0 +1,256 @@
+# service_metrics.py
+# Métricas no formato texto do Prometheus (exposition format 0.0.4) para o flow_controller e o
+# llm_server, sem dependências externas: contadores, gauges e histogramas com labels, e valores
+# lidos na hora da coleta (callbacks) para estatísticas que os módulos já mantêm.
+# Também traz o SlowRequestProfiler: profiling opcional (cProfile ou torch.profiler) que grava
+# o trace só das requisições que passaram do limite de tempo.
+import bisect
+import cProfile
+import contextlib
+import logging
+import os
+import random
+import threading
+import time
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Segundos; cobre do caminho quente do flow_controller (~10 us) a gerações longas do LLM
+DEFAULT_LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                           1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PROFILE_MODES = ("cprofile", "torch")
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int) or (isinstance(value, float) and value.is_integer() and abs(value) < 1e15):
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), callback: Callable | None = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # callback() -> número, ou {valores dos labels: número}; lido a cada coleta
+        self.callback = callback
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _samples(self) -> list:
+        if self.callback is None:
+            with self._lock:
+                return list(self._values.items())
+        value = self.callback()
+        if value is None:
+            return []
+        return list(value.items()) if isinstance(value, dict) else [((), value)]
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self._samples():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """Contador monotônico. labels: tupla de valores na ordem de labelnames."""
+    kind = "counter"
+
+    def inc(self, amount: float = 1, labels: tuple = ()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, labels: tuple = ()):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    """Histograma com buckets fixos (limites superiores, em ordem crescente)."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, labels: tuple = ()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # [contagem por bucket (+Inf no fim), soma]
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        for labels, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Conjunto de métricas de um servidor; render() gera o corpo de /metrics."""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = (), callback: Callable | None = None) -> Counter:
+        return self._register(Counter(name, documentation, labelnames, callback))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = (), callback: Callable | None = None) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> bytes:
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # Uma estatística indisponível (ex.: banco ocupado) não derruba a coleta inteira
+                logger.warning(f"Falha ao coletar a métrica {metric.name}: {e}")
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def memory_bytes() -> tuple[int | None, int | None]:
+    """(RSS atual, pico de RSS) do processo em bytes, de /proc; fora do Linux usa getrusage (só o pico)."""
+    current = peak = None
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    current = int(line.split()[1]) * 1024
+                elif line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) * 1024
+    except OSError:
+        try:
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        except ImportError:
+            pass
+    return current, peak
+
+
+def add_process_metrics(registry: MetricsRegistry):
+    """Métricas padrão de processo (memória, CPU, threads, início)."""
+    start_time = time.time()
+    registry.gauge("process_resident_memory_bytes", "Memória residente (RSS) do processo.", callback=lambda: memory_bytes()[0])
+    registry.gauge("process_peak_resident_memory_bytes", "Pico de memória residente do processo.", callback=lambda: memory_bytes()[1])
+    registry.counter("process_cpu_seconds_total", "Tempo de CPU (usuário + sistema) do processo.",
+                     callback=lambda: os.times().user + os.times().system)
+    registry.gauge("process_threads", "Threads Python ativas.", callback=threading.active_count)
+    registry.gauge("process_start_time_seconds", "Início do processo (epoch).", callback=lambda: start_time)
+
+
+class SlowRequestProfiler:
+    """Profiling opcional por requisição: grava o trace das que levarem pelo menos threshold_ms.
+
+    Desligado (threshold_ms <= 0), profile() devolve um contexto vazio. Ligado, perfila uma
+    requisição por vez (as concorrentes seguem sem profiling) e, com sample_rate < 1, só uma
+    fração delas. mode "cprofile" grava .prof (pstats / snakeviz); "torch" grava um trace
+    .json do torch.profiler (chrome://tracing).
+    """
+
+    def __init__(self, threshold_ms: float, output_dir: str, mode: str = "cprofile", sample_rate: float = 1.0, name: str = "request"):
+        self.threshold = threshold_ms / 1000.0
+        self.output_dir = output_dir
+        self.mode = mode if mode in PROFILE_MODES else "cprofile"
+        self.sample_rate = sample_rate
+        self.name = name
+        self.enabled = threshold_ms > 0
+        self.dumped = 0
+        self._busy = threading.Lock()
+        if self.enabled:
+            os.makedirs(output_dir, exist_ok=True)
+            logger.info(f"Profiling de requisições lentas ({self.mode}) ativo: >= {threshold_ms:.0f} ms, traces em {output_dir}")
+
+    def profile(self, label: str):
+        if not self.enabled or (self.sample_rate < 1 and random.random() >= self.sample_rate):
+            return contextlib.nullcontext()
+        return self._profile(label)
+
+    @contextlib.contextmanager
+    def _profile(self, label: str):
+        if not self._busy.acquire(blocking=False):
+            yield
+            return
+        try:
+            if self.mode == "torch":
+                import torch.profiler
+                profiler = torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU], record_shapes=True)
+                profiler.__enter__()
+            else:
+                profiler = cProfile.Profile()
+                profiler.enable()
+            started_at = time.perf_counter()
+            try:
+                yield
+            finally:
+                elapsed = time.perf_counter() - started_at
+                if self.mode == "torch":
+                    profiler.__exit__(None, None, None)
+                else:
+                    profiler.disable()
+                if elapsed >= self.threshold:
+                    self._dump(profiler, label, elapsed)
+        finally:
+            self._busy.release()
+
+    def _dump(self, profiler, label: str, elapsed: float):
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        # pid e sequência: nomes únicos entre workers e requisições no mesmo segundo
+        base = os.path.join(self.output_dir, f"{self.name}-{label}-{stamp}-{os.getpid()}-{self.dumped}-{int(elapsed * 1000)}ms")
+        try:
+            if self.mode == "torch":
+                path = base + ".json"
+                profiler.export_chrome_trace(path)
+            else:
+                path = base + ".prof"
+                profiler.dump_stats(path)
+        except Exception as e:
+            logger.error(f"Falha ao gravar o trace de {label} ({elapsed * 1000:.0f} ms): {e}")
+            return
+        self.dumped += 1
+        logger.warning(f"Requisição lenta: {label} levou {elapsed * 1000:.0f} ms. Trace salvo em {path}")
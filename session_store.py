@@ -0,0 +1,376 @@
+# session_store.py
+# Armazenamento das sessões de conversa do flow_controller (antigo dict global user_states).
+# Backends:
+#   - MemorySessionStore: em memória, com TTL e despejo LRU (processo único).
+#   - SQLiteSessionStore: tabela flow_sessions no database.db (WAL), compartilhável entre workers
+#     e persistente entre reinícios. Grava na hora (write-through) por padrão; a escrita em lote
+#     (write-behind) é opcional e só serve a um único processo.
+import json
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SESSION_TTL = 7 * 24 * 3600 # Sessões sem atividade por 7 dias são descartadas
+DEFAULT_MAX_SESSIONS = 100_000
+DEFAULT_FLUSH_INTERVAL = 0.0 # Segundos entre gravações em lote no SQLite; 0 = write-through
+DEFAULT_FLUSH_BATCH_SIZE = 500
+DEFAULT_LOCK_STRIPES = 256
+PURGE_INTERVAL = 60.0 # Segundos entre remoções das sessões expiradas no SQLite
+
+
+class SessionStore(ABC):
+    """Interface dos armazenamentos de sessão. Estado = dict serializável em JSON.
+
+    Um backend que não implementa todos os métodos abstratos falha já ao ser instanciado.
+    """
+    blocking_io = False  # True quando get/set fazem I/O (o servidor ASGI então processa no threadpool)
+
+    @abstractmethod
+    def get(self, sender_id: str) -> dict | None:
+        ...
+
+    @abstractmethod
+    def set(self, sender_id: str, state: dict):
+        ...
+
+    @abstractmethod
+    def delete(self, sender_id: str):
+        ...
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    def apply(self, changes: dict):
+        """Aplica várias alterações {sender_id: estado | None (remoção)} de uma vez."""
+        for sender_id, state in changes.items():
+            if state is None:
+                self.delete(sender_id)
+            else:
+                self.set(sender_id, state)
+
+    def flush(self):
+        """Grava alterações pendentes (no-op para backends síncronos)."""
+
+    def sender_transaction(self, sender_id: str):
+        """Contexto do read-modify-write da sessão de um remetente (get ... set/delete).
+
+        Backends compartilhados entre processos serializam aqui o que os locks por remetente
+        (SenderLocks) só garantem dentro do processo. No-op por padrão.
+        """
+        return nullcontext()
+
+    def close(self):
+        self.flush()
+
+
+class MemorySessionStore(SessionStore):
+    """Sessões em memória com expiração por inatividade (TTL) e limite LRU."""
+
+    def __init__(self, ttl_seconds: float = DEFAULT_SESSION_TTL, max_sessions: int = DEFAULT_MAX_SESSIONS):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max(1, max_sessions)
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # {sender_id: (expires_at, state)} do menos para o mais recente
+
+    def get(self, sender_id: str) -> dict | None:
+        with self._lock:
+            entry = self._sessions.get(sender_id)
+            if entry is None:
+                return None
+            expires_at, state = entry
+            if expires_at < time.monotonic():
+                del self._sessions[sender_id]
+                return None
+            self._sessions.move_to_end(sender_id)
+            return state
+
+    def set(self, sender_id: str, state: dict):
+        now = time.monotonic()
+        with self._lock:
+            self._sessions[sender_id] = (now + self.ttl_seconds, state)
+            self._sessions.move_to_end(sender_id)
+            self._evict(now)
+
+    def _evict(self, now: float):
+        """Despeja primeiro as sessões expiradas mais antigas, depois pelo limite LRU (chamar com o lock)."""
+        while self._sessions:
+            oldest_id, (expires_at, _) = next(iter(self._sessions.items()))
+            if expires_at >= now and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[oldest_id]
+
+    def delete(self, sender_id: str):
+        with self._lock:
+            self._sessions.pop(sender_id, None)
+
+    def apply(self, changes: dict):
+        now = time.monotonic()
+        with self._lock:
+            for sender_id, state in changes.items():
+                if state is None:
+                    self._sessions.pop(sender_id, None)
+                else:
+                    self._sessions[sender_id] = (now + self.ttl_seconds, state)
+                    self._sessions.move_to_end(sender_id)
+            self._evict(now)
+
+    def __len__(self) -> int:
+        now = time.monotonic()
+        with self._lock:
+            return sum(1 for expires_at, _ in self._sessions.values() if expires_at >= now)
+
+
+class SQLiteSessionStore(SessionStore):
+    """Sessões na tabela flow_sessions do SQLite (WAL).
+
+    Com flush_interval <= 0 (padrão) cada alteração é gravada antes de retornar (write-through)
+    e sender_transaction() abre um BEGIN IMMEDIATE: o read-modify-write de uma mensagem é
+    serializado entre workers e o próximo worker já lê o estado novo.
+    Com flush_interval > 0 as alterações são gravadas em lote por uma thread (write-behind) e
+    leituras consultam primeiro as ainda não gravadas deste processo: outros processos só as
+    enxergam após o flush, então esse modo serve apenas a um único worker.
+    """
+    blocking_io = True
+
+    def __init__(self, database_path: str, ttl_seconds: float = DEFAULT_SESSION_TTL,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL, batch_size: int = DEFAULT_FLUSH_BATCH_SIZE):
+        self.database_path = database_path
+        self.ttl_seconds = ttl_seconds
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._write_lock = threading.RLock()  # Reentrante: flush() dentro de sender_transaction()
+        self._pending = {}  # {sender_id: (updated_at, state) | None (remoção)}
+        self._inflight = {}  # Lote sendo gravado agora (continua visível para get() até o commit)
+        self._wakeup = threading.Event()
+        self._closed = threading.Event()
+        self._last_purge = 0.0  # time.monotonic() da última remoção de sessões expiradas
+        self._init_schema()
+        self._flusher = None
+        if flush_interval > 0:
+            self._flusher = threading.Thread(target=self._flush_loop, name="session-store-flusher", daemon=True)
+            self._flusher.start()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.database_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connection()
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS flow_sessions (
+                    sender_id TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )""")
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_flow_sessions_sender_id ON flow_sessions(sender_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_flow_sessions_updated_at ON flow_sessions(updated_at)")
+
+    def get(self, sender_id: str) -> dict | None:
+        with self._lock:
+            for buffered in (self._pending, self._inflight):
+                if sender_id in buffered:
+                    entry = buffered[sender_id]
+                    return entry[1] if entry is not None else None
+        row = self._connection().execute(
+            "SELECT state, updated_at FROM flow_sessions WHERE sender_id = ?", (sender_id,)
+        ).fetchone()
+        if row is None or row[1] < time.time() - self.ttl_seconds:
+            return None
+        return json.loads(row[0])
+
+    def set(self, sender_id: str, state: dict):
+        self._enqueue(sender_id, (time.time(), state))
+
+    def delete(self, sender_id: str):
+        self._enqueue(sender_id, None)
+
+    def apply(self, changes: dict):
+        """Grava todas as alterações numa única transação (a de sender_transaction(), se houver uma aberta)."""
+        now = time.time()
+        with self._lock:
+            for sender_id, state in changes.items():
+                self._pending[sender_id] = (now, state) if state is not None else None
+        self.flush()
+
+    def _enqueue(self, sender_id: str, entry):
+        with self._lock:
+            self._pending[sender_id] = entry
+            pending_count = len(self._pending)
+        if self._flusher is None:
+            self.flush()
+        elif pending_count >= self.batch_size:
+            self._wakeup.set()
+
+    @contextmanager
+    def _transaction(self):
+        """BEGIN IMMEDIATE na conexão da thread: trava a escrita no banco (entre processos) até o commit.
+
+        Threads do mesmo processo esperam no _write_lock, sem disputar o lock do SQLite.
+        """
+        with self._write_lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            self._local.in_transaction = True
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
+            finally:
+                self._local.in_transaction = False
+        self._purge_if_due()
+
+    def sender_transaction(self, sender_id: str):
+        """Um BEGIN IMMEDIATE no banco todo (o SQLite não trava por linha); no-op em write-behind."""
+        if self._flusher is not None:
+            return nullcontext()
+        return self._transaction()
+
+    def __len__(self) -> int:
+        self.flush()
+        cutoff = time.time() - self.ttl_seconds
+        return self._connection().execute("SELECT COUNT(*) FROM flow_sessions WHERE updated_at >= ?", (cutoff,)).fetchone()[0]
+
+    def flush(self):
+        """Grava todas as alterações pendentes em uma única transação."""
+        with self._write_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._inflight = pending
+            if not pending:
+                return
+            upserts = [(sender_id, json.dumps(entry[1]), entry[0]) for sender_id, entry in pending.items() if entry is not None]
+            deletes = [(sender_id,) for sender_id, entry in pending.items() if entry is None]
+            conn = self._connection()
+            # Dentro de sender_transaction() o commit fica para o fim da transação
+            in_transaction = getattr(self._local, "in_transaction", False)
+            try:
+                with nullcontext() if in_transaction else conn:
+                    if upserts:
+                        conn.executemany(
+                            "INSERT INTO flow_sessions (sender_id, state, updated_at) VALUES (?, ?, ?) "
+                            "ON CONFLICT(sender_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                            upserts)
+                    if deletes:
+                        conn.executemany("DELETE FROM flow_sessions WHERE sender_id = ?", deletes)
+            except sqlite3.Error as e:
+                logger.error(f"Erro ao gravar {len(pending)} sessão(ões) no SQLite: {e}")
+                # Devolve as alterações não gravadas, sem sobrescrever alterações mais novas
+                with self._lock:
+                    for sender_id, entry in pending.items():
+                        self._pending.setdefault(sender_id, entry)
+                raise
+            finally:
+                with self._lock:
+                    self._inflight = {}
+
+    def purge_expired(self) -> int:
+        cutoff = time.time() - self.ttl_seconds
+        with self._write_lock:
+            conn = self._connection()
+            with conn:
+                return conn.execute("DELETE FROM flow_sessions WHERE updated_at < ?", (cutoff,)).rowcount
+
+    def _purge_if_due(self):
+        """Remove as sessões expiradas a cada PURGE_INTERVAL (write-behind: pela thread; write-through: após uma transação)."""
+        now = time.monotonic()
+        if now - self._last_purge < PURGE_INTERVAL:
+            return
+        self._last_purge = now
+        try:
+            purged = self.purge_expired()
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao remover sessões expiradas do SQLite: {e}")
+            return
+        if purged:
+            logger.info(f"{purged} sessão(ões) expirada(s) removida(s) do SQLite.")
+
+    def _flush_loop(self):
+        while not self._closed.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                self._purge_if_due()
+            except sqlite3.Error:
+                pass  # Já registrado em flush(); tenta de novo no próximo ciclo
+            except Exception as e:
+                logger.error(f"Erro inesperado na gravação em lote das sessões: {e}", exc_info=True)
+
+    def close(self):
+        self._closed.set()
+        self._wakeup.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=5)
+        self.flush()
+
+
+class SenderLocks:
+    """Locks por remetente (listrados): mensagens do mesmo sender_id nunca processam em paralelo.
+
+    Um número fixo de locks evita guardar um lock por remetente; remetentes diferentes só
+    esperam um pelo outro quando caem na mesma faixa.
+    """
+
+    def __init__(self, stripes: int = DEFAULT_LOCK_STRIPES):
+        self._locks = tuple(threading.Lock() for _ in range(max(1, stripes)))
+
+    def __call__(self, sender_id: str) -> threading.Lock:
+        return self._locks[hash(sender_id) % len(self._locks)]
+
+
+class SessionBatch:
+    """Alterações de sessão acumuladas sobre um SessionStore e aplicadas juntas em commit().
+
+    Leituras enxergam as alterações ainda não aplicadas, então várias mensagens do mesmo
+    remetente no mesmo lote avançam em sequência.
+    """
+
+    def __init__(self, store: SessionStore):
+        self.store = store
+        self.changes = {}  # {sender_id: estado | None (remoção)}
+
+    def get(self, sender_id: str) -> dict | None:
+        if sender_id in self.changes:
+            return self.changes[sender_id]
+        return self.store.get(sender_id)
+
+    def set(self, sender_id: str, state: dict):
+        self.changes[sender_id] = state
+
+    def delete(self, sender_id: str):
+        self.changes[sender_id] = None
+
+    def commit(self):
+        if self.changes:
+            self.store.apply(self.changes)
+            self.changes = {}
+
+
+def create_session_store(backend: str, database_path: str, ttl_seconds: float = DEFAULT_SESSION_TTL, **options) -> SessionStore:
+    """Cria o backend de sessões pelo nome ('memory' ou 'sqlite')."""
+    backend = (backend or "memory").lower()
+    if backend == "memory":
+        return MemorySessionStore(ttl_seconds=ttl_seconds, max_sessions=options.get("max_sessions", DEFAULT_MAX_SESSIONS))
+    if backend == "sqlite":
+        return SQLiteSessionStore(database_path, ttl_seconds=ttl_seconds,
+                                  flush_interval=options.get("flush_interval", DEFAULT_FLUSH_INTERVAL),
+                                  batch_size=options.get("batch_size", DEFAULT_FLUSH_BATCH_SIZE))
+    raise ValueError(f"Backend de sessões desconhecido: '{backend}'. Use 'memory' ou 'sqlite'.")
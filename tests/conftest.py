@@ -0,0 +1,6 @@
+# tests/conftest.py
+# Os serviços Python são módulos soltos na raiz do repositório (como nos benchmarks).
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
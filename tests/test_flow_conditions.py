@@ -0,0 +1,165 @@
+# tests/test_flow_conditions.py
+# Linguagem de condições das edges (flow_conditions) e prioridade do EdgeRouter.
+import pytest
+
+from flow_conditions import compile_condition, compile_node_condition
+from flow_graph import compile_flow
+
+
+def matches(condition: str, message: str, variables: dict | None = None) -> bool:
+    compiled = compile_condition(condition)
+    message = message.strip()
+    return compiled.matches(message, message.lower(), variables)
+
+
+def test_empty_condition_is_default_edge():
+    assert compile_condition("") is None
+    assert compile_condition(None) is None
+
+
+@pytest.mark.parametrize("condition, message, expected", [
+    ("sim", " SIM ", True),
+    ("sim", "sim!", False),
+    ("= > 10", "> 10", True), # '=' permite valores que começam com operadores
+    ("== oi", "Oi", True),
+    ("!= não", "sim", True),
+    ("!= não", "NÃO", False),
+    ("contains:promo", "quero a PROMOção", True),
+    ("contains:promo", "quero o preço", False),
+    ("startswith:oi", "oi, tudo bem?", True),
+    ("startswith:oi", "e aí, oi", False),
+    ("endswith:obrigado", "muito obrigado", True),
+    ("endswith:obrigado", "obrigado!", False),
+])
+def test_text_operators(condition, message, expected):
+    assert matches(condition, message) is expected
+
+
+@pytest.mark.parametrize("message, expected", [("sim", True), ("S", True), (" yes ", True), ("talvez", False), ("sim yes", False)])
+def test_in_accepts_pipe_and_comma(message, expected):
+    assert matches("in:sim|s, yes", message) is expected
+
+
+def test_in_without_variables_is_hash_indexed():
+    assert compile_condition("in:sim|s").hash_keys == frozenset({"sim", "s"})
+    assert compile_condition("sim").hash_keys == frozenset({"sim"})
+    assert compile_condition("contains:sim").hash_keys is None
+    assert compile_condition("{{resposta}} in:sim|s").hash_keys is None # Sobre variável: não vale para a mensagem
+
+
+@pytest.mark.parametrize("condition, message, expected", [
+    (r"regex:^\d{5}-?\d{3}$", "01310-100", True),
+    (r"regex:^\d{5}-?\d{3}$", "0131-100", False),
+    (r"/^CEP/", "cep 01310100", True), # /padrão/ e sem diferenciar maiúsculas
+    ("regex:[", "[", False), # Regex inválida nunca é satisfeita
+])
+def test_regex(condition, message, expected):
+    assert matches(condition, message) is expected
+
+
+def test_invalid_regex_compiles_as_invalid():
+    assert compile_condition("regex:(").kind == "invalid"
+
+
+@pytest.mark.parametrize("condition, message, expected", [
+    ("> 10", "11", True),
+    ("> 10", "10", False),
+    (">= 10", "10", True),
+    ("< 5", "4,5", True), # Vírgula decimal
+    ("<= 5", "5.0", True),
+    ("> 10", "onze", False), # Mensagem não numérica
+    ("> dez", "11", False), # Limite inválido: nunca satisfeita
+])
+def test_numeric(condition, message, expected):
+    assert matches(condition, message) is expected
+
+
+@pytest.mark.parametrize("condition, variables, expected", [
+    ("{{email}} isset", {"email": "a@b.com"}, True),
+    ("{{email}} isset", {}, False),
+    ("{{email}}", {"email": ""}, True), # Só o sujeito: equivale a isset
+    ("{{email}} isnotset", {}, True),
+    ("{{idade}} >= 18", {"idade": "18"}, True),
+    ("{{idade}} >= 18", {"idade": "17"}, False),
+    ("{{idade}} >= 18", {}, False),
+    ("{{cidade}} in:sp|são paulo", {"cidade": "São Paulo"}, True),
+    ("{{cidade}} contains:paulo", {"cidade": "Rio"}, False),
+    ("{{plano}} == {{plano_escolhido}}", {"plano": "Pro", "plano_escolhido": "pro"}, True),
+    ("{{plano}} == {{plano_escolhido}}", {"plano": "Pro", "plano_escolhido": "básico"}, False),
+    ("{{variável}} == sim", {"variável": "Sim"}, True), # Nomes com acento
+])
+def test_variable_subjects(condition, variables, expected):
+    # A mensagem não importa quando a condição tem {{variavel}} como sujeito
+    assert matches(condition, "mensagem qualquer", variables) is expected
+
+
+def test_message_compared_with_variable_operand():
+    assert matches("{{resposta_certa}}", "Vermelho", {"resposta_certa": "azul"}) is True # Só o sujeito: isset, ignora a mensagem
+    assert matches("== {{resposta_certa}}", "Azul", {"resposta_certa": "azul"}) is True
+    assert matches("in:{{opcoes}}", "b", {"opcoes": "a|b"}) is True
+    assert matches("> {{minimo}}", "7", {"minimo": "5"}) is True
+
+
+@pytest.mark.parametrize("data, variables, expected", [
+    ({"variableName": "idade", "comparison": "greaterThan", "value": "17"}, {"idade": 18}, True),
+    ({"variableName": "idade", "comparison": "lessThan", "value": "17"}, {"idade": 18}, False),
+    ({"variableName": "nome", "comparison": "equals", "value": "Ana"}, {"nome": "ana"}, True),
+    ({"variableName": "nome", "comparison": "startsWith", "value": "an"}, {"nome": "Ana"}, True),
+    ({"variableName": "nome", "comparison": "isNotSet"}, {}, True),
+    ({"variableName": "", "comparison": "equals", "value": "x"}, {}, False),
+    ({"variableName": "nome", "comparison": "desconhecida"}, {"nome": "x"}, False),
+])
+def test_node_condition(data, variables, expected):
+    assert compile_node_condition(data).matches("", "", variables) is expected
+
+
+def flow_with_edges(*conditions) -> object:
+    """Nó 'menu' com uma edge por condição, na ordem dada (alvos t0, t1, ...)."""
+    nodes = [{"id": "start-node", "type": "input", "data": {}}, {"id": "menu", "type": "textMessage", "data": {"text": "?"}}]
+    nodes += [{"id": f"t{i}", "type": "textMessage", "data": {"text": str(i)}} for i in range(len(conditions))]
+    edges = [{"id": f"e{i}", "source": "menu", "target": f"t{i}", "data": {"condition": condition}}
+             for i, condition in enumerate(conditions)]
+    return compile_flow(1, "teste", {"nodes": nodes, "edges": edges})
+
+
+def target(flow, message: str, variables: dict | None = None):
+    edge = flow.select_edge("menu", message, variables)
+    return edge.target if edge else None
+
+
+def test_router_first_matching_edge_wins():
+    # contains:promo vem antes da igualdade indexada: tem prioridade mesmo com o índice hash
+    flow = flow_with_edges("contains:promo", "promo", "in:oi|olá", "")
+    assert target(flow, "promo") == "t0"
+    assert target(flow, "Olá") == "t2"
+    assert target(flow, "qualquer") == "t3"
+
+
+def test_router_indexed_edge_before_scanned_edge():
+    flow = flow_with_edges("promo", "contains:promo")
+    assert target(flow, "PROMO ") == "t0"
+    assert target(flow, "tem promo?") == "t1"
+
+
+def test_router_duplicate_keywords_keep_first_position():
+    flow = flow_with_edges("in:a|b", "b", "")
+    assert target(flow, "b") == "t0"
+
+
+def test_router_fallback_is_first_default_edge_regardless_of_position():
+    flow = flow_with_edges("", "sim", "")
+    assert target(flow, "sim") == "t1"
+    assert target(flow, "não") == "t0"
+
+
+def test_router_without_default_returns_none():
+    flow = flow_with_edges("sim", "> 10")
+    assert target(flow, "5") is None
+    assert target(flow, "11") == "t1"
+
+
+def test_router_variable_conditions():
+    flow = flow_with_edges("{{idade}} >= 18", "{{idade}} isset", "")
+    assert target(flow, "x", {"idade": "30"}) == "t0"
+    assert target(flow, "x", {"idade": "12"}) == "t1"
+    assert target(flow, "x", {}) == "t2"
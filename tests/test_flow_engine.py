@@ -0,0 +1,178 @@
+# tests/test_flow_engine.py
+# Execução dos fluxos pelo FlowEngine.walk/resume em fluxos pequenos montados em memória.
+import json
+
+import pytest
+
+import flow_engine
+from flow_engine import FlowEngine
+from flow_graph import TIMEOUT_HANDLE, compile_flow
+
+NOW = 1000.0
+
+
+def make_flow(flow_id, nodes: list, edges: list, version: str = "v1"):
+    """nodes: [(id, tipo, data)]; edges: [(origem, destino)] ou [(origem, destino, sourceHandle)]."""
+    elements = {
+        "nodes": [{"id": node_id, "type": node_type, "data": data} for node_id, node_type, data in nodes],
+        "edges": [{"id": f"e{i}", "source": edge[0], "target": edge[1], "sourceHandle": edge[2] if len(edge) > 2 else None}
+                  for i, edge in enumerate(edges)],
+    }
+    return compile_flow(flow_id, f"Fluxo {flow_id}", elements, version=version)
+
+
+def texts(result) -> list:
+    return [json.loads(payload).get("text") for payload in result.payloads]
+
+
+def visited(result) -> list:
+    return [node_id for _, _, node_id in result.path]
+
+
+@pytest.fixture(autouse=True)
+def frozen_time(monkeypatch):
+    monkeypatch.setattr(flow_engine.time, "time", lambda: NOW)
+
+
+def test_walks_message_nodes_until_the_end():
+    flow = make_flow(1, [("start-node", "input", {}), ("oi", "textMessage", {"text": "Olá {{nome}}"}),
+                         ("fim", "textMessage", {"text": "Até mais"})],
+                     [("start-node", "oi"), ("oi", "fim")])
+    result = FlowEngine(lambda flow_id: None).walk(flow, flow.start_node_id, {"nome": "Ana"})
+    assert texts(result) == ["Olá Ana", "Até mais"]
+    assert result.node_id is None
+    assert result.path == [(1, "v1", "start-node"), (1, "v1", "oi"), (1, "v1", "fim")]
+    assert result.steps == 3
+
+
+def test_stops_at_node_waiting_for_user_choice():
+    flow = make_flow(1, [("start-node", "input", {}),
+                         ("menu", "buttonMessage", {"text": "Escolha", "buttons": [{"id": "a", "text": "A"}]}),
+                         ("a", "textMessage", {"text": "A"})],
+                     [("start-node", "menu"), ("menu", "a")])
+    result = FlowEngine(lambda flow_id: None).walk(flow, "start-node", {})
+    assert texts(result) == ["Escolha"]
+    assert result.node_id == "menu"
+    assert result.resume_at is None and result.timeout_at is None
+
+
+@pytest.mark.parametrize("plano, expected", [("pro", "Plano pro"), ("basico", "Outro plano")])
+def test_set_variable_and_condition_branches(plano, expected):
+    flow = make_flow(1, [("start-node", "input", {}),
+                         ("set", "setVariable", {"variableName": "plano", "value": "{{escolha}}"}),
+                         ("cond", "condition", {"variableName": "plano", "comparison": "equals", "value": "pro"}),
+                         ("sim", "textMessage", {"text": "Plano pro"}), ("nao", "textMessage", {"text": "Outro plano"})],
+                     [("start-node", "set"), ("set", "cond"), ("cond", "sim", "source-true"), ("cond", "nao", "source-false")])
+    variables = {"escolha": plano}
+    result = FlowEngine(lambda flow_id: None).walk(flow, "start-node", variables)
+    assert texts(result) == [expected]
+    assert variables == {"escolha": plano, "plano": plano}
+    assert result.node_id is None
+
+
+def test_delay_pauses_and_resume_continues():
+    flow = make_flow(1, [("start-node", "input", {}), ("antes", "textMessage", {"text": "Antes"}),
+                         ("espera", "delay", {"duration": "2", "unit": "minutes"}), ("depois", "textMessage", {"text": "Depois"})],
+                     [("start-node", "antes"), ("antes", "espera"), ("espera", "depois")])
+    engine = FlowEngine(lambda flow_id: None)
+    result = engine.walk(flow, "start-node", {})
+    assert texts(result) == ["Antes"]
+    assert result.node_id == "espera"
+    assert result.resume_at == NOW + 120
+    resumed = engine.resume(flow, "espera", {})
+    assert texts(resumed) == ["Depois"]
+    assert resumed.node_id is None
+
+
+def test_zero_delay_does_not_pause():
+    flow = make_flow(1, [("start-node", "delay", {"duration": "0"}), ("fim", "textMessage", {"text": "Fim"})],
+                     [("start-node", "fim")])
+    result = FlowEngine(lambda flow_id: None).walk(flow, "start-node", {})
+    assert texts(result) == ["Fim"]
+    assert result.resume_at is None
+
+
+def test_wait_input_timeout_is_scheduled_and_followed():
+    flow = make_flow(1, [("start-node", "input", {}),
+                         ("pergunta", "waitInput", {"message": "Qual seu nome?", "variableName": "nome", "timeoutSeconds": "30"}),
+                         ("resposta", "textMessage", {"text": "Obrigado"}), ("sumiu", "textMessage", {"text": "Tempo esgotado"})],
+                     [("start-node", "pergunta"), ("pergunta", "resposta"), ("pergunta", "sumiu", TIMEOUT_HANDLE)])
+    engine = FlowEngine(lambda flow_id: None)
+    result = engine.walk(flow, "start-node", {})
+    assert texts(result) == ["Qual seu nome?"]
+    assert result.node_id == "pergunta"
+    assert result.timeout_at == NOW + 30
+    timed_out = engine.resume(flow, "pergunta", {}, timed_out=True)
+    assert texts(timed_out) == ["Tempo esgotado"]
+    assert timed_out.node_id is None
+
+
+def test_wait_input_without_timeout_edge_has_no_timer():
+    flow = make_flow(1, [("pergunta", "waitInput", {"timeoutSeconds": "30"}), ("fim", "textMessage", {"text": "Fim"})],
+                     [("pergunta", "fim")])
+    engine = FlowEngine(lambda flow_id: None)
+    result = engine.walk(flow, "pergunta", {})
+    assert result.node_id == "pergunta"
+    assert result.timeout_at is None
+    assert result.payloads == []
+    assert engine.resume(flow, "pergunta", {}, timed_out=True).node_id is None
+
+
+def test_go_to_flow_continues_at_target_start_node():
+    destino = make_flow(2, [("start-node", "input", {}), ("oi", "textMessage", {"text": "Fluxo 2"})],
+                        [("start-node", "oi")], version="v2")
+    origem = make_flow(1, [("start-node", "input", {}), ("pula", "goToFlow", {"targetFlowId": 2})],
+                       [("start-node", "pula")])
+    result = FlowEngine({2: destino}.get).walk(origem, "start-node", {})
+    assert texts(result) == ["Fluxo 2"]
+    assert result.flow is destino
+    assert result.node_id is None
+    assert result.path == [(1, "v1", "start-node"), (1, "v1", "pula"), (2, "v2", "start-node"), (2, "v2", "oi")]
+
+
+def test_go_to_inactive_flow_ends_session():
+    flow = make_flow(1, [("start-node", "input", {}), ("pula", "goToFlow", {"targetFlowId": 99})], [("start-node", "pula")])
+    result = FlowEngine({}.get).walk(flow, "start-node", {})
+    assert result.flow is flow
+    assert result.node_id is None
+
+
+def test_api_call_stops_without_running_next_nodes():
+    flow = make_flow(1, [("start-node", "input", {}), ("api", "apiCall", {"url": "http://exemplo"}),
+                         ("depois", "textMessage", {"text": "Depois"})],
+                     [("start-node", "api"), ("api", "depois")])
+    result = FlowEngine(lambda flow_id: None).walk(flow, "start-node", {})
+    assert result.payloads == []
+    assert result.node_id == "api"
+    assert visited(result) == ["start-node", "api"]
+
+
+@pytest.mark.parametrize("node_type, data, expected", [
+    ("endFlow", {}, []),
+    ("assignAgent", {"message": "Transferindo para um atendente"}, ["Transferindo para um atendente"]),
+])
+def test_ending_nodes_close_session(node_type, data, expected):
+    flow = make_flow(1, [("start-node", "input", {}), ("fim", node_type, data), ("nunca", "textMessage", {"text": "Nunca"})],
+                     [("start-node", "fim"), ("fim", "nunca")])
+    result = FlowEngine(lambda flow_id: None).walk(flow, "start-node", {})
+    assert texts(result) == expected
+    assert result.node_id is None
+
+
+def test_loop_with_same_variables_is_detected():
+    flow = make_flow(1, [("a", "textMessage", {"text": "A"}), ("b", "textMessage", {"text": "B"})],
+                     [("a", "b"), ("b", "a")])
+    result = FlowEngine(lambda flow_id: None).walk(flow, "a", {})
+    assert texts(result) == ["A", "B"]
+    assert result.node_id is None
+    assert visited(result) == ["a", "b"]
+
+
+def test_max_steps_ends_loop_that_changes_variables():
+    flow = make_flow(1, [("conta", "setVariable", {"variableName": "n", "value": "{{n}}x"}), ("volta", "tagContact", {"tagName": "t"})],
+                     [("conta", "volta"), ("volta", "conta")])
+    variables = {}
+    result = FlowEngine(lambda flow_id: None, max_steps=5).walk(flow, "conta", variables)
+    assert result.steps == 5
+    assert result.node_id is None
+    assert variables == {"n": "xxx"}
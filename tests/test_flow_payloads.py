@@ -0,0 +1,26 @@
+# tests/test_flow_payloads.py
+# Payloads pré-serializados dos nós (NodePayload) e interpolação de {{variáveis}}.
+import json
+
+from flow_payloads import NodePayload
+
+
+def test_payload_without_variables_matches_json_dumps():
+    data = {"text": "Olá, tudo bem? 😀"}
+    payload = NodePayload(data)
+    assert not payload.is_template
+    assert payload.render() == json.dumps(data).encode("ascii")
+
+
+def test_non_ascii_variable_name_is_interpolated():
+    payload = NodePayload({"text": "Olá {{variável}}, seu plano é {{ plano }}."})
+    assert payload.variables == ("variável", "plano")
+    rendered = payload.render({"variável": "José", "plano": "Básico"})
+    assert rendered.isascii()
+    assert json.loads(rendered) == {"text": "Olá José, seu plano é Básico."}
+
+
+def test_variable_values_are_escaped_and_missing_are_empty():
+    payload = NodePayload({"text": "Oi {{nome}}{{sobrenome}}!"})
+    assert payload.render_data({"nome": 'Zé "aspas"\\\n'}) == {"text": 'Oi Zé "aspas"\\\n!'}
+    assert payload.render_data({}) == {"text": "Oi !"}
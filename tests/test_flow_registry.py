@@ -0,0 +1,62 @@
+# tests/test_flow_registry.py
+# Versões e recompilação dos fluxos ativos no FlowRegistry (banco SQLite temporário).
+import json
+import sqlite3
+
+import pytest
+
+from flow_registry import FlowRegistry
+
+ELEMENTS = {"nodes": [{"id": "start-node", "type": "input", "data": {}},
+                      {"id": "oi", "type": "textMessage", "data": {"text": "Oi"}}],
+            "edges": [{"id": "e0", "source": "start-node", "target": "oi"}]}
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / "flows.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE flows (id INTEGER PRIMARY KEY, name TEXT, campaign_id TEXT, status TEXT, elements TEXT, updated_at TEXT)")
+    conn.execute("INSERT INTO flows VALUES (1, 'Fluxo', NULL, 'active', ?, '2026-01-01 00:00:00')", (json.dumps(ELEMENTS),))
+    conn.commit()
+    conn.close()
+    return path
+
+
+def update_elements(path: str, elements_json: str):
+    """Edição no mesmo segundo: updated_at não muda."""
+    with sqlite3.connect(path) as conn:
+        conn.execute("UPDATE flows SET elements = ? WHERE id = 1", (elements_json,))
+
+
+def test_same_second_edit_is_detected_by_poll(database):
+    registry = FlowRegistry(database)
+    registry.refresh()
+    old_version = registry.get(1).version
+    elements = dict(ELEMENTS, nodes=[ELEMENTS["nodes"][0], {"id": "oi", "type": "textMessage", "data": {"text": "Olá"}}])
+    update_elements(database, json.dumps(elements))
+    assert registry.poll()
+    flow = registry.get(1)
+    assert flow.version != old_version
+    assert registry.get_version(1, old_version) is not None  # Fixada para as sessões em andamento
+
+
+def test_broken_edit_is_reported_and_previous_version_keeps_serving(database):
+    registry = FlowRegistry(database)
+    registry.refresh()
+    old_version = registry.get(1).version
+    update_elements(database, "{broken")
+    registry.refresh(force=True)
+    assert registry.failed_flow_ids() == [1]
+    assert registry.get(1).version == old_version
+    update_elements(database, json.dumps(ELEMENTS))
+    registry.refresh(force=True)
+    assert registry.failed_flow_ids() == []
+
+
+def test_broken_flow_never_compiled_is_reported(database):
+    update_elements(database, "{broken")
+    registry = FlowRegistry(database)
+    registry.refresh()
+    assert registry.get(1) is None
+    assert registry.failed_flow_ids() == [1]
@@ -0,0 +1,73 @@
+# tests/test_llm_batching.py
+# Geração em lote do llm_server: a saída de uma requisição não depende dos vizinhos de lote.
+# Usa um Llama minúsculo com pesos aleatórios e tokenizer de palavras montados em memória.
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+tokenizers = pytest.importorskip("tokenizers")
+
+os.environ.setdefault("LLM_RESPONSE_CACHE", "0")  # Sem llm_cache.db na árvore
+import llm_server
+from llm_server import GenerateRequest
+
+VOCAB_WORDS = 200
+CONTEXT_SIZE = 48
+
+
+@pytest.fixture(scope="module")
+def tiny_model():
+    vocab = {"<unk>": 0, "<s>": 1, "</s>": 2, "<pad>": 3, **{f"w{i}": i + 4 for i in range(VOCAB_WORDS)}}
+    backend = tokenizers.Tokenizer(tokenizers.models.WordLevel(vocab, unk_token="<unk>"))
+    backend.pre_tokenizer = tokenizers.pre_tokenizers.Whitespace()
+    tokenizer = transformers.PreTrainedTokenizerFast(tokenizer_object=backend, unk_token="<unk>", bos_token="<s>",
+                                                     eos_token="</s>", pad_token="<pad>")
+    tokenizer.padding_side = "left"
+    torch.manual_seed(0)
+    config = transformers.LlamaConfig(vocab_size=len(vocab), hidden_size=64, intermediate_size=128, num_hidden_layers=2,
+                                      num_attention_heads=4, max_position_embeddings=128, bos_token_id=1, eos_token_id=2,
+                                      pad_token_id=3)
+    model = transformers.LlamaForCausalLM(config).eval()
+    return model, tokenizer
+
+
+@pytest.fixture
+def server(tiny_model, monkeypatch):
+    model, tokenizer = tiny_model
+    monkeypatch.setattr(llm_server, "model", model)
+    monkeypatch.setattr(llm_server, "tokenizer", tokenizer)
+    monkeypatch.setattr(llm_server, "DEVICE", torch.device("cpu"))
+    monkeypatch.setattr(llm_server, "DEFAULT_CONTEXT_SIZE", CONTEXT_SIZE)
+    monkeypatch.setattr(llm_server, "prefix_cache", None)
+    return llm_server
+
+
+def greedy(prompt: str, max_new_tokens: int) -> GenerateRequest:
+    return GenerateRequest(prompt=prompt, max_new_tokens=max_new_tokens, do_sample=False, repetition_penalty=1.0)
+
+
+def prompt_of(words: int, offset: int = 0) -> str:
+    return " ".join(f"w{(offset + i * 7) % VOCAB_WORDS}" for i in range(words))
+
+
+def test_requests_with_different_max_new_tokens_are_not_batched_together(server):
+    short, long = greedy(prompt_of(10), 8), greedy(prompt_of(10), 32)
+    assert server._batch_key(short) != server._batch_key(long)
+    assert server._batch_key(short) == server._batch_key(greedy(prompt_of(20, 3), 8))
+
+
+def test_batched_greedy_output_matches_solo(server):
+    # O prompt longo passa do contexto e é truncado; o curto entra no lote com padding à esquerda
+    requests = [greedy(prompt_of(100), 8), greedy(prompt_of(12, 5), 8), greedy(prompt_of(30, 11), 8)]
+    solo = [server._run_generation_batch([request])[0] for request in requests]
+    assert server._run_generation_batch(requests) == solo
+    assert all(solo)
+
+
+def test_each_prompt_keeps_its_own_context_budget(server):
+    # Mesmo num lote com max_new_tokens diferentes, o prompt longo não é cortado pelo maior valor
+    requests = [greedy(prompt_of(100), 8), greedy(prompt_of(12, 5), 32)]
+    solo = [server._run_generation_batch([request])[0] for request in requests]
+    assert server._run_generation_batch(requests) == solo
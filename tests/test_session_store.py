@@ -0,0 +1,73 @@
+# tests/test_session_store.py
+# Backends de sessão: duas instâncias do SQLiteSessionStore no mesmo banco simulam dois workers.
+import threading
+
+import pytest
+
+from session_store import MemorySessionStore, SessionBatch, SQLiteSessionStore
+
+
+@pytest.fixture
+def database(tmp_path):
+    return str(tmp_path / "sessions.db")
+
+
+def test_write_through_is_visible_to_other_workers(database):
+    a, b = SQLiteSessionStore(database), SQLiteSessionStore(database)
+    a.set("x", {"node_id": "menu"})
+    assert b.get("x") == {"node_id": "menu"}
+    a.delete("x")
+    assert b.get("x") is None
+
+
+def test_write_behind_is_only_visible_after_flush(database):
+    a = SQLiteSessionStore(database, flush_interval=3600)
+    b = SQLiteSessionStore(database)
+    try:
+        a.set("x", {"node_id": "menu"})
+        assert a.get("x") == {"node_id": "menu"}
+        assert b.get("x") is None
+        a.flush()
+        assert b.get("x") == {"node_id": "menu"}
+    finally:
+        a.close()
+
+
+def test_sender_transaction_serializes_read_modify_write_between_workers(database):
+    stores = [SQLiteSessionStore(database), SQLiteSessionStore(database)]
+
+    def increment(store):
+        for _ in range(50):
+            with store.sender_transaction("x"):
+                state = store.get("x") or {"count": 0}
+                store.set("x", {"count": state["count"] + 1})
+
+    threads = [threading.Thread(target=increment, args=(store,)) for store in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert stores[0].get("x") == {"count": 100}
+
+
+def test_sender_transaction_rolls_back_on_error(database):
+    store = SQLiteSessionStore(database)
+    store.set("x", {"node_id": "inicio"})
+    with pytest.raises(RuntimeError):
+        with store.sender_transaction("x"):
+            store.set("x", {"node_id": "menu"})
+            raise RuntimeError("falha no processamento")
+    assert SQLiteSessionStore(database).get("x") == {"node_id": "inicio"}
+
+
+def test_session_batch_reads_its_own_changes():
+    store = MemorySessionStore()
+    store.set("x", {"node_id": "inicio"})
+    batch = SessionBatch(store)
+    batch.set("x", {"node_id": "menu"})
+    batch.delete("y")
+    assert batch.get("x") == {"node_id": "menu"}
+    assert store.get("x") == {"node_id": "inicio"}
+    batch.commit()
+    assert store.get("x") == {"node_id": "menu"}
+    assert not batch.changes